@@ -1,4 +1,4 @@
-from quart import Quart, request, render_template, send_from_directory, abort, url_for, jsonify, send_file
+from quart import Quart, Response, request, render_template, send_from_directory, abort, url_for, jsonify, send_file
 from werkzeug.exceptions import BadRequest
 import os
 import aiosqlite
@@ -6,12 +6,19 @@ from datetime import datetime
 import asyncio
 import sqlite3
 import json
-from orchestrator import TaskOrchestrator
-from operations import OPERATIONS
-import pydot
-import aiofiles
+from orchestrator import TaskOrchestrator, base_task_id, mapped_parent_key
+from operations import OPERATIONS, RESOURCES
 from asgiref.wsgi import WsgiToAsgi
-from otel_config import configure_opentelemetry, get_tracer, get_meter
+from otel_config import configure_opentelemetry, shutdown_opentelemetry, get_tracer, get_meter
+from metrics_registry import REGISTRY, CONTENT_TYPE, LoopLagMonitor
+from loop_watchdog import LoopWatchdog, WATCHDOG_ENABLED
+from run_history import list_runs, get_run, run_stats, parse_time, DEFAULT_TENANT
+from retention import RetentionManager
+import dag_storage
+from artifact_store import ArtifactStore
+from value_codec import decode_value, redact_params
+import tempfile
+import hashlib
 import logging
 
 logger = logging.getLogger("taskflow")
@@ -25,8 +32,6 @@ if not logger.hasHandlers():
     logger.addHandler(console_handler)
 
 
-configure_opentelemetry(service_name="taskflow")
-
 tracer = get_tracer("taskflow")
 meter = get_meter("taskflow")
 api_cli_req_counter = meter.create_counter("api_cli_req_counter")
@@ -35,7 +40,56 @@ api_web_req_counter = meter.create_counter("api_web_req_counter")
 app = Quart(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DAGS_DIR = os.path.join(BASE_DIR, 'dags')
+ARTIFACTS_DIR = os.getenv("TASKFLOW_ARTIFACTS_DIR", os.path.join(BASE_DIR, 'artifacts'))
 DB_PATH = os.path.join(BASE_DIR, 'orchestrator.db')
+# watchdog дополнительно ловит синхронный код, блокирующий loop (TASKFLOW_WATCHDOG=0 - только замер задержки)
+loop_lag_monitor = LoopWatchdog() if WATCHDOG_ENABLED else LoopLagMonitor()
+retention_manager = None
+
+
+@app.before_serving
+async def setup_telemetry():
+    """
+    настройка OpenTelemetry при старте сервера, а не при импорте модуля
+    """
+    global retention_manager
+    configure_opentelemetry(service_name="taskflow")
+    loop_lag_monitor.start()
+    # уборка старых запусков и брошенных файлов userdata_buffer в фоне
+    retention_manager = RetentionManager(DB_PATH, DAGS_DIR, artifacts_root=ARTIFACTS_DIR)
+    retention_manager.start()
+
+
+@app.after_serving
+async def close_resources():
+    """
+    закрытие теплых ресурсов операций (HTTP-сессии, модели) и выгрузка остатков телеметрии
+    """
+    await loop_lag_monitor.stop()
+    if retention_manager is not None:
+        await retention_manager.stop()
+    await RESOURCES.aclose()
+    await asyncio.to_thread(shutdown_opentelemetry)
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    """
+    метрики оркестратора в формате Prometheus
+    """
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
+def with_tenant(config):
+    """
+    конфиг с tenant запуска для честной очереди задач: заголовок X-TaskFlow-Tenant,
+    поле tenant конфига (бот ставит tg:<chat_id>) или хэш заголовка X-API-Key
+    """
+    tenant = request.headers.get("X-TaskFlow-Tenant") or config.get("tenant")
+    api_key = request.headers.get("X-API-Key")
+    if not tenant and api_key:
+        tenant = "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return {**config, "tenant": tenant or DEFAULT_TENANT}
 
 
 # "/api/cli" logic
@@ -48,6 +102,7 @@ async def run_cli():
     config = await request.get_json()
     if not config:
         raise BadRequest("JSON body is required")
+    config = with_tenant(config)
 
     try:
         orchestrator = TaskOrchestrator(
@@ -55,11 +110,11 @@ async def run_cli():
             operations=OPERATIONS,
         )
         dag_id = orchestrator.dag_id
-        await orchestrator.execute_dag(recovery_mode=False)
+        dag_result = await orchestrator.execute_dag(recovery_mode=False)
         with tracer.start_as_current_span(f"dag.run") as span:
             span.set_attribute("dag.id", dag_id)
             logger.info(f"DAG {dag_id} по ручке /api/cli запущен")
-        return await send_from_directory(DAGS_DIR, f"{dag_id}.zip", as_attachment=True)
+        return await dag_zip_response(dag_result["dag_id"])
     except Exception as e:
 
         return {"error": str(e)}, 500
@@ -80,20 +135,52 @@ def db_connect():
     return conn
 
 
-async def load_dag_config(dag_id: str):
+def artifact_store():
     """
-    загрузчик конфига по id
+    хранилище артефактов, в которое оркестратор переносит файлы завершенных запусков
+    """
+    return ArtifactStore(DB_PATH, ARTIFACTS_DIR)
+
+
+def read_dag_file_sync(dag_id: str, name: str):
+    """
+    файл запуска: из хранилища артефактов, а для выполняющихся и старых запусков - из папки или zip
     """
-    dag_path = os.path.join(DAGS_DIR, dag_id)
-    config_path = os.path.join(dag_path, "config.json")
+    if not dag_storage.is_dag_id(dag_id):
+        return None
+    content = artifact_store().read(dag_id, os.path.basename(name))
+    if content is None:
+        content = dag_storage.read_member(dag_id, name, DAGS_DIR)
+    return content
+
 
-    if not os.path.exists(config_path):
+def locate_dag_file_sync(dag_id: str, name: str):
+    """
+    путь к файлу запуска на диске: блоб хранилища артефактов или файл в папке выполняющегося запуска
+    """
+    if not dag_storage.is_dag_id(dag_id):
         return None
-    async with aiofiles.open(config_path, 'r') as f:
-        content = await f.read()
-        output = json.loads(content)
+    path = artifact_store().file_path(dag_id, os.path.basename(name))
+    if path is None:
+        path = dag_storage.member_path(dag_id, name, DAGS_DIR)
+    return path
+
+
+def decode_task_value(stored):
+    """
+    params/result из таблицы запуска: JSON, сжатое значение или ссылка на хранилище артефактов
+    """
+    return decode_value(stored, artifact_store().read_blob)
+
 
-        return json.loads(content)
+async def load_dag_config(dag_id: str):
+    """
+    загрузчик конфига по id
+    """
+    content = await asyncio.to_thread(read_dag_file_sync, dag_id, "config.json")
+    if content is None:
+        return None
+    return json.loads(content)
 
 
 
@@ -101,26 +188,85 @@ async def load_dag_results(dag_id: str):
     """
     асинхронный загрузчик результатов
     """
-    results_path = os.path.join(DAGS_DIR, dag_id, 'results.json')
-    if os.path.exists(results_path):
-        async with aiofiles.open(results_path, 'r') as f:
-            content = await f.read()
-            return json.loads(content)
-    return {}
+    content = await asyncio.to_thread(read_dag_file_sync, dag_id, 'results.json')
+    if content is None:
+        return {}
+    return json.loads(content)
 
 
-async def is_dag_complete(dag_id):
-    zip_path = os.path.join(DAGS_DIR, f"{dag_id}.zip")
-    if os.path.exists(zip_path):
+def is_dag_complete_sync(dag_id):
+    if not dag_storage.is_dag_id(dag_id):
+        return False
+    if artifact_store().has_run(dag_id):
         return True
-    return False
+    _, zip_path = dag_storage.locate(dag_id, DAGS_DIR)
+    return zip_path is not None
 
 
+async def is_dag_complete(dag_id):
+    return await asyncio.to_thread(is_dag_complete_sync, dag_id)
+
+
+async def dag_zip_response(dag_id: str):
+    """
+    zip запуска, собранный из хранилища артефактов во временный файл (или готовый zip старого запуска)
+    """
+    if not dag_storage.is_dag_id(dag_id):
+        abort(404)
+    archive = tempfile.TemporaryFile()
+    if not await asyncio.to_thread(artifact_store().write_zip, dag_id, archive):
+        archive.close()
+        _, zip_path = dag_storage.locate(dag_id, DAGS_DIR)
+        if zip_path is None:
+            abort(404)
+        return await send_file(zip_path, as_attachment=True)
+
+    size = await asyncio.to_thread(archive.seek, 0, os.SEEK_END)
+    await asyncio.to_thread(archive.seek, 0)
+
+    async def body():
+        try:
+            while chunk := await asyncio.to_thread(archive.read, 1024 * 1024):
+                yield chunk
+        finally:
+            archive.close()
+
+    return Response(body(), mimetype="application/zip", headers={
+        "Content-Disposition": f"attachment; filename={dag_id}.zip",
+        "Content-Length": str(size),
+    })
+
+
+
+def summarize_statuses(statuses):
+    """
+    общий статус и подпись узла для одного или нескольких экземпляров задачи
+    """
+    if len(statuses) == 1:
+        return statuses[0], statuses[0]
+
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    if counts.get("failed"):
+        status = "failed"
+    elif counts.get("completed") == len(statuses):
+        status = "completed"
+    elif counts.get("running") or counts.get("completed"):
+        status = "running"
+    else:
+        status = "pending"
+    label = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items())) + f" / {len(statuses)}"
+    return status, label
+
 
 async def generate_dag_graph(dag_id, config):
     """
     генерация SVG-графа с pydot
     """
+    # pydot (и pyparsing) нужен только для страницы DAG - не грузим его на старте
+    import pydot
+
     graph = pydot.Dot(graph_type='digraph', rankdir='LR')
     conn = db_connect()
     cursor = conn.cursor()
@@ -128,19 +274,29 @@ async def generate_dag_graph(dag_id, config):
     with conn:
 
         config = dict(config)
+        # экземпляры одной задачи (sweep, map_params) сворачиваются в один узел
+        statuses = {}
+        cursor.execute(f"SELECT task_id, status FROM {dag_id}")
+        rows = cursor.fetchall()
+        expanded = {mapped_parent_key(task_id) for task_id, _ in rows if "[" in task_id}
+        for task_id, status in rows:
+            if task_id in expanded:
+                continue
+            statuses.setdefault(base_task_id(task_id), []).append(status)
+
         for task in config["tasks"]:
-            cursor.execute(f"SELECT status FROM {dag_id} WHERE task_id = ?", (task["id"],))
-            row = cursor.fetchone()
-            status = row[0] if row else "pending"
+            task_statuses = statuses.get(task["id"], ["pending"])
+            status, label = summarize_statuses(task_statuses)
             color = "green" if status == "completed" else "lightblue" if status == "running" else "white" if status == "pending" else "red"
-            node = pydot.Node(task["id"], shape='box', style='filled', fillcolor=color,
-                              label=task['id'] + f"\n({status})")
+            shape = 'box3d' if task.get('map_params') else 'box'
+            node = pydot.Node(task["id"], shape=shape, style='filled', fillcolor=color,
+                              label=task['id'] + f"\n({label})")
             task_nodes[task['id']] = node
             graph.add_node(node)
     for task in config['tasks']:
         for dep in task['dependencies']:
             has_data_dep = False
-            for dep_param in task['dependent_params'].values():
+            for dep_param in list(task['dependent_params'].values()) + list(task.get('map_params', {}).values()):
                 if dep in dep_param:
                     has_data_dep = True
                     break
@@ -162,6 +318,7 @@ async def api_web():
     api_web_req_counter.add(1)
     if not config or 'dag_name' not in config:
         return jsonify({'error': 'Invalid config'}), 400
+    config = with_tenant(config)
 
     try:
         orchestrator = TaskOrchestrator(
@@ -181,6 +338,61 @@ async def api_web():
         return {"error": str(e)}, 500
 
 
+def history_filters():
+    """
+    фильтры истории запусков из query string
+    """
+    args = request.args
+    return {
+        "dag_name": args.get("dag_name"),
+        "graph_id": args.get("graph_id"),
+        "tenant": args.get("tenant"),
+        "since": parse_time(args.get("since")),
+        "until": parse_time(args.get("until")),
+    }
+
+
+@app.route('/api/runs')
+async def api_runs():
+    """
+    история запусков: ?dag_name=&graph_id=&tenant=&status=&since=&until=&limit=&cursor=
+    """
+    try:
+        page = await list_runs(
+            DB_PATH,
+            **history_filters(),
+            status=request.args.get("status"),
+            limit=request.args.get("limit", 50, type=int),
+            cursor=request.args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
+
+
+@app.route('/api/runs/stats')
+async def api_runs_stats():
+    """
+    успешность и перцентили длительности запусков и задач по сводным таблицам
+    """
+    try:
+        stats = await run_stats(DB_PATH, **history_filters())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(stats)
+
+
+@app.route('/api/runs/<dag_id>')
+async def api_run(dag_id):
+    """
+    один запуск с его задачами
+    """
+    run = await get_run(DB_PATH, dag_id)
+    if run is None:
+        abort(404)
+    return jsonify(run)
+
+
 @app.route('/dag_ui/<dag_id>')
 async def dag_ui(dag_id):
     config = await load_dag_config(dag_id)
@@ -206,26 +418,48 @@ async def dag_ui(dag_id):
 
 @app.route("/dag_ui/<dag_id>/<task_id>")
 async def task_details(dag_id, task_id):
+    if not dag_storage.is_dag_id(dag_id):
+        abort(404)
     conn = db_connect()
     cursor = conn.cursor()
     with conn:
-        cursor.execute(
-            f"SELECT status, result, error, params, retry_count FROM {dag_id} WHERE task_id = ?", (task_id,))
+        # SELECT * + имена колонок: в таблицах старых запусков нет колонки timings
+        try:
+            cursor.execute(f"SELECT * FROM {dag_id} WHERE task_id = ?", (task_id,))
+        except sqlite3.OperationalError:
+            # таблица удалена уборкой (retention.py)
+            abort(404)
+        columns = [column[0] for column in cursor.description]
         row = cursor.fetchall()
-        db_row = row[0] if row else None
+        db_row = dict(zip(columns, row[0])) if row else None
+        # экземпляры задачи (sweep, map_params) показываются свернутым списком
+        cursor.execute(f"SELECT task_id, status FROM {dag_id}")
+        instances = [
+            {'id': key, 'status': instance_status, 'link': url_for('task_details', dag_id=dag_id, task_id=key)}
+            for key, instance_status in cursor.fetchall()
+            if key != task_id and base_task_id(key) == task_id
+        ]
 
     if db_row:
-        status = db_row[0]
-        result = json.loads(db_row[1]) if db_row[1] else {}
-        error = db_row[2]
-        params = json.loads(db_row[3]) if db_row[3] else {}
-        retry_count = db_row[4]
+        status = db_row['status']
+        result = decode_task_value(db_row['result']) or {}
+        error = db_row['error']
+        params = decode_task_value(db_row['params']) or {}
+        retry_count = db_row['retry_count']
+        timings = json.loads(db_row['timings']) if db_row.get('timings') else {}
     else:
         status = 'pending'
         result = {}
         error = None
         params = {}
         retry_count = 0
+        timings = {}
+    if not params:
+        # параметры сохраняются вместе с итогом экземпляра; до него показываем параметры из конфига
+        config = await load_dag_config(dag_id) or {}
+        for task in config.get('tasks', []):
+            if task['id'] == base_task_id(task_id):
+                params = redact_params(task.get('independent_params', {}))
     if result:
         output_file = result.get('output_file_path', None)
         download_link = url_for('download_file', dag_id=dag_id,
@@ -240,26 +474,46 @@ async def task_details(dag_id, task_id):
         status=status,
         error=error,
         retry_count=retry_count,
-        download_link=download_link
+        download_link=download_link,
+        instances=instances,
+        timings=timings
     )
 
 
 @app.route('/download/<dag_id>/<filename>')
 async def download_file(dag_id, filename):
-    dag_dir = os.path.join(DAGS_DIR, dag_id)
-    return await send_from_directory(dag_dir, filename, as_attachment=True)
+    # файлы бывают в несколько ГБ - отдаются с диска по частям, не читаясь в память
+    name = os.path.basename(filename)
+    path = await asyncio.to_thread(locate_dag_file_sync, dag_id, filename)
+    if path is not None:
+        return await send_file(path, as_attachment=True, attachment_filename=name)
+
+    # старый запуск, упакованный в zip
+    member = await asyncio.to_thread(dag_storage.open_zip_member, dag_id, filename, DAGS_DIR)
+    if member is None:
+        abort(404)
+
+    async def body():
+        try:
+            while chunk := await asyncio.to_thread(member.read, 1024 * 1024):
+                yield chunk
+        finally:
+            member.close()
+
+    return Response(body(), mimetype="application/octet-stream", headers={
+        "Content-Disposition": f"attachment; filename={name}",
+    })
 
 
 @app.route('/download_zip/<dag_id>')
 async def download_zip(dag_id):
-    zip_path = os.path.join(DAGS_DIR, f"{dag_id}.zip")
-    if not os.path.exists(zip_path):
-        abort(404)
-    return await send_from_directory(DAGS_DIR, f"{dag_id}.zip", as_attachment=True)
+    return await dag_zip_response(dag_id)
 
 
 if __name__ == "__main__":
     os.makedirs("./results", exist_ok=True)
     import uvicorn
 
-    uvicorn.run("app:app", host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
+    # автоперезагрузка заново импортирует приложение на каждое изменение - только для разработки
+    reload = os.getenv("TASKFLOW_RELOAD", "0") == "1"
+    uvicorn.run("app:app", host="0.0.0.0", port=5000, reload=reload)
\ No newline at end of file
@@ -0,0 +1,303 @@
+"""
+Хранилище артефактов с адресацией по содержимому.
+
+Каждый файл хранится один раз: artifacts/sha256/ab/cd/<sha256>. Запуск ссылается
+на блобы через манифест run_artifacts (dag_id, имя файла -> хэш), а в таблице
+artifacts у блоба хранится число ссылок. Zip запуска собирается из блобов по
+запросу (write_zip). Блобы без ссылок удаляет collect_garbage.
+
+Большие параметры и результаты задач (value_codec.py) тоже хранятся блобами: в
+манифесте они записаны под именами с префиксом VALUE_PREFIX ("_values/...") и не
+попадают в zip и список файлов запуска.
+
+Порядок операций исключает гонку с уборкой: ingest_run сначала увеличивает
+счетчики ссылок и только потом кладет файлы, а collect_garbage удаляет файлы
+внутри своей транзакции, поэтому ingest либо видит живой блоб со ссылкой, либо
+ждет конца уборки и кладет файл заново.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from metrics_registry import ARTIFACT_BYTES
+from operations.file_ops import digest_file, fast_copy, move_file
+
+logger = logging.getLogger("taskflow")
+
+ARTIFACTS_ROOT = os.getenv("TASKFLOW_ARTIFACTS_DIR", "./artifacts")
+# сколько блобов удаляется одной транзакцией уборки
+GC_BATCH = 500
+# имена значений задач в манифесте (не файлы запуска)
+VALUE_PREFIX = "_values/"
+_FILES_ONLY = "AND name NOT LIKE '\\_values/%' ESCAPE '\\'"
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS artifacts (
+        digest TEXT PRIMARY KEY,
+        size INTEGER,
+        refcount INTEGER,
+        created_at REAL,
+        last_used_at REAL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS artifacts_unreferenced ON artifacts (refcount) WHERE refcount <= 0",
+    '''
+    CREATE TABLE IF NOT EXISTS run_artifacts (
+        dag_id TEXT,
+        name TEXT,
+        digest TEXT,
+        size INTEGER,
+        PRIMARY KEY (dag_id, name)
+    )
+    ''',
+)
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+class ArtifactStore:
+    """Блобы по sha256 и манифесты запусков в orchestrator.db; методы синхронные (вызываются в потоке)"""
+
+    def __init__(self, db_path: str, root: str = ARTIFACTS_ROOT):
+        self.db_path = db_path
+        self.root = root
+
+    def connect(self) -> sqlite3.Connection:
+        # уборка держит write-блокировку, пока удаляет пачку файлов - ждем ее дольше обычного
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if self.db_path not in _schema_ready:
+            with _schema_lock:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                conn.commit()
+                _schema_ready.add(self.db_path)
+        return conn
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "sha256", digest[:2], digest[2:4], digest)
+
+    # --------------------
+    # Запись
+    # --------------------
+
+    def _place_blob(self, source_path: str, digest: str, keep_source: bool) -> bool:
+        """Кладет файл в блоб digest; False, если такой блоб уже есть (источник тогда удаляется)"""
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            if not keep_source:
+                os.remove(source_path)
+            return False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        temp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.part"
+        if keep_source:
+            fast_copy(source_path, temp_path)
+        else:
+            move_file(source_path, temp_path)
+        # блоб общий для многих запусков - защищаем от записи
+        os.chmod(temp_path, 0o444)
+        os.replace(temp_path, blob)
+        return True
+
+    def _add_refs(self, conn: sqlite3.Connection, sizes: Dict[str, int], refs: Dict[str, int]):
+        now = time.time()
+        conn.executemany('''
+            INSERT INTO artifacts (digest, size, refcount, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (digest) DO UPDATE SET refcount = refcount + excluded.refcount, last_used_at = excluded.last_used_at
+        ''', [(digest, sizes[digest], count, now, now) for digest, count in refs.items()])
+
+    def ingest_run(self, dag_id: str, run_dir: str, keep_source: bool = False) -> Dict[str, int]:
+        """Переносит файлы папки запуска в хранилище и записывает манифест
+
+        Повторный вызов для того же dag_id заменяет манифест (ссылки старого снимаются).
+        Возвращает {"files", "bytes", "stored_bytes"} - сколько байт реально записано.
+        """
+        files = {}
+        for directory, _, names in os.walk(run_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                files[os.path.relpath(path, run_dir).replace(os.sep, "/")] = (path, digest_file(path),
+                                                                               os.path.getsize(path))
+
+        sizes = {digest: size for _, digest, size in files.values()}
+        refs = {}
+        for _, digest, _ in files.values():
+            refs[digest] = refs.get(digest, 0) + 1
+
+        conn = self.connect()
+        try:
+            # значения задач, записанные во время запуска, остаются в манифесте
+            self.release_run(conn, dag_id, files_only=True)
+            conn.executemany(
+                "INSERT INTO run_artifacts (dag_id, name, digest, size) VALUES (?, ?, ?, ?)",
+                [(dag_id, name, digest, size) for name, (_, digest, size) in files.items()],
+            )
+            self._add_refs(conn, sizes, refs)
+            conn.commit()
+        finally:
+            conn.close()
+
+        stored_bytes = 0
+        for path, digest, size in files.values():
+            if self._place_blob(path, digest, keep_source):
+                stored_bytes += size
+        total = sum(size for _, _, size in files.values())
+        ARTIFACT_BYTES.inc(stored_bytes, kind="stored")
+        ARTIFACT_BYTES.inc(total - stored_bytes, kind="deduplicated")
+        return {"files": len(files), "bytes": total, "stored_bytes": stored_bytes}
+
+    def put_bytes(self, dag_id: str, name: str, data: bytes) -> str:
+        """Записывает значение задачи как блоб под именем VALUE_PREFIX + name; возвращает sha256"""
+        digest = hashlib.sha256(data).hexdigest()
+        name = VALUE_PREFIX + name
+        conn = self.connect()
+        try:
+            self.release_name(conn, dag_id, name)
+            conn.execute(
+                "INSERT INTO run_artifacts (dag_id, name, digest, size) VALUES (?, ?, ?, ?)",
+                (dag_id, name, digest, len(data)),
+            )
+            self._add_refs(conn, {digest: len(data)}, {digest: 1})
+            conn.commit()
+        finally:
+            conn.close()
+
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            ARTIFACT_BYTES.inc(len(data), kind="deduplicated")
+            return digest
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        temp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.chmod(temp_path, 0o444)
+        os.replace(temp_path, blob)
+        ARTIFACT_BYTES.inc(len(data), kind="stored")
+        return digest
+
+    # --------------------
+    # Чтение
+    # --------------------
+
+    def manifest(self, dag_id: str) -> Dict[str, Tuple[str, int]]:
+        """{имя файла: (sha256, размер)} запуска; пусто, если запуск не в хранилище"""
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                f"SELECT name, digest, size FROM run_artifacts WHERE dag_id = ? {_FILES_ONLY} ORDER BY name", (dag_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return {name: (digest, size) for name, digest, size in rows}
+
+    def has_run(self, dag_id: str) -> bool:
+        conn = self.connect()
+        try:
+            return conn.execute(
+                f"SELECT 1 FROM run_artifacts WHERE dag_id = ? {_FILES_ONLY} LIMIT 1", (dag_id,)
+            ).fetchone() is not None
+        finally:
+            conn.close()
+
+    def file_path(self, dag_id: str, name: str) -> Optional[str]:
+        """Путь к блобу файла запуска (None, если его нет в манифесте) - отдается с диска, без чтения в память"""
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT digest FROM run_artifacts WHERE dag_id = ? AND name = ?", (dag_id, name)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        path = self.blob_path(row[0])
+        return path if os.path.isfile(path) else None
+
+    def read(self, dag_id: str, name: str) -> Optional[bytes]:
+        """Содержимое небольшого файла запуска (config.json, results.json) по имени"""
+        path = self.file_path(dag_id, name)
+        if path is None:
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+
+    def read_blob(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self.blob_path(digest), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def write_zip(self, dag_id: str, fileobj: BinaryIO) -> bool:
+        """Собирает zip запуска из блобов в fileobj; False, если запуска нет в хранилище"""
+        manifest = self.manifest(dag_id)
+        if not manifest:
+            return False
+        with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, (digest, _) in manifest.items():
+                archive.write(self.blob_path(digest), arcname=name)
+        return True
+
+    # --------------------
+    # Ссылки и уборка
+    # --------------------
+
+    def release_run(self, conn: sqlite3.Connection, dag_id: str, files_only: bool = False) -> int:
+        """Снимает ссылки запуска на блобы и удаляет его манифест (вызывающий делает commit)
+
+        files_only - только файлы запуска, значения задач остаются.
+        """
+        condition = _FILES_ONLY if files_only else ""
+        refs = conn.execute(
+            f"SELECT digest, COUNT(*) FROM run_artifacts WHERE dag_id = ? {condition} GROUP BY digest", (dag_id,)
+        ).fetchall()
+        if not refs:
+            return 0
+        conn.executemany(
+            "UPDATE artifacts SET refcount = refcount - ? WHERE digest = ?", [(count, digest) for digest, count in refs]
+        )
+        conn.execute(f"DELETE FROM run_artifacts WHERE dag_id = ? {condition}", (dag_id,))
+        return len(refs)
+
+    def release_name(self, conn: sqlite3.Connection, dag_id: str, name: str):
+        """Снимает ссылку одной записи манифеста (вызывающий делает commit)"""
+        row = conn.execute(
+            "SELECT digest FROM run_artifacts WHERE dag_id = ? AND name = ?", (dag_id, name)
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE artifacts SET refcount = refcount - 1 WHERE digest = ?", row)
+            conn.execute("DELETE FROM run_artifacts WHERE dag_id = ? AND name = ?", (dag_id, name))
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        """Удаляет блобы без ссылок; возвращает (число блобов, освобожденные байты)"""
+        removed, freed = 0, 0
+        conn = self.connect()
+        try:
+            while True:
+                # write-блокировка на все время удаления файлов: ingest_run ждет ее,
+                # прежде чем сослаться на блоб
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute(
+                    "SELECT digest, size FROM artifacts WHERE refcount <= 0 LIMIT ?", (GC_BATCH,)
+                ).fetchall()
+                if not rows:
+                    conn.rollback()
+                    break
+                for digest, size in rows:
+                    try:
+                        os.remove(self.blob_path(digest))
+                        freed += size
+                    except FileNotFoundError:
+                        pass
+                conn.executemany("DELETE FROM artifacts WHERE digest = ?", [(digest,) for digest, _ in rows])
+                conn.commit()
+                removed += len(rows)
+        finally:
+            conn.close()
+        return removed, freed
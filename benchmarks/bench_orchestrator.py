@@ -0,0 +1,383 @@
+"""
+Сквозной бенчмарк оркестратора на синтетических DAG.
+
+Графы (chain, fanout, diamond, layered, pipeline) строятся из stub-операции с заданной
+задержкой (latency_ms) и CPU-нагрузкой в event loop (cpu_ms). Задержка берется
+либо из asyncio.sleep, либо из локального mock HTTP-сервера (--http), к которому
+операция ходит через aiohttp. Запуск идет через TaskOrchestrator.execute_dag
+(mode=direct) или через ручки /api/web и /api/cli (Quart test client).
+--policies сравнивает порядок запуска готовых задач (scheduling_policy): заметная
+разница - на pipeline с ограниченным --max-concurrency.
+
+Каждый сценарий выполняется в отдельном процессе во временной папке, поэтому
+peak RSS и БД у сценариев свои. Отчет - JSON, его удобно сравнивать между коммитами:
+
+    python benchmarks/bench_orchestrator.py
+    python benchmarks/bench_orchestrator.py --shapes chain layered --sizes 10 1000 100000 --latency-ms 0
+    python benchmarks/bench_orchestrator.py --modes direct web cli --http --output bench.json
+    python benchmarks/bench_orchestrator.py --shapes pipeline --sizes 200 --max-concurrency 4 --policies fifo critical_path
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHAPES = ("chain", "fanout", "diamond", "layered", "pipeline")
+MODES = ("direct", "web", "cli")
+POLICIES = ("fifo", "critical_path")
+
+
+# --------------------
+# Синтетические DAG
+# --------------------
+
+def _task(task_id, dependencies, args):
+    params = {"bench_id": task_id, "latency_ms": args.latency_ms, "cpu_ms": args.cpu_ms}
+    if args.http:
+        params["url"] = args.mock_url
+    return {
+        "id": task_id,
+        "operation": "bench_op",
+        "independent_params": params,
+        # значение первой зависимости протаскивается дальше - как в настоящих пайплайнах
+        "dependent_params": {"value": f"{dependencies[0]}.results.value"} if dependencies else {},
+        "dependencies": dependencies,
+    }
+
+
+def build_dag(shape: str, size: int, args) -> dict:
+    """Синтетический DAG из size задач"""
+    edges = {}
+    if shape == "chain":
+        for index in range(size):
+            edges[f"t{index}"] = [f"t{index - 1}"] if index else []
+    elif shape == "fanout":
+        # корень -> size-2 независимых задач -> одна сборка
+        edges["root"] = []
+        for index in range(max(size - 2, 0)):
+            edges[f"t{index}"] = ["root"]
+        edges["join"] = [f"t{index}" for index in range(max(size - 2, 0))] or ["root"]
+    elif shape == "diamond":
+        # цепочка ромбов: a -> (b, c) -> d -> (b, c) -> ...
+        previous = "d0"
+        edges[previous] = []
+        index = 0
+        while len(edges) + 3 <= size:
+            index += 1
+            edges[f"b{index}"] = [previous]
+            edges[f"c{index}"] = [previous]
+            edges[f"d{index}"] = [f"b{index}", f"c{index}"]
+            previous = f"d{index}"
+    elif shape == "layered":
+        # случайный слоистый граф: ширина слоя ~ sqrt(size), 1-3 ребра в предыдущий слой
+        rng = random.Random(args.seed)
+        width = max(int(size ** 0.5), 1)
+        layers = []
+        count = 0
+        while count < size:
+            layer = [f"l{len(layers)}_{index}" for index in range(min(width, size - count))]
+            for task_id in layer:
+                edges[task_id] = rng.sample(layers[-1], min(len(layers[-1]), rng.randint(1, 3))) if layers else []
+            layers.append(layer)
+            count += len(layer)
+    elif shape == "pipeline":
+        # корень -> половина задач независимыми ветками и длинная цепочка из второй половины;
+        # ветки в конфиге раньше цепочки, поэтому fifo запускает их первыми
+        edges["root"] = []
+        branches = max(size - 1, 0) // 2
+        for index in range(branches):
+            edges[f"s{index}"] = ["root"]
+        for index in range(max(size - 1 - branches, 0)):
+            edges[f"p{index}"] = [f"p{index - 1}"] if index else ["root"]
+    else:
+        raise ValueError(f"Unknown shape '{shape}'")
+
+    return {
+        "dag_name": f"bench_{shape}_{size}",
+        "max_retries": 1,
+        "retry_delay": 0,
+        "max_concurrency": args.max_concurrency,
+        "scheduling_policy": args.policy,
+        "tasks": [_task(task_id, dependencies, args) for task_id, dependencies in edges.items()],
+    }
+
+
+def ideal_makespan(config: dict) -> float:
+    """Нижняя граница времени DAG без накладных расходов: критический путь или весь CPU подряд"""
+    finish = {}
+    total_cpu = 0.0
+    for task in config["tasks"]:
+        params = task["independent_params"]
+        cost = (params["latency_ms"] + params["cpu_ms"]) / 1000
+        total_cpu += params["cpu_ms"] / 1000
+        finish[task["id"]] = cost + max((finish[dep] for dep in task["dependencies"]), default=0.0)
+    return max(max(finish.values(), default=0.0), total_cpu)
+
+
+# --------------------
+# Stub-операция и mock-сервер
+# --------------------
+
+TIMINGS = {}
+
+
+async def bench_op(bench_id: str, latency_ms: float = 0, cpu_ms: float = 0, url: str = None, value=None):
+    """Stub-операция: cpu_ms занятого event loop, затем latency_ms ожидания (sleep или HTTP)"""
+    started = time.perf_counter()
+    deadline = started + cpu_ms / 1000
+    while time.perf_counter() < deadline:
+        pass
+    if url:
+        import aiohttp
+        from operations import RESOURCES
+
+        session = await RESOURCES.get(("aiohttp", "bench"), aiohttp.ClientSession, loop_bound=True)
+        async with session.get(url, params={"latency_ms": latency_ms}) as response:
+            await response.read()
+    elif latency_ms:
+        await asyncio.sleep(latency_ms / 1000)
+    TIMINGS[bench_id] = (started, time.perf_counter())
+    return {"value": (value or 0) + 1}
+
+
+async def start_mock_server():
+    """Локальный HTTP-сервер, отвечающий через latency_ms"""
+    from aiohttp import web
+
+    async def handler(request):
+        latency_ms = float(request.query.get("latency_ms", 0))
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        return web.json_response({"ok": True})
+
+    application = web.Application()
+    application.router.add_get("/data", handler)
+    runner = web.AppRunner(application, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/data"
+
+
+# --------------------
+# Один сценарий (в дочернем процессе)
+# --------------------
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_scenario(args) -> dict:
+    from operations import OPERATIONS, RESOURCES
+    from loop_watchdog import LoopWatchdog
+    import orchestrator as orchestrator_module
+
+    OPERATIONS.register("bench_op", bench_op)
+    if not args.verbose:
+        # orchestrator при импорте выставляет INFO - глушим после импорта
+        logging.getLogger("taskflow").setLevel(logging.WARNING)
+    runner = None
+    if args.http:
+        runner, args.mock_url = await start_mock_server()
+
+    config = build_dag(args.shape, args.size, args)
+    orchestrators = []
+
+    class RecordingOrchestrator(orchestrator_module.TaskOrchestrator):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.finished = asyncio.Event()
+            orchestrators.append(self)
+
+        async def execute_dag(self, *a, **kw):
+            try:
+                return await super().execute_dag(*a, **kw)
+            finally:
+                self.finished.set()
+
+    watchdog = LoopWatchdog(threshold=args.stall_threshold_ms / 1000)
+    watchdog.start()
+    started = time.perf_counter()
+    if args.mode == "direct":
+        await RecordingOrchestrator(dag_config=config, operations=OPERATIONS).execute_dag()
+    else:
+        import app as app_module
+
+        app_module.TaskOrchestrator = RecordingOrchestrator
+        app_module.DAGS_DIR = os.path.abspath("dags")
+        app_module.DB_PATH = os.path.abspath("orchestrator.db")
+        app_module.ARTIFACTS_DIR = os.path.abspath("artifacts")
+        client = app_module.app.test_client()
+        if args.mode == "web":
+            response = await client.post("/api/web", json=config)
+            assert response.status_code == 200, await response.get_data()
+            try:
+                await asyncio.wait_for(orchestrators[0].finished.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"DAG {orchestrators[0].dag_id} не завершился за {args.timeout}с")
+        else:
+            response = await client.post("/api/cli", json=config)
+            assert response.status_code == 200, await response.get_data()
+            await response.get_data()
+    wall = time.perf_counter() - started
+    await watchdog.stop()
+
+    orchestrator = orchestrators[0]
+    failed = [key for key, status in orchestrator.task_status.items() if status != "completed"]
+    finished_at = {task_id: end for task_id, (_, end) in TIMINGS.items()}
+    latencies = []
+    for task in config["tasks"]:
+        if task["id"] not in TIMINGS:
+            continue
+        # от момента, когда задача стала готова (завершилась последняя зависимость), до ее завершения
+        ready_at = max((finished_at[dep] for dep in task["dependencies"]), default=started)
+        latencies.append(TIMINGS[task["id"]][1] - ready_at)
+    phases = {}
+    for timings in orchestrator.task_timings.values():
+        for phase, seconds in timings.items():
+            phases.setdefault(phase, []).append(seconds)
+    own_cost = (args.latency_ms + args.cpu_ms) / 1000
+    ideal = ideal_makespan(config)
+    tasks = len(config["tasks"])
+
+    if runner is not None:
+        await runner.cleanup()
+    await RESOURCES.aclose()
+
+    return {
+        "shape": args.shape,
+        "size": args.size,
+        "mode": args.mode,
+        "policy": args.policy,
+        "http": args.http,
+        "tasks": tasks,
+        "failed": len(failed),
+        "wall_s": round(wall, 4),
+        "ideal_s": round(ideal, 4),
+        "throughput_tasks_per_s": round(tasks / wall, 2) if wall else None,
+        "overhead_per_task_ms": round(max(wall - ideal, 0) / tasks * 1000, 4),
+        "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "latency_p99_ms": round(_percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "scheduling_p50_ms": round((_percentile(latencies, 0.5) - own_cost) * 1000, 3) if latencies else None,
+        "phases_mean_ms": {phase: round(sum(values) / len(values) * 1000, 4) for phase, values in phases.items()},
+        "loop_stalls": watchdog.stall_count,
+        "loop_stall_total_ms": round(watchdog.stall_seconds * 1000, 3),
+        "loop_lag_max_ms": round(watchdog.gauge.value() * 1000, 3),
+        "loop_stall_sources": sorted({stall["location"] for stall in watchdog.stalls if stall["location"]})[:10],
+        "db_writes": orchestrator.db_writes,
+        "db_writes_per_task": round(orchestrator.db_writes / tasks, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def worker(args):
+    sys.path.insert(0, REPO_DIR)
+    with tempfile.TemporaryDirectory() as cwd:
+        # оркестратор пишет ./dags и ./orchestrator.db относительно cwd
+        os.chdir(cwd)
+        print(json.dumps(asyncio.run(run_scenario(args))))
+
+
+# --------------------
+# Запуск набора сценариев
+# --------------------
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк оркестратора на синтетических DAG")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["direct"])
+    parser.add_argument("--policies", nargs="+", choices=POLICIES, default=["fifo"],
+                        help="порядок запуска готовых задач (scheduling_policy)")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="задержка операции")
+    parser.add_argument("--cpu-ms", type=float, default=0.0, help="CPU-нагрузка операции в event loop")
+    parser.add_argument("--http", action="store_true", help="задержка через mock HTTP-сервер")
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=3600, help="ожидание DAG из /api/web")
+    parser.add_argument("--stall-threshold-ms", type=float, default=50, help="порог блокировки event loop")
+    parser.add_argument("--output", help="записать JSON в файл")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи оркестратора")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--shape", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--policy", default="fifo", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.mock_url = None
+
+    if args.worker:
+        worker(args)
+        return
+
+    common = ["--latency-ms", str(args.latency_ms), "--cpu-ms", str(args.cpu_ms),
+              "--seed", str(args.seed), "--timeout", str(args.timeout),
+              "--stall-threshold-ms", str(args.stall_threshold_ms)]
+    if args.http:
+        common.append("--http")
+    if args.max_concurrency:
+        common += ["--max-concurrency", str(args.max_concurrency)]
+    if args.verbose:
+        common.append("--verbose")
+
+    results = []
+    for mode in args.modes:
+        for shape in args.shapes:
+            for size in args.sizes:
+                for policy in args.policies:
+                    process = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--worker",
+                         "--shape", shape, "--size", str(size), "--mode", mode, "--policy", policy, *common],
+                        capture_output=True, text=True,
+                    )
+                    if process.returncode != 0:
+                        row = {"shape": shape, "size": size, "mode": mode, "policy": policy,
+                               "error": process.stderr[-2000:]}
+                    else:
+                        row = json.loads(process.stdout.strip().splitlines()[-1])
+                    results.append(row)
+                    print(f"{mode:6} {shape:8} {size:>7} {policy:13}: " + (
+                        f"{row['wall_s']:.3f}s, {row['throughput_tasks_per_s']} задач/с, "
+                        f"overhead {row['overhead_per_task_ms']} мс/задачу, p99 {row['latency_p99_ms']} мс, "
+                        f"{row['db_writes']} записей в БД, {row['loop_stalls']} блокировок loop, "
+                        f"RSS {row['peak_rss_mb']} МБ"
+                        if "error" not in row else "ошибка"
+                    ), file=sys.stderr)
+
+    report = {
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "params": {"latency_ms": args.latency_ms, "cpu_ms": args.cpu_ms, "http": args.http,
+                   "max_concurrency": args.max_concurrency, "seed": args.seed},
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Бенчмарк холодного старта: время импорта модулей TaskFlow в чистом интерпретаторе.
+
+Каждый модуль импортируется в отдельном процессе (python -X importtime), берется
+медиана по нескольким запускам и сравнивается с бюджетом. Код возврата 1, если
+какой-то модуль не уложился - скрипт можно ставить в CI как защиту от регрессий.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 7 --budget app=0.8 --json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# бюджет на импорт модуля, сек
+DEFAULT_BUDGETS = {
+    "operations": 0.1,
+    "orchestrator": 0.3,
+    "app": 0.6,
+    # большая часть - сам aiogram (pydantic-модели типов Telegram)
+    "bot": 4.0,
+}
+
+# тяжелые пакеты, которые не должны грузиться при импорте модуля
+FORBIDDEN_IMPORTS = {
+    "operations": ["pandas", "numpy", "yaml", "pyarrow"],
+    "orchestrator": ["pandas", "numpy", "pyarrow"],
+    "app": ["pandas", "numpy", "pyarrow", "pydot", "grpc"],
+    "bot": ["pandas", "numpy", "pyarrow", "flask"],
+}
+
+
+def measure(module: str, cwd: str):
+    """Импортирует модуль в новом процессе, возвращает (время импорта, список загруженных модулей)"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark-token")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Импорт {module} упал:\n{process.stderr[-2000:]}")
+
+    # строки вида "import time:       123 |      4567 | package.module"
+    loaded = []
+    total_us = 0
+    for line in process.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if not match:
+            continue
+        loaded.append(match.group(4))
+        if match.group(4) == module:
+            total_us = int(match.group(2))
+    return total_us / 1_000_000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк времени импорта")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", action="append", default=[],
+                        help="переопределить бюджет: модуль=секунды")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_BUDGETS))
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in args.budget:
+        name, value = item.split("=")
+        budgets[name] = float(value)
+
+    report = {}
+    failed = False
+    # модули создают рабочие папки (tg_data, dags) - запускаем их во временной директории
+    with tempfile.TemporaryDirectory() as cwd:
+        for module in args.modules:
+            timings = []
+            loaded = []
+            for _ in range(args.runs):
+                seconds, loaded = measure(module, cwd)
+                timings.append(seconds)
+            median = statistics.median(timings)
+            heavy = sorted({name for name in loaded for forbidden in FORBIDDEN_IMPORTS.get(module, [])
+                            if name == forbidden})
+            budget = budgets.get(module)
+            ok = (budget is None or median <= budget) and not heavy
+            failed = failed or not ok
+            report[module] = {
+                "median_s": round(median, 4),
+                "min_s": round(min(timings), 4),
+                "budget_s": budget,
+                "heavy_imports": heavy,
+                "ok": ok,
+            }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for module, row in report.items():
+            status = "OK" if row["ok"] else "FAIL"
+            extra = f" тяжелые импорты: {', '.join(row['heavy_imports'])}" if row["heavy_imports"] else ""
+            print(f"{status:4} {module:14} {row['median_s']:.3f}s (бюджет {row['budget_s']}s){extra}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
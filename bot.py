@@ -15,7 +15,10 @@ from aiogram.types import (
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.client.default import DefaultBotProperties
-from flask.cli import load_dotenv
+from dotenv import load_dotenv
+from operations.telegram_ops import CHAT_ID_RESOLVER
+from metrics_registry import CRON_LAG, LoopLagMonitor, serve_metrics
+from loop_watchdog import LoopWatchdog, WATCHDOG_ENABLED
 
 import logging
 
@@ -36,6 +39,8 @@ if not logger.hasHandlers():
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 API_URL = "http://0.0.0.0:5000/api"
+# порт для /metrics бота (cron lag, задержка event loop); не задан - сервер не запускается
+METRICS_PORT = os.getenv("TASKFLOW_BOT_METRICS_PORT")
 
 DATA_DIR = "./tg_data"
 GRAPHS_FILE = f"{DATA_DIR}/graphs.json"
@@ -244,6 +249,7 @@ class GraphState(StatesGroup):
     waiting_for_cron = State()
     waiting_for_method = State()
     managing_graphs = State()
+    waiting_for_new_config = State()
 
 
 # --------------------
@@ -335,6 +341,8 @@ def settings_text(data):
 async def start_cmd(msg: Message, state: FSMContext):
     await state.clear()
     logger.info(f"Команда /start от пользователя {msg.from_user.id} (@{msg.from_user.username})")
+    # чтобы send_telegram_message находил chat_id без похода в getUpdates
+    await CHAT_ID_RESOLVER.remember(msg.from_user.username, msg.from_user.id)
     await msg.answer(
         "👋 Привет! Я бот для управления графами.\n\n"
         "Используйте команды:\n"
@@ -638,6 +646,58 @@ async def run_graph_now(cb: CallbackQuery):
         await cb.message.answer(f"❌ Ошибка при выполнении графа '{graph.get('name')}'")
 
 
+@dp.callback_query(F.data.startswith("edit_"), GraphState.managing_graphs)
+async def edit_graph_config(cb: CallbackQuery, state: FSMContext):
+    graph_id = cb.data.split("_")[1]
+    logger.info(f"Пользователь {cb.from_user.id} редактирует config графа {graph_id}")
+    graph = get_graph_by_id(graph_id)
+
+    if not graph:
+        logger.error(f"Граф {graph_id} не найден для редактирования")
+        await cb.answer("Граф не найден!", show_alert=True)
+        return
+
+    await state.update_data(edit_graph_id=graph_id)
+    await state.set_state(GraphState.waiting_for_new_config)
+    await cb.message.answer(
+        f"Отправьте новый config.json для графа '{graph.get('name')}'.\n"
+        f"Перезапустятся только задачи, входы которых изменились."
+    )
+    await cb.answer()
+
+
+@dp.message(GraphState.waiting_for_new_config)
+async def receive_new_config(msg: Message, state: FSMContext):
+    if not msg.document or not msg.document.file_name.endswith(".json"):
+        logger.warning(f"Пользователь {msg.from_user.id} отправил не JSON файл")
+        await msg.answer("Отправьте config.json файл")
+        return
+
+    file = await bot.get_file(msg.document.file_id)
+    content = await bot.download_file(file.file_path)
+    try:
+        config = json.loads(content.read())
+    except Exception as e:
+        logger.error(f"Ошибка парсинга JSON от пользователя {msg.from_user.id}: {e}")
+        await msg.answer("Невалидный JSON.")
+        return
+
+    data = await state.get_data()
+    graph_id = data.get("edit_graph_id")
+    await state.set_state(GraphState.managing_graphs)
+    if not update_graph(graph_id, config=config):
+        await msg.answer("Config не изменился или граф не найден.")
+        return
+
+    graph = get_graph_by_id(graph_id)
+    await msg.answer(f"⚙️ Config графа '{graph.get('name')}' обновлен, перезапускаю изменившиеся задачи...")
+    # запуск incremental (как и все запуски графа): неизменившиеся задачи берутся из прошлого запуска
+    if await perform_api_action(graph_id):
+        await msg.answer(f"✅ Граф '{graph.get('name')}' успешно выполнен!")
+    else:
+        await msg.answer(f"❌ Ошибка при выполнении графа '{graph.get('name')}'")
+
+
 @dp.callback_query(F.data.startswith("delete_"), GraphState.managing_graphs)
 async def delete_graph_handler(cb: CallbackQuery):
     graph_id = cb.data.split("_")[1]
@@ -699,11 +759,45 @@ async def show_graph_status(cb: CallbackQuery):
         f"📤 Метод: {'Web-интерфейс' if graph.get('method') == 'web' else 'ZIP архив'}\n"
         f"🆔 ID: {graph_id}"
     )
+    stats_text = await fetch_graph_stats(graph_id)
+    if stats_text:
+        status_message += f"\n\n{stats_text}"
 
     await cb.message.answer(status_message)
     await cb.answer()
 
 
+async def fetch_graph_stats(graph_id):
+    """Сводка по истории запусков графа для статуса (None, если API недоступно)"""
+    try:
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(API_URL + "/runs/stats", params={"graph_id": graph_id}) as resp:
+                if resp.status != 200:
+                    logger.warning(f"Статистика графа {graph_id} недоступна: статус {resp.status}")
+                    return None
+                stats = await resp.json()
+    except Exception as e:
+        logger.warning(f"Не удалось получить статистику графа {graph_id}: {e}")
+        return None
+
+    if not stats.get("runs"):
+        return "📈 Запусков в истории пока нет"
+    duration = stats["duration"]
+    lines = [
+        f"📈 Запусков: {stats['runs']}, успешных: {stats['success_rate'] * 100:.1f}%",
+        f"⏱ Длительность: p50 {duration['p50']:.2f}с, p90 {duration['p90']:.2f}с, max {duration['max']:.2f}с",
+    ]
+    # самые медленные задачи по p90
+    slowest = sorted(stats["tasks"].items(), key=lambda item: item[1]["duration"]["p90"] or 0, reverse=True)
+    for task_id, task_stats in slowest[:3]:
+        lines.append(
+            f"  • {task_id}: p90 {task_stats['duration']['p90']:.2f}с, "
+            f"успешных {task_stats['success_rate'] * 100:.0f}%"
+        )
+    return "\n".join(lines)
+
+
 # --------------------
 # API ACTION
 # --------------------
@@ -721,12 +815,21 @@ async def perform_api_action(graph_id):
         return False
 
     logger.info(f"Выполняю граф {graph_id} ({graph.get('name')}) методом {graph.get('method')}")
+    # graph_id связывает запуски с графом в истории запусков (/api/runs),
+    # tenant - пользователя в честной очереди задач (executor.py); incremental - после
+    # редактирования config перезапускаются только задачи, входы которых изменились
+    run_config = {
+        "incremental": True,
+        **graph["config"],
+        "graph_id": graph_id,
+        "tenant": f"tg:{graph['chat_id']}",
+    }
 
     try:
         async with aiohttp.ClientSession() as session:
             if graph["method"] == "web":
                 logger.info(f"Отправка запроса к Web API для графа {graph_id}")
-                async with session.post(API_URL + "/web", json=graph["config"]) as resp:
+                async with session.post(API_URL + "/web", json=run_config) as resp:
                     if resp.status == 200:
                         j = await resp.json()
                         link = j.get("link")
@@ -750,7 +853,7 @@ async def perform_api_action(graph_id):
                 async with session.post(
                         API_URL + "/cli",
                         headers={"Content-Type": "application/json"},
-                        json=graph["config"]
+                        json=run_config
                 ) as resp:
                     if resp.status == 200:
                         file_bytes = await resp.read()
@@ -820,6 +923,7 @@ async def cron_worker():
 
                 if graph["next_run"] <= now:
                     logger.info(f"Запускаю граф {graph['graph_id']} по cron {cron} в {now}")
+                    CRON_LAG.observe((now - graph["next_run"]).total_seconds())
 
                     update_graph(graph["graph_id"], last_run=now)
                     itr = croniter(cron, now)
@@ -845,6 +949,12 @@ async def main():
     cron_task = asyncio.create_task(cron_worker())
     logger.info("Cron worker запущен")
 
+    metrics_runner = None
+    loop_lag_monitor = LoopWatchdog() if WATCHDOG_ENABLED else LoopLagMonitor()
+    loop_lag_monitor.start()
+    if METRICS_PORT:
+        metrics_runner = await serve_metrics("0.0.0.0", int(METRICS_PORT))
+
     logger.info("Доступные команды:")
     logger.info("/start - начать работу")
     logger.info("/graphs - управление графами")
@@ -862,6 +972,9 @@ async def main():
             await cron_task
         except asyncio.CancelledError:
             logger.info("Cron worker остановлен")
+        await loop_lag_monitor.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
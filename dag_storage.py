@@ -0,0 +1,159 @@
+"""
+Идентификаторы и размещение данных запусков на диске.
+
+dag_id - "dag" + ULID: 48 бит времени в мс и 80 случайных бит в base32 Crockford.
+Идентификаторы упорядочены по времени создания и генерируются без обращения к
+диску. Папка и архив запуска лежат в шарде по времени из id - dags/YYYYMMDD/HH/,
+чтобы в одной директории не копились сотни тысяч записей. Старые числовые id
+(dagNNNNNNN) шардируются по sha1 - dags/<xx>/. Запуски, сохраненные до
+шардирования, лежат прямо в dags/ и находятся по запасному пути, пока уборка
+(retention.py) не перенесет их в шард.
+
+После упаковки папка запуска удаляется, и файлы читаются из архива.
+"""
+import hashlib
+import os
+import re
+import secrets
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+DAGS_ROOT = "./dags"
+
+DAG_ID_PATTERN = re.compile(r"dag[0-9A-Za-z]+")
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ULID_LENGTH = 26
+ULID_PATTERN = re.compile(rf"dag[{_CROCKFORD}]{{{ULID_LENGTH}}}")
+
+_ulid_lock = threading.Lock()
+_last_ulid = (0, 0)
+
+
+def new_dag_id() -> str:
+    """Новый dag_id; в пределах одной мс процесса id монотонно растут"""
+    global _last_ulid
+    with _ulid_lock:
+        timestamp = time.time_ns() // 1_000_000
+        last_timestamp, last_random = _last_ulid
+        if timestamp <= last_timestamp:
+            # та же мс (или часы ушли назад): продолжаем последовательность
+            timestamp, randomness = last_timestamp, last_random + 1
+        else:
+            randomness = secrets.randbits(80)
+        _last_ulid = (timestamp, randomness)
+    value = (timestamp << 80) | (randomness & ((1 << 80) - 1))
+    chars = []
+    for _ in range(ULID_LENGTH):
+        value, index = divmod(value, 32)
+        chars.append(_CROCKFORD[index])
+    return "dag" + "".join(reversed(chars))
+
+
+def dag_id_time(dag_id: str) -> Optional[float]:
+    """Unix-время создания запуска из ULID-id (None для старых числовых id)"""
+    if not ULID_PATTERN.fullmatch(dag_id):
+        return None
+    timestamp = 0
+    for char in dag_id[3:13]:
+        timestamp = timestamp * 32 + _CROCKFORD.index(char)
+    return timestamp / 1000
+
+
+def is_dag_id(dag_id: str) -> bool:
+    """dag_id из URL можно подставлять в путь и имя таблицы"""
+    return bool(DAG_ID_PATTERN.fullmatch(dag_id))
+
+
+def shard(dag_id: str) -> str:
+    """Шард запуска: YYYYMMDD/HH по времени из id, для старых id - sha1"""
+    created = dag_id_time(dag_id)
+    if created is None:
+        return hashlib.sha1(dag_id.encode()).hexdigest()[:2]
+    return datetime.fromtimestamp(created, timezone.utc).strftime("%Y%m%d/%H")
+
+
+def iter_shards(root: str = DAGS_ROOT) -> Iterator[str]:
+    """Папки шардов: dags/<xx> и dags/YYYYMMDD/HH"""
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as entries:
+        names = [entry.name for entry in entries if entry.is_dir()]
+    for name in names:
+        path = os.path.join(root, name)
+        if len(name) == 2:
+            yield path
+        elif len(name) == 8 and name.isdigit():
+            with os.scandir(path) as entries:
+                hours = [entry.name for entry in entries if entry.is_dir()]
+            for hour in hours:
+                yield os.path.join(path, hour)
+
+
+def dag_dir(dag_id: str, root: str = DAGS_ROOT) -> str:
+    """Папка запуска (пока он выполняется)"""
+    return os.path.join(root, shard(dag_id), dag_id)
+
+
+def dag_zip(dag_id: str, root: str = DAGS_ROOT) -> str:
+    """Архив запуска"""
+    return dag_dir(dag_id, root) + ".zip"
+
+
+def legacy_paths(dag_id: str, root: str = DAGS_ROOT) -> Tuple[str, str]:
+    """Папка и архив запуска в плоской раскладке dags/<dag_id>"""
+    path = os.path.join(root, dag_id)
+    return path, path + ".zip"
+
+
+def locate(dag_id: str, root: str = DAGS_ROOT) -> Tuple[Optional[str], Optional[str]]:
+    """(папка, архив) запуска; None для отсутствующих и для недопустимого dag_id"""
+    if not is_dag_id(dag_id):
+        return None, None
+    for path, zip_path in ((dag_dir(dag_id, root), dag_zip(dag_id, root)), legacy_paths(dag_id, root)):
+        found_dir = path if os.path.isdir(path) else None
+        found_zip = zip_path if os.path.isfile(zip_path) else None
+        if found_dir or found_zip:
+            return found_dir, found_zip
+    return None, None
+
+
+def member_path(dag_id: str, name: str, root: str = DAGS_ROOT) -> Optional[str]:
+    """Путь к файлу в папке запуска (None, если папки или файла нет)"""
+    path, _ = locate(dag_id, root)
+    if path is None:
+        return None
+    file_path = os.path.join(path, os.path.basename(name))
+    return file_path if os.path.isfile(file_path) else None
+
+
+def open_zip_member(dag_id: str, name: str, root: str = DAGS_ROOT) -> Optional[BinaryIO]:
+    """Файл из архива запуска, открытый на чтение без распаковки в память (закрывает вызывающий)"""
+    _, zip_path = locate(dag_id, root)
+    if zip_path is None:
+        return None
+    name = os.path.basename(name)
+    # файл архива остается открытым, пока открыт member
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in (name, f"./{name}"):
+            try:
+                return archive.open(member)
+            except KeyError:
+                continue
+    return None
+
+
+def read_member(dag_id: str, name: str, root: str = DAGS_ROOT) -> Optional[bytes]:
+    """Файл запуска из папки, а если она уже удалена - из архива"""
+    file_path = member_path(dag_id, name, root)
+    if file_path is not None:
+        with open(file_path, "rb") as file:
+            return file.read()
+    member = open_zip_member(dag_id, name, root)
+    if member is None:
+        return None
+    with member:
+        return member.read()
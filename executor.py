@@ -0,0 +1,328 @@
+"""
+Общий для всех DAG процесса исполнитель: кому достается следующий слот задачи.
+
+Оркестратор перед выполнением экземпляра задачи берет слот (TaskExecutor.slot).
+Слотов TASKFLOW_MAX_RUNNING_TASKS (256, 0 - без ограничения) на процесс; когда они
+заняты, задачи ждут в очереди, и освободившийся слот получает:
+
+1. задача более высокого класса приоритета (priority в конфиге DAG: high, normal, low);
+2. в пределах класса - tenant (пользователь бота, API-ключ) с наименьшим
+   виртуальным временем: каждый полученный слот сдвигает время tenant на 1/вес
+   (взвешенная честная очередь, start-time fair queuing). Tenant, вернувшийся
+   после простоя, начинает с текущего времени очереди, а не с накопленного запаса;
+3. в пределах tenant - по порядку задачи (order: для scheduling_policy=critical_path
+   сначала задачи на самом долгом оставшемся пути DAG), затем в порядке постановки в очередь.
+
+Tenant, у которого уже занято столько слотов, сколько позволяет его квота, в
+выборе не участвует. Веса и квоты: TASKFLOW_TENANT_WEIGHTS="tg:42=4,key:ab12=2",
+TASKFLOW_TENANT_QUOTAS="tg:42=50", квота по умолчанию - TASKFLOW_TENANT_MAX_RUNNING
+(без нее tenant ограничен только общим числом слотов).
+
+Кроме слота задача занимает ресурсы процесса (поле resources задачи в конфиге):
+cpu - ядра, memory - байты ("4G"), io - класс light (HTTP-запросы, не считается)
+или heavy (диск, занимает io-слот). Задача получает слот, только если ее ресурсы
+помещаются в свободную емкость: TASKFLOW_CPU_CAPACITY (число ядер),
+TASKFLOW_MEMORY_CAPACITY (80% памяти машины), TASKFLOW_IO_SLOTS (8); 0 - без
+ограничения. Пока первая в очереди задача ждет ресурсов, ее обгоняют задачи,
+которые помещаются, но не дольше TASKFLOW_RESOURCE_STARVATION_SECONDS (30 сек) -
+потом освобождающиеся ресурсы копятся для нее.
+"""
+import asyncio
+import contextlib
+import heapq
+import itertools
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from metrics_registry import RESOURCES_IN_USE, TENANT_QUEUE_WAIT, TENANT_TASKS
+from retention import parse_size
+
+PRIORITY_CLASSES = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+_PRIORITY_RANK = {name: rank for rank, name in enumerate(PRIORITY_CLASSES)}
+
+RESOURCES = ("cpu", "memory", "io")
+# io-слотов на задачу по io-классу
+IO_CLASSES = {"light": 0, "heavy": 1}
+# ядер по умолчанию по resource_class операции: io-операции ждут сеть, а не CPU
+DEFAULT_CPU = {"io": 0, "cpu": 1, "memory": 1}
+
+
+def parse_mapping(value: Optional[str], cast=float) -> Dict[str, float]:
+    """{tenant: значение} из строки вида "tg:42=4,key:ab12=2" """
+    mapping = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            tenant, _, number = item.strip().rpartition("=")
+            mapping[tenant] = cast(number)
+    return mapping
+
+
+def default_capacity() -> Dict[str, float]:
+    """Емкость процесса по переменным окружения и параметрам машины"""
+    memory = parse_size(os.getenv("TASKFLOW_MEMORY_CAPACITY"))
+    if memory is None:
+        try:
+            memory = int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.8)
+        except (ValueError, OSError, AttributeError):
+            memory = 0
+    return {
+        "cpu": float(os.getenv("TASKFLOW_CPU_CAPACITY") or os.cpu_count() or 1),
+        "memory": memory,
+        "io": int(os.getenv("TASKFLOW_IO_SLOTS", "8")),
+    }
+
+
+def task_demand(resources: Optional[dict], resource_class: str = "io") -> Dict[str, float]:
+    """Ресурсы задачи из поля resources конфига: {"cpu": 2, "memory": "4G", "io": "heavy"}"""
+    resources = resources or {}
+    unknown = set(resources) - set(RESOURCES)
+    if unknown:
+        raise ValueError(f"Unknown resources: {', '.join(sorted(unknown))}")
+    io = resources.get("io", "light")
+    if isinstance(io, str):
+        if io not in IO_CLASSES:
+            raise ValueError(f"Unknown io class '{io}', expected one of {', '.join(IO_CLASSES)}")
+        io = IO_CLASSES[io]
+    memory = resources.get("memory", 0)
+    return {
+        "cpu": float(resources.get("cpu", DEFAULT_CPU[resource_class])),
+        "memory": parse_size(memory) if isinstance(memory, str) else int(memory),
+        "io": int(io),
+    }
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    priority = priority or DEFAULT_PRIORITY
+    if priority not in _PRIORITY_RANK:
+        raise ValueError(f"Unknown priority '{priority}', expected one of {', '.join(PRIORITY_CLASSES)}")
+    return _PRIORITY_RANK[priority]
+
+
+class _Tenant:
+    __slots__ = ("name", "weight", "quota", "virtual", "running", "queues")
+
+    def __init__(self, name: str, weight: float, quota: Optional[int]):
+        self.name = name
+        self.weight = weight
+        self.quota = quota
+        self.virtual = 0.0
+        self.running = 0
+        # очереди по требуемым ресурсам: задача поменьше не стоит за большой задачей
+        # того же tenant; элемент - (ранг приоритета, порядок задачи, номер в очереди, слот)
+        self.queues: Dict[tuple, List[tuple]] = {}
+
+    def heads(self) -> List[List[tuple]]:
+        """Непустые очереди (отмененные ожидающие снимаются с вершины кучи)"""
+        heads = []
+        for key, queue in list(self.queues.items()):
+            while queue and queue[0][-1].future.cancelled():
+                heapq.heappop(queue)
+            if queue:
+                heads.append(queue)
+            else:
+                del self.queues[key]
+        return heads
+
+    def waiting(self) -> int:
+        return sum(not entry[-1].future.cancelled() for queue in self.queues.values() for entry in queue)
+
+
+class Slot:
+    """Право выполнять одну задачу; release можно вызывать повторно"""
+    __slots__ = ("executor", "tenant", "priority", "rank", "order", "demand", "future", "held", "queued_at")
+
+    def __init__(self, executor: "TaskExecutor", tenant: str, priority: str, demand: Dict[str, float] = None,
+                 order: float = 0.0):
+        self.executor = executor
+        self.tenant = tenant
+        self.priority = priority or DEFAULT_PRIORITY
+        self.rank = priority_rank(priority)
+        # порядок внутри tenant и класса приоритета: меньше - раньше (политика планирования DAG)
+        self.order = order
+        self.demand = demand or {}
+        self.future = None
+        self.held = False
+        self.queued_at = 0.0
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.executor._release(self)
+
+    async def reacquire(self):
+        """Снова встает в очередь (после release на время паузы между попытками)"""
+        if not self.held:
+            await self.executor._acquire(self)
+
+
+class TaskExecutor:
+    def __init__(self, capacity: int = None, weights: Dict[str, float] = None, quotas: Dict[str, int] = None,
+                 default_quota: Optional[int] = None, resources: Dict[str, float] = None,
+                 starvation_timeout: float = None):
+        self.capacity = capacity if capacity is not None else int(os.getenv("TASKFLOW_MAX_RUNNING_TASKS", "256"))
+        self.weights = weights if weights is not None else parse_mapping(os.getenv("TASKFLOW_TENANT_WEIGHTS"))
+        self.quotas = quotas if quotas is not None else parse_mapping(os.getenv("TASKFLOW_TENANT_QUOTAS"), int)
+        if default_quota is None and os.getenv("TASKFLOW_TENANT_MAX_RUNNING"):
+            default_quota = int(os.getenv("TASKFLOW_TENANT_MAX_RUNNING"))
+        self.default_quota = default_quota
+        self.resources = resources if resources is not None else default_capacity()
+        self.in_use = dict.fromkeys(RESOURCES, 0)
+        if starvation_timeout is None:
+            starvation_timeout = float(os.getenv("TASKFLOW_RESOURCE_STARVATION_SECONDS", "30"))
+        self.starvation_timeout = starvation_timeout
+        self.running = 0
+        # виртуальное время очереди: время последнего tenant, получившего слот
+        self.clock = 0.0
+        self._tenants: Dict[str, _Tenant] = {}
+        self._sequence = itertools.count()
+
+    def _tenant(self, name: str) -> _Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = self._tenants[name] = _Tenant(
+                name, self.weights.get(name, 1.0), self.quotas.get(name, self.default_quota)
+            )
+        return tenant
+
+    def check_demand(self, demand: Dict[str, float], task_id: str = ""):
+        """ValueError, если задаче не хватит ресурсов процесса даже без других задач"""
+        for resource, need in demand.items():
+            capacity = self.resources.get(resource)
+            if capacity and need > capacity:
+                raise ValueError(f"Task '{task_id}' requires {resource}={need}, worker capacity is {capacity}")
+
+    def _fits(self, demand: Dict[str, float]) -> bool:
+        return all(
+            not self.resources.get(resource) or self.in_use[resource] + need <= self.resources[resource]
+            for resource, need in demand.items()
+        )
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tenant: str, priority: str = DEFAULT_PRIORITY, demand: Dict[str, float] = None,
+                   order: float = 0.0):
+        slot = Slot(self, tenant, priority, demand, order)
+        await self._acquire(slot)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    async def _acquire(self, slot: Slot):
+        tenant = self._tenant(slot.tenant)
+        if tenant.running == 0 and not tenant.heads():
+            # простаивавший tenant не получает запас слотов за время простоя
+            tenant.virtual = self.clock
+        slot.future = asyncio.get_running_loop().create_future()
+        slot.queued_at = time.perf_counter()
+        queue = tenant.queues.setdefault(tuple(sorted(slot.demand.items())), [])
+        heapq.heappush(queue, (slot.rank, slot.order, next(self._sequence), slot))
+        TENANT_TASKS.inc(tenant=tenant.name, state="waiting")
+        self._dispatch()
+        try:
+            await slot.future
+        except asyncio.CancelledError:
+            if slot.future.done() and not slot.future.cancelled():
+                # слот выдан одновременно с отменой - возвращаем его
+                slot.release()
+            else:
+                TENANT_TASKS.dec(tenant=tenant.name, state="waiting")
+                self._forget_idle(tenant)
+            raise
+
+    def _release(self, slot: Slot):
+        tenant = self._tenants[slot.tenant]
+        tenant.running -= 1
+        self.running -= 1
+        self._take(slot.demand, -1)
+        TENANT_TASKS.dec(tenant=tenant.name, state="running")
+        self._dispatch()
+        self._forget_idle(tenant)
+
+    def _forget_idle(self, tenant: _Tenant):
+        """Убирает простаивающего tenant (иначе словарь растет с каждым API-ключом);
+        вернувшись, он все равно начнет с текущего времени очереди"""
+        if tenant.running == 0 and not tenant.heads() and self._tenants.get(tenant.name) is tenant:
+            del self._tenants[tenant.name]
+
+    def _take(self, demand: Dict[str, float], sign: int = 1):
+        for resource, need in demand.items():
+            if need:
+                self.in_use[resource] += sign * need
+                RESOURCES_IN_USE.set(self.in_use[resource], resource=resource)
+
+    def _next(self) -> Optional[Tuple[_Tenant, List[tuple]]]:
+        """Tenant и очередь, чья первая задача получает слот: класс приоритета, виртуальное время, ресурсы"""
+        candidates = []
+        for tenant in self._tenants.values():
+            if tenant.quota is not None and tenant.running >= tenant.quota:
+                continue
+            for queue in tenant.heads():
+                rank, order, sequence, _ = queue[0]
+                candidates.append(((rank, tenant.virtual, order, sequence), tenant, queue))
+        candidates.sort(key=lambda candidate: candidate[0])
+        now = time.perf_counter()
+        for _, tenant, queue in candidates:
+            slot = queue[0][-1]
+            if self._fits(slot.demand):
+                return tenant, queue
+            if now - slot.queued_at > self.starvation_timeout:
+                # задача слишком долго ждет ресурсов: остальные ее больше не обгоняют
+                return None
+        return None
+
+    def _dispatch(self):
+        """Раздает свободные слоты: класс приоритета, затем виртуальное время tenant"""
+        while not self.capacity or self.running < self.capacity:
+            chosen = self._next()
+            if chosen is None:
+                return
+            best, queue = chosen
+            slot = heapq.heappop(queue)[-1]
+            self._grant(best, slot)
+            slot.future.set_result(None)
+            TENANT_TASKS.dec(tenant=best.name, state="waiting")
+            TENANT_QUEUE_WAIT.observe(time.perf_counter() - slot.queued_at, tenant=best.name, priority=slot.priority)
+
+    def _grant(self, tenant: _Tenant, slot: Slot):
+        self.clock = tenant.virtual
+        tenant.virtual += 1 / tenant.weight
+        tenant.running += 1
+        self.running += 1
+        self._take(slot.demand)
+        slot.held = True
+        TENANT_TASKS.inc(tenant=tenant.name, state="running")
+
+    def try_slot(self, tenant: str, priority: str = DEFAULT_PRIORITY, demand: Dict[str, float] = None) -> Optional[Slot]:
+        """Слот без ожидания или None: только из свободной емкости, когда никто не ждет (резервные копии задач)"""
+        slot = Slot(self, tenant, priority, demand)
+        if self.capacity and self.running >= self.capacity:
+            return None
+        if not self._fits(slot.demand) or any(other.heads() for other in self._tenants.values()):
+            return None
+        state = self._tenant(tenant)
+        if state.quota is not None and state.running >= state.quota:
+            return None
+        if state.running == 0:
+            state.virtual = self.clock
+        self._grant(state, slot)
+        return slot
+
+    def snapshot(self) -> Dict:
+        """Занятые слоты и очереди по tenant"""
+        return {
+            "capacity": self.capacity,
+            "running": self.running,
+            "resources": {resource: {"in_use": self.in_use[resource], "capacity": self.resources.get(resource)}
+                          for resource in RESOURCES},
+            "tenants": {
+                name: {"running": tenant.running, "waiting": tenant.waiting(),
+                       "weight": tenant.weight, "quota": tenant.quota}
+                for name, tenant in self._tenants.items()
+                if tenant.running or tenant.queues
+            },
+        }
+
+
+EXECUTOR = TaskExecutor()
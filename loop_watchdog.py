@@ -0,0 +1,151 @@
+"""
+Watchdog event loop: находит синхронный код, который блокирует loop.
+
+Корутина-пульс (LoopLagMonitor) просыпается каждые interval секунд и пишет время
+пробуждения; отдельный поток проверяет, как давно это было. Если loop не
+просыпался дольше threshold, поток снимает стек потока event loop
+(sys._current_frames) и по нему определяет задачу и операцию DAG, которые его
+держат. Зависание логируется сразу, а по его окончании пишется в метрики
+taskflow_loop_stalls_total / taskflow_loop_stall_seconds и в OTel-спан event_loop.stall.
+
+    watchdog = LoopWatchdog(threshold=0.1)
+    watchdog.start()        # из event loop
+    ...
+    await watchdog.stop()
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from metrics_registry import REGISTRY, LoopLagMonitor
+from otel_config import get_tracer
+
+logger = logging.getLogger("taskflow")
+tracer = get_tracer("taskflow.watchdog")
+
+LOOP_STALLS = REGISTRY.counter(
+    "taskflow_loop_stalls_total", "Блокировки event loop дольше порога", ["operation"]
+)
+LOOP_STALL_DURATION = REGISTRY.histogram(
+    "taskflow_loop_stall_seconds", "Длительность блокировок event loop",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+WATCHDOG_ENABLED = os.getenv("TASKFLOW_WATCHDOG", "1") != "0"
+WATCHDOG_THRESHOLD = float(os.getenv("TASKFLOW_WATCHDOG_THRESHOLD_MS", "100")) / 1000
+# сколько последних блокировок (со стеками) держать в памяти
+WATCHDOG_MAX_STALLS = int(os.getenv("TASKFLOW_WATCHDOG_MAX_STALLS", "100"))
+
+# кадры, по локальным переменным которых определяется, чью работу выполняет loop
+_TASK_FRAMES = ("_run_attempts", "_expand_mapped_task", "_gather_mapped_task")
+
+
+def describe_stack(frame) -> Dict[str, Any]:
+    """Задача, операция и место в коде по стеку потока event loop"""
+    info = {"task_id": None, "operation": None, "dag_id": None, "location": None}
+    innermost = frame
+    if innermost is not None:
+        code = innermost.f_code
+        info["location"] = f"{code.co_filename}:{innermost.f_lineno} ({code.co_name})"
+    while frame is not None:
+        local_vars = frame.f_locals
+        if info["task_id"] is None and frame.f_code.co_name in _TASK_FRAMES:
+            info["task_id"] = local_vars.get("task_id") or local_vars.get("key")
+            info["operation"] = local_vars.get("operation_name")
+        if info["dag_id"] is None:
+            info["dag_id"] = getattr(local_vars.get("self"), "dag_id", None)
+        frame = frame.f_back
+    return info
+
+
+class LoopWatchdog(LoopLagMonitor):
+    """LoopLagMonitor с потоком-сторожем, ловящим блокировки loop дольше threshold"""
+
+    def __init__(self, threshold: float = WATCHDOG_THRESHOLD, interval: float = 0.05, stack_limit: int = 20,
+                 max_stalls: int = WATCHDOG_MAX_STALLS):
+        super().__init__(interval=interval)
+        self.threshold = threshold
+        self.stack_limit = stack_limit
+        # последние max_stalls блокировок; полные итоги - в stall_count / stall_seconds
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.stall_seconds = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._stall: Optional[Dict[str, Any]] = None
+
+    def start(self):
+        super().start()
+        self._loop_thread_id = threading.get_ident()
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._watch, name="taskflow-watchdog", daemon=True)
+            self._thread.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            # join в потоке: иначе остановка сторожа сама блокировала бы loop
+            await asyncio.to_thread(self._thread.join, 1)
+            self._thread = None
+        await super().stop()
+
+    def _watch(self):
+        check_interval = min(self.threshold / 2, self.interval)
+        while not self._stopped.wait(check_interval):
+            beat = self.last_beat
+            if beat is None:
+                continue
+            now = time.monotonic()
+            if self._stall is not None:
+                if beat != self._stall["beat"]:
+                    self._finish_stall(beat)
+                continue
+            # пульс ожидается каждые interval секунд - все сверх этого loop был занят
+            blocked = now - beat - self.interval
+            if blocked > self.threshold:
+                self._begin_stall(beat, blocked)
+
+    def _begin_stall(self, beat: float, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        info = describe_stack(frame)
+        stack = "".join(traceback.format_stack(frame, limit=self.stack_limit)) if frame is not None else ""
+        self._stall = {
+            **info,
+            "beat": beat,
+            "started_at": time.time() - blocked,
+            "stack": stack,
+        }
+        logger.warning(
+            f"Event loop заблокирован уже {blocked * 1000:.0f} мс: "
+            f"DAG {info['dag_id']}, задача {info['task_id']}, операция {info['operation']}, "
+            f"{info['location']}\n{stack}"
+        )
+
+    def _finish_stall(self, beat: float):
+        stall, self._stall = self._stall, None
+        duration = max(beat - stall["beat"] - self.interval, 0.0)
+        stall["duration"] = duration
+        self.stalls.append(stall)
+        self.stall_count += 1
+        self.stall_seconds += duration
+        LOOP_STALLS.inc(operation=stall["operation"] or "")
+        LOOP_STALL_DURATION.observe(duration)
+
+        attributes = {
+            key: str(stall[key]) for key in ("dag_id", "task_id", "operation", "location") if stall[key]
+        }
+        span = tracer.start_span("event_loop.stall", start_time=int(stall["started_at"] * 1e9),
+                                 attributes=attributes)
+        span.end(end_time=int((stall["started_at"] + duration) * 1e9))
+        logger.warning(
+            f"Event loop был заблокирован {duration * 1000:.0f} мс "
+            f"(задача {stall['task_id']}, операция {stall['operation']}, {stall['location']})"
+        )
@@ -0,0 +1,282 @@
+"""
+Внутрипроцессные метрики в формате Prometheus.
+
+Обновление метрики - запись в dict без блокировок и аллокаций на горячем пути
+(метрики меняются из event loop). Значения, которые дешевле посчитать при
+сборе, чем поддерживать (глубина очереди готовых задач), задаются функцией.
+Текст для /metrics собирает MetricsRegistry.render().
+"""
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("taskflow")
+
+# границы бакетов по умолчанию, сек
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterable[str]:
+        return ()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение считается при сборе метрик (только для метрики без меток)"""
+        self._function = function
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        if self._function is not None:
+            yield f"{self.name} {_format_value(self._function())}"
+            return
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по бакетам..., +Inf], сумма
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self):
+        for key, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                extra = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, extra)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса; повторная регистрация имени возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --------------------
+# Метрики оркестратора
+# --------------------
+
+DAGS_RUNNING = REGISTRY.gauge("taskflow_dags_running", "DAG, выполняющиеся сейчас")
+TASKS_RUNNING = REGISTRY.gauge("taskflow_tasks_running", "Экземпляры задач, выполняющиеся сейчас")
+READY_QUEUE_DEPTH = REGISTRY.gauge("taskflow_ready_queue_depth", "Готовые к запуску задачи во всех DAG")
+TASK_DURATION = REGISTRY.histogram(
+    "taskflow_task_duration_seconds", "Время задачи, включая ретраи", ["operation", "status"]
+)
+TASK_RETRIES = REGISTRY.counter("taskflow_task_retries_total", "Повторные попытки задач", ["operation"])
+SPECULATIVE_ATTEMPTS = REGISTRY.counter(
+    "taskflow_speculative_attempts_total", "Резервные копии долгих задач: launched, primary_won, backup_won",
+    ["operation", "outcome"],
+)
+TASKS_REUSED = REGISTRY.counter(
+    "taskflow_tasks_reused_total", "Задачи, результат которых взят из прошлого запуска (incremental)", ["operation"]
+)
+DB_WRITE_LATENCY = REGISTRY.histogram(
+    "taskflow_db_write_seconds", "Время пишущей транзакции в БД оркестратора", ["kind"]
+)
+ARCHIVE_DURATION = REGISTRY.histogram("taskflow_archive_seconds", "Время переноса файлов DAG в хранилище артефактов")
+ARCHIVE_SIZE = REGISTRY.histogram(
+    "taskflow_archive_bytes", "Размер файлов DAG",
+    buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10),
+)
+ARTIFACT_BYTES = REGISTRY.counter(
+    "taskflow_artifact_bytes_total", "Байты файлов DAG: записанные в хранилище и совпавшие с уже хранимыми",
+    ["kind"],
+)
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "taskflow_event_loop_lag_seconds", "Задержка event loop относительно расписания",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_LAG_MAX = REGISTRY.gauge("taskflow_event_loop_lag_max_seconds", "Максимальная задержка event loop")
+TENANT_QUEUE_WAIT = REGISTRY.histogram(
+    "taskflow_tenant_queue_wait_seconds", "Ожидание слота исполнителя задачами tenant", ["tenant", "priority"],
+)
+TENANT_TASKS = REGISTRY.gauge("taskflow_tenant_tasks", "Задачи tenant в исполнителе: running, waiting", ["tenant", "state"])
+RESOURCES_IN_USE = REGISTRY.gauge(
+    "taskflow_executor_resources_in_use", "Ресурсы процесса, занятые задачами: cpu, memory, io", ["resource"]
+)
+CRON_LAG = REGISTRY.histogram(
+    "taskflow_cron_lag_seconds", "Опоздание запуска графа относительно cron-расписания",
+    buckets=(0.1, 0.5, 1, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+
+
+class LoopLagMonitor:
+    """Измеряет задержку event loop: насколько позже расписания просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = 0.5, histogram: Histogram = EVENT_LOOP_LAG,
+                 gauge: Gauge = EVENT_LOOP_LAG_MAX):
+        self.interval = interval
+        self.histogram = histogram
+        self.gauge = gauge
+        self.last_lag = 0.0
+        # time.monotonic() последнего пробуждения - по нему watchdog видит зависший loop
+        self.last_beat: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self.last_beat = time.monotonic()
+            scheduled = self.last_beat + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(time.monotonic() - scheduled, 0.0)
+            self.histogram.observe(self.last_lag)
+            if self.last_lag > self.gauge.value():
+                self.gauge.set(self.last_lag)
+
+
+async def serve_metrics(host: str, port: int, registry: MetricsRegistry = REGISTRY):
+    """Отдельный HTTP-сервер /metrics для процессов без веб-приложения (бот)"""
+    from aiohttp import web
+
+    async def handler(request):
+        return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    application = web.Application()
+    application.router.add_get("/metrics", handler)
+    runner = web.AppRunner(application, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
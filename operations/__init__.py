@@ -1,12 +1,26 @@
-from .api_ops import fetch_api_data
-from .telegram_ops import send_telegram_message
-from .data_ops import dict_to_string, json_to_string, async_sleep
+from .registry import OperationRegistry, OperationSpec, operation, operation_spec, run_operation
+from .resources import RESOURCES, ResourcePool
 
-OPERATIONS = {
-    "fetch_api_data": fetch_api_data,
-    "send_telegram_message": send_telegram_message,
-    "dict_to_string": dict_to_string,
-    "json_to_string": json_to_string,
-    "async_sleep": async_sleep
+# модули операций импортируются только при первом вызове операции,
+# сторонние операции подключаются через entry points и TASKFLOW_PLUGIN_DIR
+OPERATIONS = OperationRegistry(package=__name__)
 
-}
\ No newline at end of file
+OPERATIONS.register("fetch_api_data", ".api_ops:fetch_api_data", resource_class="io", idempotent=True,
+                    idempotent_methods=("GET",))
+OPERATIONS.register("send_telegram_message", ".telegram_ops:send_telegram_message", resource_class="io")
+OPERATIONS.register("dict_to_string", ".data_ops:dict_to_string", cacheable=True, idempotent=True)
+OPERATIONS.register("json_to_string", ".data_ops:json_to_string", cacheable=True, idempotent=True)
+OPERATIONS.register("async_sleep", ".data_ops:async_sleep", idempotent=True)
+OPERATIONS.register("filter_rows", ".data_ops:filter_rows", resource_class="memory", cacheable=True, idempotent=True)
+OPERATIONS.register("select_columns", ".data_ops:select_columns", resource_class="memory", cacheable=True, idempotent=True)
+OPERATIONS.register("aggregate", ".data_ops:aggregate", resource_class="memory", cacheable=True, idempotent=True)
+OPERATIONS.register("join_files", ".data_ops:join_files", resource_class="memory", cacheable=True, idempotent=True)
+OPERATIONS.register("convert_format", ".data_ops:convert_format", resource_class="cpu", cacheable=True, idempotent=True)
+OPERATIONS.register("ml_predict", ".ml_ops:ml_predict", resource_class="cpu", cacheable=True, idempotent=True)
+OPERATIONS.register("ml_predict_file", ".ml_ops:ml_predict_file", resource_class="memory", cacheable=True, idempotent=True)
+OPERATIONS.register("copy_file", ".file_ops:copy_file", resource_class="io", idempotent=True)
+OPERATIONS.register("move_file", ".file_ops:move_file_op", resource_class="io")
+OPERATIONS.register("concat_files", ".file_ops:concat_files", resource_class="io", cacheable=True, idempotent=True)
+OPERATIONS.register("split_file", ".file_ops:split_file", resource_class="io", cacheable=True, idempotent=True)
+OPERATIONS.register("hash_file", ".file_ops:hash_file", resource_class="cpu", cacheable=True, idempotent=True)
+OPERATIONS.register("compress_file", ".file_ops:compress_file", resource_class="cpu", cacheable=True, idempotent=True)
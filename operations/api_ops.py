@@ -4,6 +4,27 @@ import json
 from typing import Dict, Any
 import random
 import os
+from .resources import RESOURCES
+
+OUTPUT_DIR = "./userdata_buffer"
+
+
+def _create_output(filename: str = None):
+    """Создает новый файл результата в ./userdata_buffer (имя filename или случайное)
+
+    Файл открывается в режиме x: одновременные вызовы с одним filename (например,
+    резервная копия задачи) не пишут в один файл, второй получает случайное имя.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    name = os.path.basename(filename) if filename else None
+    while True:
+        if not name:
+            name = f"{random.randint(1000000, 9999999)}.json"
+        output_path = f"{OUTPUT_DIR}/{name}"
+        try:
+            return output_path, open(output_path, "x", encoding="utf-8")
+        except FileExistsError:
+            name = None
 
 
 async def fetch_api_data(url: str, method: str, headers: Dict = None, params: Dict = None, filename: str = None) -> Dict[str, Any]:
@@ -25,47 +46,36 @@ async def fetch_api_data(url: str, method: str, headers: Dict = None, params: Di
     if not params:
         params = {}
 
-    if not filename:
-        id = random.randint(1000000, 9999999)
-        output_path = f"./userdata_buffer/{id}.json"
-        while os.path.exists(output_path):
-            id = random.randint(1000000, 9999999)
-            output_path = f"./userdata_buffer/{id}.json"
-    else:
-        filename = os.path.basename(filename)
-        output_path = f"./userdata_buffer/{filename}"
-        while os.path.exists(output_path):
-            id = random.randint(1000000, 9999999)
-            output_path = f"./userdata_buffer/{id}.json"
     try:
-        async with aiohttp.ClientSession() as session:
-            if method.upper() == "GET":
-                async with session.get(url, headers=headers, params=params) as response:
-                    status_code = response.status
-                    text = await response.text()
+        # одна теплая сессия на event loop: соединения переиспользуются между задачами
+        session = await RESOURCES.get(("aiohttp", "api_ops"), aiohttp.ClientSession, loop_bound=True)
+        if method.upper() == "GET":
+            async with session.get(url, headers=headers, params=params) as response:
+                status_code = response.status
+                text = await response.text()
 
-                    # Пытаемся распарсить JSON, если это возможно
-                    try:
-                        data = await response.json()
-                    except:
-                        data = text
+                # Пытаемся распарсить JSON, если это возможно
+                try:
+                    data = await response.json()
+                except:
+                    data = text
 
-            elif method.upper() == "POST":
-                async with session.post(url, headers=headers, json=params) as response:
-                    status_code = response.status
-                    text = await response.text()
-                    try:
-                        data = await response.json()
-                    except:
-                        data = text
-            else:
-                raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
+        elif method.upper() == "POST":
+            async with session.post(url, headers=headers, json=params) as response:
+                status_code = response.status
+                text = await response.text()
+                try:
+                    data = await response.json()
+                except:
+                    data = text
+        else:
+            raise ValueError(f"Неподдерживаемый HTTP метод: {method}")
 
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+        output_path, f = _create_output(filename)
+        with f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
 
-            return {"output_file_path": output_path}
+        return {"output_file_path": output_path}
 
     except Exception as e:
         raise ConnectionError(f"Request failed: {str(e)}") from e
\ No newline at end of file
@@ -1,10 +1,32 @@
 import asyncio
+import contextlib
 import json
-import yaml
-import csv
-import pandas as pd
-from typing import Dict, Any, List
-import io
+import os
+import random
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Dict, Any, List, Iterator, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# pandas и numpy импортируются внутри функций: простые операции модуля
+# (json_to_string, dict_to_string) не должны платить за их загрузку
+
+DEFAULT_CHUNKSIZE = 100_000
+OUTPUT_DIR = "./userdata_buffer"
+
+# расширение файла -> формат, в котором операции читают и пишут данные
+FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".json": "json",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".npy": "npy",
+}
+EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "json": ".jsonl", "parquet": ".parquet", "arrow": ".arrow", "npy": ".npy"}
 
 async def dict_to_string(data: Dict) -> Dict[str, Any]:
     """
@@ -59,4 +81,422 @@ async def async_sleep(sleep_time: int = 10):
     # заглушка для тестов
     await asyncio.sleep(sleep_time)
     raise ValueError("стоп мне неприятно")
-    return {"sleep_succesfull" : True}
\ No newline at end of file
+    return {"sleep_succesfull" : True}
+
+
+# --------------------
+# Чанковые операции над табличными файлами
+# --------------------
+
+def _file_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Неподдерживаемый формат файла: {path}")
+    return FORMATS[extension]
+
+
+def buffer_output_path(output_format: str) -> str:
+    """Свободный путь в ./userdata_buffer (оркестратор потом перенесет файл в папку DAG)"""
+    if output_format not in EXTENSIONS:
+        raise ValueError(f"Неподдерживаемый формат вывода: {output_format}")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_path = f"{OUTPUT_DIR}/{random.randint(1000000, 9999999)}{EXTENSIONS[output_format]}"
+    while os.path.exists(output_path):
+        output_path = f"{OUTPUT_DIR}/{random.randint(1000000, 9999999)}{EXTENSIONS[output_format]}"
+    return output_path
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Для форматов parquet/arrow нужен пакет pyarrow") from e
+    return pyarrow
+
+
+def iter_chunks(path: str, chunksize: int = DEFAULT_CHUNKSIZE, columns: Optional[List[str]] = None) -> Iterator["pd.DataFrame"]:
+    """
+    Читает файл кусками по chunksize строк, не загружая его целиком
+
+    Args:
+        path: путь к csv/jsonl/json/parquet/arrow/npy файлу
+        chunksize: количество строк в одном куске
+        columns: читать только эти колонки (для parquet/arrow - без чтения остальных с диска)
+    """
+    import numpy as np
+    import pandas as pd
+
+    file_format = _file_format(path)
+
+    if file_format == "csv":
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+
+    elif file_format == "jsonl":
+        for chunk in pd.read_json(path, lines=True, chunksize=chunksize):
+            yield chunk[columns] if columns else chunk
+
+    elif file_format == "json":
+        # обычный JSON-массив не читается потоково - грузим целиком и режем
+        frame = pd.read_json(path)
+        frame = frame[columns] if columns else frame
+        for start in range(0, len(frame), chunksize):
+            yield frame.iloc[start:start + chunksize]
+
+    elif file_format == "parquet":
+        pa = _import_pyarrow()
+        parquet_file = pa.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    elif file_format == "arrow":
+        pa = _import_pyarrow()
+        with pa.memory_map(path, "r") as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                table = pa.Table.from_batches([reader.get_batch(index)])
+                if columns:
+                    table = table.select(columns)
+                for batch in table.to_batches(max_chunksize=chunksize):
+                    yield batch.to_pandas()
+
+    elif file_format == "npy":
+        array = np.load(path, mmap_mode="r")
+        if array.ndim == 1:
+            array = array.reshape(-1, 1)
+        names = [str(index) for index in range(array.shape[1])]
+        for start in range(0, array.shape[0], chunksize):
+            chunk = pd.DataFrame(np.asarray(array[start:start + chunksize]), columns=names)
+            yield chunk[columns] if columns else chunk
+
+
+class ChunkWriter:
+    """Пишет DataFrame-куски в один файл нужного формата по мере поступления"""
+
+    def __init__(self, path: str, output_format: str):
+        self.path = path
+        self.output_format = output_format
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        self._file = None
+        self._dtype = None
+        self._columns = None
+
+    def write(self, chunk: "pd.DataFrame"):
+        import numpy as np
+
+        if self.output_format == "csv":
+            chunk.to_csv(self.path, mode="a", header=self.rows == 0, index=False)
+
+        elif self.output_format in ("jsonl", "json"):
+            if len(chunk):
+                with open(self.path, "a", encoding="utf-8") as file:
+                    chunk.to_json(file, orient="records", lines=True, force_ascii=False)
+
+        elif self.output_format in ("parquet", "arrow"):
+            pa = _import_pyarrow()
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._open_table_writer(table.schema)
+            else:
+                # типы куска CSV выводятся по его строкам: колонка, которая была числовой
+                # или пустой в первых кусках, дальше может оказаться текстом
+                schema = _widen_schema(self._schema, table.schema)
+                if not schema.equals(self._schema):
+                    self._rewrite_table(schema)
+            self._writer.write_table(table.cast(self._schema))
+
+        elif self.output_format == "npy":
+            # размер массива заранее неизвестен: данные копятся во временном файле,
+            # заголовок .npy дописывается в close()
+            dtype = _npy_dtype(chunk)
+            if self._file is None:
+                self._dtype = dtype
+                self._columns = len(chunk.columns)
+                self._file = tempfile.NamedTemporaryFile(dir=os.path.dirname(self.path) or ".", delete=False)
+            elif len(chunk.columns) != self._columns:
+                raise ValueError(f"npy output: chunk has {len(chunk.columns)} columns, expected {self._columns}")
+            else:
+                dtype = np.result_type(self._dtype, dtype)
+                if dtype != self._dtype:
+                    self._widen_npy(dtype)
+            self._file.write(np.ascontiguousarray(chunk.to_numpy(dtype=self._dtype)).tobytes())
+
+        self.rows += len(chunk)
+
+    def _open_table_writer(self, schema):
+        pa = _import_pyarrow()
+        self._schema = schema
+        if self.output_format == "parquet":
+            self._writer = pa.parquet.ParquetWriter(self.path, schema)
+        else:
+            self._file = pa.OSFile(self.path, "wb")
+            self._writer = pa.ipc.new_file(self._file, schema)
+
+    def _rewrite_table(self, schema):
+        """Переписывает уже записанные куски под расширенную схему (бывает не чаще пары раз на колонку)"""
+        pa = _import_pyarrow()
+        self._writer.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        previous_path = f"{self.path}.previous"
+        os.replace(self.path, previous_path)
+        self._open_table_writer(schema)
+        if self.output_format == "parquet":
+            for batch in pa.parquet.ParquetFile(previous_path).iter_batches():
+                self._writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        else:
+            with pa.memory_map(previous_path) as source:
+                reader = pa.ipc.open_file(source)
+                for index in range(reader.num_record_batches):
+                    self._writer.write_table(pa.Table.from_batches([reader.get_batch(index)]).cast(schema))
+        os.remove(previous_path)
+
+    def _widen_npy(self, dtype):
+        """Переводит уже записанные во временный файл строки в более широкий числовой тип"""
+        import numpy as np
+
+        self._file.close()
+        previous_path = f"{self._file.name}.previous"
+        os.replace(self._file.name, previous_path)
+        self._file = open(self._file.name, "wb")
+        if self.rows:
+            previous = np.memmap(previous_path, dtype=self._dtype, mode="r", shape=(self.rows, self._columns))
+            for start in range(0, self.rows, DEFAULT_CHUNKSIZE):
+                self._file.write(
+                    np.ascontiguousarray(previous[start:start + DEFAULT_CHUNKSIZE], dtype=dtype).tobytes()
+                )
+            del previous
+        os.remove(previous_path)
+        self._dtype = dtype
+
+    def close(self):
+        import numpy as np
+
+        if self.output_format in ("parquet", "arrow") and self._writer is not None:
+            self._writer.close()
+            if self._file is not None:
+                self._file.close()
+
+        elif self.output_format == "npy":
+            if self._file is None:
+                np.save(self.path, np.empty((0, 0)))
+                return
+            self._file.close()
+            header = {"descr": np.lib.format.dtype_to_descr(np.dtype(self._dtype)),
+                      "fortran_order": False, "shape": (self.rows, self._columns)}
+            with open(self.path, "wb") as output, open(self._file.name, "rb") as data:
+                np.lib.format.write_array_header_1_0(output, header)
+                shutil.copyfileobj(data, output)
+            os.remove(self._file.name)
+
+        elif self.rows == 0:
+            # пустой результат - все равно создаем файл
+            open(self.path, "a").close()
+
+
+def _widen_schema(schema, other):
+    """Схема, к которой приводятся обе: числа - к float64, пустые (null) колонки - к типу
+    другой схемы, остальные расхождения - к строке"""
+    pa = _import_pyarrow()
+    numeric = (pa.types.is_integer, pa.types.is_floating, pa.types.is_boolean)
+    other_types = {field.name: field.type for field in other}
+    fields = []
+    for field in schema:
+        new_type = other_types.get(field.name, field.type)
+        if new_type.equals(field.type) or pa.types.is_null(new_type):
+            widened = field.type
+        elif pa.types.is_null(field.type):
+            widened = new_type
+        elif any(check(field.type) for check in numeric) and any(check(new_type) for check in numeric):
+            widened = pa.float64()
+        else:
+            widened = pa.string()
+        fields.append(field.with_type(widened))
+    # pandas-метаданные первого куска описывают старые типы - не переносим их
+    return pa.schema(fields)
+
+
+def _npy_dtype(chunk: "pd.DataFrame"):
+    """Числовой dtype для npy; текстовые колонки не пишутся (в .npy попали бы указатели на объекты)"""
+    import numpy as np
+    from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+    if not len(chunk.columns):
+        return np.dtype(np.float64)
+    text = [str(name) for name, dtype in chunk.dtypes.items() if not (is_numeric_dtype(dtype) or is_bool_dtype(dtype))]
+    if text:
+        raise ValueError(f"npy output supports only numeric columns, got non-numeric: {', '.join(text)}")
+    return np.result_type(*chunk.dtypes)
+
+
+def _checked_input(path: str) -> str:
+    """Входной файл операции: те же ограничения, что у файловых операций (file_ops.input_path)"""
+    from . import file_ops
+
+    return file_ops.input_path(path)
+
+
+def _transform_file(input_path: str, output_format: str, transform, chunksize: int, columns=None) -> Dict[str, Any]:
+    """Прогоняет файл через transform(chunk) -> chunk и пишет результат в ./userdata_buffer"""
+    input_path = _checked_input(input_path)
+    output_path = buffer_output_path(output_format)
+    writer = ChunkWriter(output_path, output_format)
+    try:
+        for chunk in iter_chunks(input_path, chunksize=chunksize, columns=columns):
+            writer.write(transform(chunk))
+    except BaseException:
+        # недописанный файл не должен выглядеть как результат
+        with contextlib.suppress(Exception):
+            writer.close()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    writer.close()
+    return {"output_file_path": output_path, "rows": writer.rows, "format": output_format}
+
+
+async def filter_rows(input_path: str, query: str, output_format: str = "parquet",
+                      chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, Any]:
+    """
+    Фильтрует строки файла векторизованным выражением pandas (DataFrame.query)
+
+    Args:
+        input_path: входной файл
+        query: выражение, например "price > 100 and country == 'RU'"
+        output_format: csv/jsonl/parquet/arrow/npy
+        chunksize: строк в одном куске
+    """
+    return await asyncio.to_thread(
+        _transform_file, input_path, output_format, lambda chunk: chunk.query(query), chunksize
+    )
+
+
+async def select_columns(input_path: str, columns: List[str], output_format: str = "parquet",
+                         chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, Any]:
+    """
+    Оставляет в файле только указанные колонки (проекция)
+
+    Args:
+        input_path: входной файл
+        columns: список колонок в нужном порядке
+        output_format: csv/jsonl/parquet/arrow/npy
+        chunksize: строк в одном куске
+    """
+    return await asyncio.to_thread(
+        _transform_file, input_path, output_format, lambda chunk: chunk[columns], chunksize, columns
+    )
+
+
+async def convert_format(input_path: str, output_format: str = "parquet",
+                         chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, Any]:
+    """
+    Конвертирует файл между csv/jsonl/json/parquet/arrow/npy кусками
+
+    Args:
+        input_path: входной файл
+        output_format: csv/jsonl/parquet/arrow/npy
+        chunksize: строк в одном куске
+    """
+    return await asyncio.to_thread(_transform_file, input_path, output_format, lambda chunk: chunk, chunksize)
+
+
+# частичные агрегаты, которые можно складывать между кусками
+_PARTIAL_AGGREGATIONS = {
+    "sum": ["sum"],
+    "count": ["count"],
+    "min": ["min"],
+    "max": ["max"],
+    "mean": ["sum", "count"],
+}
+_COMBINE = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+
+def _aggregate_file(input_path, group_by, aggregations, output_format, chunksize):
+    import pandas as pd
+
+    for column, how in aggregations.items():
+        if how not in _PARTIAL_AGGREGATIONS:
+            raise ValueError(f"Неподдерживаемая агрегация {how} для колонки {column}")
+    input_path = _checked_input(input_path)
+
+    partial_spec = {
+        f"{column}__{part}": pd.NamedAgg(column=column, aggfunc=part)
+        for column, how in aggregations.items()
+        for part in _PARTIAL_AGGREGATIONS[how]
+    }
+    columns = list(dict.fromkeys(list(group_by) + list(aggregations)))
+
+    # каждый кусок сворачивается до частичных агрегатов, их объем ~ числу групп, а не строк
+    partials = None
+    for chunk in iter_chunks(input_path, chunksize=chunksize, columns=columns):
+        partial = chunk.groupby(group_by, dropna=False).agg(**partial_spec)
+        partials = partial if partials is None else pd.concat([partials, partial])
+        partials = partials.groupby(level=list(range(len(group_by))), dropna=False).agg(
+            {name: _COMBINE[name.rsplit("__", 1)[1]] for name in partial_spec}
+        )
+
+    result = pd.DataFrame(index=partials.index if partials is not None else None)
+    for column, how in aggregations.items():
+        # агрегат по колонке группировки не должен перетирать ключ
+        name = f"{column}_{how}" if column in group_by else column
+        if partials is None:
+            result[name] = []
+        elif how == "mean":
+            result[name] = partials[f"{column}__sum"] / partials[f"{column}__count"]
+        else:
+            result[name] = partials[f"{column}__{how}"]
+
+    output_path = buffer_output_path(output_format)
+    writer = ChunkWriter(output_path, output_format)
+    try:
+        writer.write(result.reset_index())
+    finally:
+        writer.close()
+    return {"output_file_path": output_path, "rows": writer.rows, "format": output_format}
+
+
+async def aggregate(input_path: str, group_by: List[str], aggregations: Dict[str, str],
+                    output_format: str = "parquet", chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, Any]:
+    """
+    Группировка с агрегатами, считается кусками (в памяти только частичные агрегаты по группам)
+
+    Args:
+        input_path: входной файл
+        group_by: колонки группировки
+        aggregations: {колонка: sum/count/min/max/mean}
+        output_format: csv/jsonl/parquet/arrow/npy
+        chunksize: строк в одном куске
+    """
+    return await asyncio.to_thread(_aggregate_file, input_path, group_by, aggregations, output_format, chunksize)
+
+
+def _join_files(left_path, right_path, on, how, output_format, chunksize):
+    import pandas as pd
+
+    if how not in ("inner", "left"):
+        raise ValueError(f"Поддерживаются только inner и left join, получено: {how}")
+    # правая таблица - build-сторона (должна помещаться в память), левая читается кусками
+    right = pd.concat(list(iter_chunks(_checked_input(right_path), chunksize=chunksize)), ignore_index=True)
+    return _transform_file(
+        left_path, output_format, lambda chunk: chunk.merge(right, on=on, how=how), chunksize
+    )
+
+
+async def join_files(left_path: str, right_path: str, on: List[str], how: str = "inner",
+                     output_format: str = "parquet", chunksize: int = DEFAULT_CHUNKSIZE) -> Dict[str, Any]:
+    """
+    Join двух файлов: левый читается кусками, правый (меньший) целиком держится в памяти
+
+    Args:
+        left_path: большой файл
+        right_path: справочник, который помещается в память
+        on: колонки соединения
+        how: inner или left
+        output_format: csv/jsonl/parquet/arrow/npy
+        chunksize: строк в одном куске
+    """
+    return await asyncio.to_thread(_join_files, left_path, right_path, on, how, output_format, chunksize)
@@ -0,0 +1,316 @@
+import asyncio
+import errno
+import hashlib
+import mimetypes
+import mmap
+import os
+import shutil
+from typing import Any, Dict, List
+
+from .data_ops import OUTPUT_DIR
+
+COPY_CHUNK = 64 * 1024 * 1024
+HASH_CHUNK = 8 * 1024 * 1024
+# откуда операции берут входные файлы: буфер результатов операций и папки запусков
+# (dag_storage.DAGS_ROOT) - путь приходит из конфига пользователя
+INPUT_ROOTS = (OUTPUT_DIR, "./dags")
+
+
+# --------------------
+# Низкоуровневые помощники (используются и оркестратором)
+# --------------------
+
+def input_path(path: str, roots=INPUT_ROOTS) -> str:
+    """Реальный путь входного файла операции; файлы вне roots (orchestrator.db, .env) не отдаются"""
+    real = os.path.realpath(path)
+    for root in roots:
+        root = os.path.realpath(root)
+        if os.path.commonpath([real, root]) == root:
+            return real
+    raise ValueError(f"File '{path}' is outside of allowed directories: {', '.join(roots)}")
+
+
+def _buffer_path(filename: str) -> str:
+    """Свободный путь в ./userdata_buffer с сохранением имени файла"""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    name = os.path.basename(filename)
+    path = os.path.join(OUTPUT_DIR, name)
+    stem, extension = os.path.splitext(name)
+    index = 1
+    while os.path.exists(path):
+        path = os.path.join(OUTPUT_DIR, f"{stem}_{index}{extension}")
+        index += 1
+    return path
+
+
+def _copy_range(source, destination, offset: int, count: int) -> int:
+    """Копирует count байт из source (с offset) в текущую позицию destination в ядре
+
+    copy_file_range (Linux) -> sendfile -> обычное чтение/запись. Файлы должны быть
+    открыты с buffering=0, чтобы запись из Python и из ядра шла по одной позиции.
+    Возвращает количество скопированных байт.
+    """
+    source_fd, destination_fd = source.fileno(), destination.fileno()
+    copied = 0
+
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied < count:
+                sent = os.copy_file_range(source_fd, destination_fd, min(COPY_CHUNK, count - copied),
+                                          offset + copied)
+                if sent == 0:
+                    break
+                copied += sent
+            return copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                raise
+
+    if hasattr(os, "sendfile"):
+        try:
+            while copied < count:
+                sent = os.sendfile(destination_fd, source_fd, offset + copied, min(COPY_CHUNK, count - copied))
+                if sent == 0:
+                    break
+                copied += sent
+            return copied
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+
+    source.seek(offset + copied)
+    while copied < count:
+        block = source.read(min(1024 * 1024, count - copied))
+        if not block:
+            break
+        destination.write(block)
+        copied += len(block)
+    return copied
+
+
+def fast_copy(source_path: str, destination_path: str) -> int:
+    """Копирует файл без прохода данных через Python, возвращает размер"""
+    size = os.path.getsize(source_path)
+    with open(source_path, "rb", buffering=0) as source, open(destination_path, "wb", buffering=0) as destination:
+        copied = _copy_range(source, destination, 0, size)
+    shutil.copymode(source_path, destination_path)
+    return copied
+
+
+def move_file(source_path: str, destination_path: str) -> str:
+    """Переносит файл; между файловыми системами (EXDEV) - копия во временный файл и rename"""
+    try:
+        os.replace(source_path, destination_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        temp_path = f"{destination_path}.part"
+        fast_copy(source_path, temp_path)
+        with open(temp_path, "rb") as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, destination_path)
+        os.remove(source_path)
+    return destination_path
+
+
+def digest_file(path: str, algorithm: str = "sha256") -> str:
+    """Хэш файла через mmap: страницы читаются ядром, без копирования в bytes"""
+    hasher = hashlib.new(algorithm)
+    size = os.path.getsize(path)
+    if size == 0:
+        return hasher.hexdigest()
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, size, HASH_CHUNK):
+                hasher.update(view[offset:offset + HASH_CHUNK])
+        finally:
+            view.release()
+    return hasher.hexdigest()
+
+
+def artifact_handle(path: str, **extra) -> Dict[str, Any]:
+    """Описание файла-результата вместо его содержимого"""
+    stat = os.stat(path)
+    media_type, _ = mimetypes.guess_type(path)
+    return {
+        "name": os.path.basename(path),
+        "size": stat.st_size,
+        "media_type": media_type or "application/octet-stream",
+        **extra,
+    }
+
+
+# --------------------
+# Операции
+# --------------------
+
+def _copy(source_path, filename):
+    source_path = input_path(source_path)
+    output_path = _buffer_path(filename or source_path)
+    fast_copy(source_path, output_path)
+    return {"output_file_path": output_path, "artifact": artifact_handle(output_path)}
+
+
+async def copy_file(source_path: str, filename: str = None) -> Dict[str, Any]:
+    """
+    Копирует файл (copy_file_range/sendfile - без чтения в память процесса)
+
+    Args:
+        source_path: исходный файл (в userdata_buffer или папке запуска)
+        filename: имя копии (по умолчанию - имя исходного файла)
+    """
+    return await asyncio.to_thread(_copy, source_path, filename)
+
+
+def _move(source_path, filename):
+    # переносить (удаляя оригинал) можно только из буфера: файлы запусков остаются на месте
+    source_path = input_path(source_path, roots=(OUTPUT_DIR,))
+    output_path = _buffer_path(filename or source_path)
+    move_file(source_path, output_path)
+    return {"output_file_path": output_path, "artifact": artifact_handle(output_path)}
+
+
+async def move_file_op(source_path: str, filename: str = None) -> Dict[str, Any]:
+    """
+    Переносит файл (с переименованием), в том числе между файловыми системами
+
+    Args:
+        source_path: исходный файл (только из userdata_buffer)
+        filename: новое имя файла
+    """
+    return await asyncio.to_thread(_move, source_path, filename)
+
+
+def _concat(paths, filename):
+    paths = [input_path(path) for path in paths]
+    output_path = _buffer_path(filename or "concat.bin")
+    with open(output_path, "wb", buffering=0) as destination:
+        for path in paths:
+            with open(path, "rb", buffering=0) as source:
+                _copy_range(source, destination, 0, os.path.getsize(path))
+    return {"output_file_path": output_path, "artifact": artifact_handle(output_path, parts=len(paths))}
+
+
+async def concat_files(paths: List[str], filename: str = None) -> Dict[str, Any]:
+    """
+    Склеивает файлы по порядку в один
+
+    Args:
+        paths: список файлов (например, output_file_path mapped-задачи)
+        filename: имя результата
+    """
+    return await asyncio.to_thread(_concat, paths, filename)
+
+
+def _split_offsets(path: str, part_size: int, align_lines: bool) -> List[int]:
+    """Границы частей; при align_lines граница сдвигается на конец строки (поиск в mmap)"""
+    size = os.path.getsize(path)
+    offsets = [0]
+    if size == 0:
+        return offsets + [0]
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        while offsets[-1] < size:
+            boundary = min(offsets[-1] + part_size, size)
+            if align_lines and boundary < size:
+                newline = mapped.find(b"\n", boundary - 1)
+                boundary = size if newline == -1 else newline + 1
+            offsets.append(boundary)
+    return offsets
+
+
+def _split(source_path, part_size, align_lines):
+    source_path = input_path(source_path)
+    offsets = _split_offsets(source_path, part_size, align_lines)
+    stem, extension = os.path.splitext(os.path.basename(source_path))
+    paths = []
+    with open(source_path, "rb", buffering=0) as source:
+        for index, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            output_path = _buffer_path(f"{stem}.part{index:04d}{extension}")
+            with open(output_path, "wb", buffering=0) as destination:
+                _copy_range(source, destination, start, end - start)
+            paths.append(output_path)
+    return {
+        "output_file_paths": paths,
+        "artifacts": [artifact_handle(path) for path in paths],
+    }
+
+
+async def split_file(source_path: str, part_size: int = 64 * 1024 * 1024, align_lines: bool = True) -> Dict[str, Any]:
+    """
+    Режет файл на части по part_size байт
+
+    Args:
+        source_path: исходный файл (в userdata_buffer или папке запуска)
+        part_size: размер части в байтах
+        align_lines: не разрывать строки (для csv/jsonl)
+    """
+    return await asyncio.to_thread(_split, source_path, part_size, align_lines)
+
+
+def _hash(path, algorithm):
+    path = input_path(path)
+    digest = digest_file(path, algorithm)
+    return {"digest": digest, "algorithm": algorithm, "artifact": artifact_handle(path, **{algorithm: digest})}
+
+
+async def hash_file(path: str, algorithm: str = "sha256") -> Dict[str, Any]:
+    """
+    Считает хэш файла кусками через mmap
+
+    Args:
+        path: файл (в userdata_buffer или папке запуска)
+        algorithm: sha256, sha1, md5, blake2b, ...
+    """
+    return await asyncio.to_thread(_hash, path, algorithm)
+
+
+def _compress(source_path, compression, level):
+    source_path = input_path(source_path)
+    if compression == "gzip":
+        import gzip
+
+        output_path = _buffer_path(os.path.basename(source_path) + ".gz")
+        opener = lambda: gzip.open(output_path, "wb", compresslevel=level)
+    elif compression == "bz2":
+        import bz2
+
+        output_path = _buffer_path(os.path.basename(source_path) + ".bz2")
+        opener = lambda: bz2.open(output_path, "wb", compresslevel=level)
+    elif compression == "xz":
+        import lzma
+
+        output_path = _buffer_path(os.path.basename(source_path) + ".xz")
+        opener = lambda: lzma.open(output_path, "wb", preset=level)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError("Для zstd нужен пакет zstandard") from e
+
+        output_path = _buffer_path(os.path.basename(source_path) + ".zst")
+        opener = lambda: zstandard.ZstdCompressor(level=level).stream_writer(open(output_path, "wb"))
+    else:
+        raise ValueError(f"Неподдерживаемое сжатие: {compression}")
+
+    with open(source_path, "rb") as source, opener() as destination:
+        shutil.copyfileobj(source, destination, 1024 * 1024)
+    original_size = os.path.getsize(source_path)
+    return {
+        "output_file_path": output_path,
+        "artifact": artifact_handle(output_path, original_size=original_size, compression=compression),
+    }
+
+
+async def compress_file(source_path: str, compression: str = "gzip", level: int = 6) -> Dict[str, Any]:
+    """
+    Потоково сжимает файл
+
+    Args:
+        source_path: исходный файл (в userdata_buffer или папке запуска)
+        compression: gzip, bz2, xz или zstd (нужен zstandard)
+        level: уровень сжатия
+    """
+    return await asyncio.to_thread(_compress, source_path, compression, level)
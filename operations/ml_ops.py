@@ -0,0 +1,288 @@
+import asyncio
+import os
+import pickle
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MODELS_DIR = os.getenv("TASKFLOW_MODELS_DIR", "./models")
+MODEL_CACHE_SIZE = int(os.getenv("TASKFLOW_MODEL_CACHE_SIZE", "8"))
+
+
+class LinearModel:
+    """Линейная модель из .npz (coef, intercept) - инференс на чистом NumPy"""
+
+    def __init__(self, coef: "np.ndarray", intercept: "np.ndarray"):
+        self.coef = coef
+        self.intercept = intercept
+        self.n_features_in_ = coef.shape[-1]
+
+    def predict(self, features: "np.ndarray") -> "np.ndarray":
+        return features @ self.coef.T + self.intercept
+
+
+class OnnxModel:
+    """Обертка над onnxruntime.InferenceSession с интерфейсом predict()"""
+
+    def __init__(self, path: str):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, features: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        return self.session.run(None, {self.input_name: features.astype(np.float32)})[0]
+
+
+def _load_model(path: str):
+    """Загружает модель по расширению: .pkl/.pickle/.joblib (sklearn), .onnx, .npz"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".pkl", ".pickle"):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    if extension == ".joblib":
+        import joblib
+
+        return joblib.load(path)
+    if extension == ".onnx":
+        return OnnxModel(path)
+    if extension == ".npz":
+        import numpy as np
+
+        weights = np.load(path)
+        return LinearModel(weights["coef"], weights["intercept"])
+    raise ValueError(f"Неподдерживаемый формат модели: {path}")
+
+
+def model_path(name: str) -> str:
+    """Путь к модели внутри TASKFLOW_MODELS_DIR (модели грузятся только оттуда)"""
+    return os.path.join(MODELS_DIR, os.path.basename(name))
+
+
+class ModelCache:
+    """LRU-кэш загруженных моделей
+
+    Ключ - путь и mtime файла, поэтому перезаписанная модель загрузится заново.
+    Одновременные запросы одной модели дожидаются одной загрузки. Микробатчеры
+    модели хранятся вместе с ней и вытесняются вместе с ней.
+    """
+
+    def __init__(self, max_models: int = MODEL_CACHE_SIZE):
+        self.max_models = max_models
+        self._models: "OrderedDict[Tuple[str, float], Any]" = OrderedDict()
+        self._loading: Dict[Tuple[str, float], asyncio.Future] = {}
+        # {ключ модели: {(метод, event loop): MicroBatcher}}
+        self._batchers: Dict[Tuple[str, float], Dict[Tuple[str, int], "MicroBatcher"]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, path: str) -> Tuple[Tuple[str, float], Any]:
+        key = (os.path.abspath(path), os.path.getmtime(path))
+        if key in self._models:
+            self._models.move_to_end(key)
+            self.hits += 1
+            return key, self._models[key]
+        if key in self._loading:
+            self.hits += 1
+            return key, await asyncio.shield(self._loading[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            model = await asyncio.to_thread(_load_model, path)
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                self._batchers.pop(evicted, None)
+            future.set_result(model)
+            return key, model
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    def batcher(self, key: Tuple[str, float], model: Any, method: str, max_batch_size: int,
+                max_wait: float) -> "MicroBatcher":
+        """Микробатчер модели для метода в текущем event loop"""
+        batcher_key = (method, id(asyncio.get_running_loop()))
+        batchers = self._batchers.get(key, {}) if key in self._models else {}
+        batcher = batchers.get(batcher_key)
+        if batcher is None or batcher.model is not model:
+            batcher = MicroBatcher(model, method=method, max_batch_size=max_batch_size, max_wait=max_wait)
+            if key in self._models:
+                # модель уже вытеснена - батчер не запоминаем, иначе он держал бы ее в памяти
+                self._batchers.setdefault(key, {})[batcher_key] = batcher
+        return batcher
+
+    def clear(self):
+        self._models.clear()
+        self._batchers.clear()
+
+
+class MicroBatcher:
+    """Склеивает одновременные вызовы одной модели в один векторизованный вызов
+
+    Запросы копятся, пока в батче меньше max_batch_size строк и с первого запроса
+    прошло меньше max_wait секунд, затем model.<method>(np.vstack(...)) выполняется
+    в пуле потоков, а результат режется обратно по запросам. В один вызов идут только
+    запросы одной ширины; если вызов упал, каждый запрос батча повторяется отдельно,
+    чтобы ошибка одного запроса не досталась остальным.
+    """
+
+    def __init__(self, model: Any, method: str = "predict", max_batch_size: int = 256, max_wait: float = 0.005):
+        self.model = model
+        self.method = method
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "asyncio.Queue[Tuple[np.ndarray, asyncio.Future]]" = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.rows = 0
+
+    async def submit(self, rows: "np.ndarray") -> "np.ndarray":
+        expected = getattr(self.model, "n_features_in_", None)
+        if expected is not None and rows.shape[-1] != expected:
+            raise ValueError(f"Model expects {expected} features, got {rows.shape[-1]}")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[0].shape[1:], item[0].dtype), []).append(item)
+            for group in groups.values():
+                await self._run_batch(group)
+
+    async def _run_batch(self, batch):
+        import numpy as np
+
+        try:
+            features = np.vstack([rows for rows, _ in batch])
+            predictions = np.asarray(await asyncio.to_thread(getattr(self.model, self.method), features))
+            if len(predictions) != len(features):
+                raise ValueError(f"Model returned {len(predictions)} predictions for {len(features)} rows")
+        except Exception as e:
+            if len(batch) > 1:
+                for item in batch:
+                    await self._run_batch([item])
+                return
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.rows += len(features)
+        offset = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(predictions[offset:offset + len(rows)])
+            offset += len(rows)
+
+
+MODEL_CACHE = ModelCache()
+
+
+async def ml_predict(model: str, features: List, method: str = "predict",
+                     max_batch_size: int = 256, max_wait_ms: float = 5) -> Dict[str, Any]:
+    """
+    Инференс модели на CPU с микробатчингом одновременных вызовов
+
+    Args:
+        model: имя файла модели в TASKFLOW_MODELS_DIR (.pkl/.joblib/.onnx/.npz)
+        features: одна строка признаков или список строк
+        method: метод модели (predict, predict_proba, ...)
+        max_batch_size: максимум строк в одном вызове модели
+        max_wait_ms: сколько ждать других вызовов для склейки в батч
+    """
+    import numpy as np
+
+    rows = np.asarray(features, dtype=float)
+    single = rows.ndim == 1
+    if single:
+        rows = rows.reshape(1, -1)
+
+    key, loaded = await MODEL_CACHE.get(model_path(model))
+    batcher = MODEL_CACHE.batcher(key, loaded, method, max_batch_size, max_wait_ms / 1000)
+    predictions = await batcher.submit(rows)
+    return {"predictions": predictions[0].tolist() if single else predictions.tolist()}
+
+
+def _predict_file(loaded, input_path, columns, method, output_format, output_column, chunksize):
+    from .data_ops import ChunkWriter, buffer_output_path, iter_chunks
+
+    output_path = buffer_output_path(output_format)
+    writer = ChunkWriter(output_path, output_format)
+    started = time.perf_counter()
+    try:
+        for chunk in iter_chunks(input_path, chunksize=chunksize):
+            features = chunk[columns] if columns else chunk
+            predictions = getattr(loaded, method)(features.to_numpy(dtype=float))
+            if getattr(predictions, "ndim", 1) > 1 and predictions.shape[1] == 1:
+                predictions = predictions.ravel()
+            chunk = chunk.copy()
+            if getattr(predictions, "ndim", 1) > 1:
+                for index in range(predictions.shape[1]):
+                    chunk[f"{output_column}_{index}"] = predictions[:, index]
+            else:
+                chunk[output_column] = predictions
+            writer.write(chunk)
+    finally:
+        writer.close()
+    return {
+        "output_file_path": output_path,
+        "rows": writer.rows,
+        "format": output_format,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+async def ml_predict_file(model: str, input_path: str, columns: List[str] = None, method: str = "predict",
+                          output_format: str = "parquet", output_column: str = "prediction",
+                          chunksize: int = 100_000) -> Dict[str, Any]:
+    """
+    Скоринг табличного файла моделью: кусками, одним векторизованным вызовом на кусок
+
+    Args:
+        model: имя файла модели в TASKFLOW_MODELS_DIR
+        input_path: входной файл (csv/jsonl/parquet/arrow/npy)
+        columns: колонки-признаки (по умолчанию все)
+        method: метод модели (predict, predict_proba, ...)
+        output_format: формат файла с результатом
+        output_column: имя колонки с предсказанием
+        chunksize: строк в одном куске
+    """
+    from . import file_ops
+
+    input_path = file_ops.input_path(input_path)
+    _, loaded = await MODEL_CACHE.get(model_path(model))
+    return await asyncio.to_thread(
+        _predict_file, loaded, input_path, columns, method, output_format, output_column, chunksize
+    )
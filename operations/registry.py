@@ -0,0 +1,220 @@
+import asyncio
+import glob
+import importlib
+import importlib.util
+import logging
+import os
+import weakref
+from collections.abc import Mapping
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("taskflow")
+
+ENTRY_POINT_GROUP = "taskflow.operations"
+PLUGIN_DIR = os.getenv("TASKFLOW_PLUGIN_DIR", "./plugins")
+
+EXECUTORS = ("async", "thread")
+RESOURCE_CLASSES = ("io", "cpu", "memory")
+
+
+@dataclass(frozen=True)
+class OperationSpec:
+    """Метаданные операции, по которым оркестратор решает, как ее запускать
+
+    executor: async - корутина в event loop, thread - синхронная функция в пуле потоков
+    resource_class: io / cpu / memory - характер нагрузки
+    cacheable: результат зависит только от параметров и может переиспользоваться
+    idempotent: повторный запуск безопасен (можно ретраить и дублировать)
+    idempotent_methods: для HTTP-операций - при каких параметрах method вызов идемпотентен
+        (пусто - при любых)
+    concurrency_limit: сколько вызовов операции одновременно на процесс (None - без лимита)
+    """
+    name: str
+    target: str
+    executor: str = "async"
+    resource_class: str = "io"
+    cacheable: bool = False
+    idempotent: bool = False
+    idempotent_methods: Tuple[str, ...] = ()
+    concurrency_limit: Optional[int] = None
+
+    def __post_init__(self):
+        if self.executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{self.executor}' for operation '{self.name}'")
+        if self.resource_class not in RESOURCE_CLASSES:
+            raise ValueError(f"Unknown resource class '{self.resource_class}' for operation '{self.name}'")
+
+    def is_idempotent(self, params: Dict[str, Any]) -> bool:
+        """Идемпотентен ли вызов с этими параметрами (POST к API - нет, даже если GET - да)"""
+        if not self.idempotent:
+            return False
+        if self.idempotent_methods:
+            return str(params.get("method", "")).upper() in self.idempotent_methods
+        return True
+
+
+def operation(name: str = None, **metadata):
+    """Декоратор для плагинов: помечает функцию как операцию TaskFlow с метаданными
+
+    @operation("resize_image", executor="thread", resource_class="cpu", idempotent=True)
+    def resize_image(path: str, width: int): ...
+
+    Функции из plugin-папки регистрируются сразу, для entry points метаданные
+    читаются из атрибута при первой загрузке операции.
+    """
+    def decorator(func):
+        func.__taskflow_operation__ = {"name": name or func.__name__, **metadata}
+        _DECORATED.append(func)
+        return func
+    return decorator
+
+
+_DECORATED = []
+
+
+class OperationRegistry(Mapping):
+    """Реестр операций: имя -> "модуль:функция", модуль импортируется при первом обращении
+
+    Ведет себя как обычный dict операций (OPERATIONS["fetch_api_data"]), поэтому
+    оркестратор не знает о ленивой загрузке. Тяжелые зависимости (pandas, numpy)
+    грузятся только когда DAG действительно использует операцию из data_ops.
+    Сторонние операции находятся через entry points группы taskflow.operations
+    и *.py файлы в TASKFLOW_PLUGIN_DIR - при первом обращении к неизвестному имени.
+    """
+
+    def __init__(self, targets: Dict[str, str] = None, package: str = None):
+        self._specs: Dict[str, OperationSpec] = {}
+        self._package = package
+        self._loaded: Dict[str, Callable[..., Any]] = {}
+        self._discovered = False
+        for name, target in (targets or {}).items():
+            self.register(name, target)
+
+    def register(self, name: str, target, **metadata) -> OperationSpec:
+        """Добавляет операцию: функцию или строку "модуль:функция" для ленивой загрузки"""
+        if callable(target):
+            metadata = {**getattr(target, "__taskflow_operation__", {}), **metadata}
+            metadata.pop("name", None)
+            self._loaded[name] = target
+            target_path = f"{target.__module__}:{target.__qualname__}"
+        else:
+            self._loaded.pop(name, None)
+            target_path = target
+        spec = OperationSpec(name=name, target=target_path, **metadata)
+        self._specs[name] = spec
+        return spec
+
+    def spec(self, name: str) -> OperationSpec:
+        """Метаданные операции (для entry points - после загрузки функции)"""
+        if name not in self._specs:
+            self._discover()
+        if name not in self._loaded and self._specs[name].target.startswith(ENTRY_POINT_GROUP + "="):
+            self[name]
+        return self._specs[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def _discover(self):
+        if self._discovered:
+            return
+        self._discovered = True
+        self.discover_entry_points()
+        self.discover_plugin_dir(PLUGIN_DIR)
+
+    def discover_entry_points(self, group: str = ENTRY_POINT_GROUP):
+        """Регистрирует операции из entry points установленных пакетов (без импорта)"""
+        from importlib.metadata import entry_points
+
+        for entry_point in entry_points(group=group):
+            if entry_point.name in self._specs:
+                continue
+            self._specs[entry_point.name] = OperationSpec(
+                name=entry_point.name, target=f"{group}={entry_point.value}"
+            )
+            logger.info(f"Найдена операция {entry_point.name} ({entry_point.value})")
+
+    def discover_plugin_dir(self, path: str):
+        """Импортирует *.py из папки плагинов и регистрирует функции с @operation"""
+        for plugin_path in sorted(glob.glob(os.path.join(path, "*.py"))):
+            module_name = f"taskflow_plugins.{os.path.splitext(os.path.basename(plugin_path))[0]}"
+            module_spec = importlib.util.spec_from_file_location(module_name, plugin_path)
+            module = importlib.util.module_from_spec(module_spec)
+            try:
+                module_spec.loader.exec_module(module)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить плагин {plugin_path}: {e}")
+                continue
+            for func in list(_DECORATED):
+                if func.__module__ == module_name:
+                    name = func.__taskflow_operation__["name"]
+                    self.register(name, func)
+                    logger.info(f"Загружена операция {name} из {plugin_path}")
+
+    def __getitem__(self, name: str) -> Callable[..., Any]:
+        if name in self._loaded:
+            return self._loaded[name]
+        if name not in self._specs:
+            self._discover()
+        spec = self._specs[name]
+        target = spec.target.split("=", 1)[1] if spec.target.startswith(ENTRY_POINT_GROUP + "=") else spec.target
+        module_name, _, attr = target.partition(":")
+        module = importlib.import_module(module_name, package=self._package)
+        func = module
+        for part in attr.split("."):
+            func = getattr(func, part)
+        declared = dict(getattr(func, "__taskflow_operation__", {}))
+        declared.pop("name", None)
+        if declared:
+            self._specs[name] = replace(spec, **declared)
+        self._loaded[name] = func
+        return func
+
+    def __contains__(self, name) -> bool:
+        if name not in self._specs:
+            self._discover()
+        return name in self._specs
+
+    def __iter__(self):
+        self._discover()
+        return iter(self._specs)
+
+    def __len__(self) -> int:
+        self._discover()
+        return len(self._specs)
+
+
+def operation_spec(operations: Mapping, name: str) -> OperationSpec:
+    """Метаданные операции; для обычного dict операций - значения по умолчанию"""
+    if isinstance(operations, OperationRegistry):
+        return operations.spec(name)
+    return OperationSpec(name=name, target=name)
+
+
+# семафоры concurrency_limit: отдельные для каждого event loop
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def _limiter(spec: OperationSpec) -> Optional[asyncio.Semaphore]:
+    if not spec.concurrency_limit:
+        return None
+    loop_limiters = _limiters.setdefault(asyncio.get_running_loop(), {})
+    if spec.name not in loop_limiters:
+        loop_limiters[spec.name] = asyncio.Semaphore(spec.concurrency_limit)
+    return loop_limiters[spec.name]
+
+
+async def run_operation(func: Callable[..., Any], spec: OperationSpec, params: Dict[str, Any]):
+    """Вызывает операцию с учетом executor и concurrency_limit из ее метаданных"""
+    limiter = _limiter(spec)
+    if limiter is not None:
+        await limiter.acquire()
+    try:
+        if spec.executor == "thread":
+            return await asyncio.to_thread(func, **params)
+        return await func(**params)
+    finally:
+        if limiter is not None:
+            limiter.release()
@@ -0,0 +1,98 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Union
+
+logger = logging.getLogger("taskflow")
+
+
+class ResourcePool:
+    """Теплые ресурсы операций, живущие между задачами и запусками DAG
+
+    Операция получает ресурс по ключу (загруженная модель, HTTP-сессия, соединение)
+    и не пересоздает его на каждый вызов:
+
+        session = await RESOURCES.get(("aiohttp", "default"), aiohttp.ClientSession, loop_bound=True)
+
+    Создание одного ключа из нескольких задач одновременно выполняется один раз.
+    loop_bound=True - ресурс привязан к event loop (aiohttp-сессии) и создается
+    отдельно для каждого loop. ttl - через сколько секунд простоя ресурс пересоздать.
+    При закрытии пула у ресурсов вызываются close()/aclose(), если они есть.
+    """
+
+    def __init__(self):
+        self._resources: Dict[Hashable, Tuple[Any, float, Optional[float]]] = {}
+        self._creating: Dict[Hashable, asyncio.Future] = {}
+
+    def _key(self, key: Hashable, loop_bound: bool) -> Hashable:
+        return (key, id(asyncio.get_running_loop())) if loop_bound else key
+
+    async def get(self, key: Hashable, factory: Callable[[], Union[Any, Awaitable[Any]]],
+                  loop_bound: bool = False, ttl: Optional[float] = None) -> Any:
+        full_key = self._key(key, loop_bound)
+        entry = self._resources.get(full_key)
+        if entry is not None:
+            resource, last_used, entry_ttl = entry
+            if (entry_ttl is None or time.monotonic() - last_used < entry_ttl) and not _is_closed(resource):
+                self._resources[full_key] = (resource, time.monotonic(), entry_ttl)
+                return resource
+            del self._resources[full_key]
+            await _close(resource)
+
+        if full_key in self._creating:
+            return await asyncio.shield(self._creating[full_key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._creating[full_key] = future
+        try:
+            resource = factory()
+            if inspect.isawaitable(resource):
+                resource = await resource
+            self._resources[full_key] = (resource, time.monotonic(), ttl)
+            future.set_result(resource)
+            logger.info(f"Создан теплый ресурс {key}")
+            return resource
+        except BaseException as e:
+            future.set_exception(e)
+            # исключение уже отдано вызывающему - не логируем "never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._creating[full_key]
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Ресурс без привязки к loop, если он уже создан"""
+        entry = self._resources.get(key)
+        return entry[0] if entry else None
+
+    async def release(self, key: Hashable, loop_bound: bool = False):
+        """Закрывает и удаляет один ресурс"""
+        entry = self._resources.pop(self._key(key, loop_bound), None)
+        if entry is not None:
+            await _close(entry[0])
+
+    async def aclose(self):
+        """Закрывает все ресурсы (при остановке приложения)"""
+        resources, self._resources = self._resources, {}
+        for resource, _, _ in resources.values():
+            await _close(resource)
+
+
+def _is_closed(resource: Any) -> bool:
+    return bool(getattr(resource, "closed", False))
+
+
+async def _close(resource: Any):
+    close = getattr(resource, "aclose", None) or getattr(resource, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии ресурса {resource!r}: {e}")
+
+
+RESOURCES = ResourcePool()
@@ -1,69 +1,388 @@
 import aiohttp
 import asyncio
-from typing import Dict, Any
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional
 import os
 import json
+from .resources import RESOURCES
+
+logger = logging.getLogger("taskflow")
+
+# лимиты Telegram Bot API
+GLOBAL_RATE = 30        # сообщений в секунду на один токен
+CHAT_RATE = 1           # сообщений в секунду в один чат
+MAX_MESSAGE_LENGTH = 4096
+COALESCE_WINDOW = float(os.getenv("TASKFLOW_TG_COALESCE_WINDOW", "1.0"))
+MAX_SEND_ATTEMPTS = 5
+TELEGRAM_API_URL = os.getenv("TASKFLOW_TELEGRAM_API_URL", "https://api.telegram.org")
+
+TG_DATA_DIR = "./tg_data"
+USERS_DB = f"{TG_DATA_DIR}/tg_users.db"
+LEGACY_USERS_FILE = f"{TG_DATA_DIR}/tg_user_ids.json"
+CHAT_ID_TTL = float(os.getenv("TASKFLOW_TG_CHAT_ID_TTL", "3600"))
+# через сколько секунд простоя token bucket чата (и токена) забывается
+BUCKET_TTL = float(os.getenv("TASKFLOW_TG_BUCKET_TTL", "300"))
+
 
 class TelegramBot:
     def __init__(self, token: str):
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.base_url = f"{TELEGRAM_API_URL}/bot{token}"
 
 
-async def get_chat_id_by_username(username: str,  token: str) -> int:
+class ChatIdStore:
+    """Персистентный индекс username -> chat_id в SQLite
+
+    Username - первичный ключ, поэтому поиск идет по индексу, а не чтением всего
+    файла. Здесь же хранится номер последнего просмотренного update_id для
+    каждого бота (по хэшу токена). Старый tg_user_ids.json импортируется один раз.
+    """
+
+    def __init__(self, path: str = USERS_DB):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, updated_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS update_cursors (bot TEXT PRIMARY KEY, last_update_id INTEGER NOT NULL)"
+            )
+            if os.path.exists(LEGACY_USERS_FILE):
+                with open(LEGACY_USERS_FILE, "r", encoding="utf-8") as file:
+                    legacy = json.load(file)
+                connection.executemany(
+                    "INSERT OR IGNORE INTO users (username, chat_id, updated_at) VALUES (?, ?, ?)",
+                    [(username.lower(), chat_id, time.time()) for username, chat_id in legacy.items()],
+                )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get(self, username: str) -> Optional[int]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT chat_id FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, users: Dict[str, int]):
+        if not users:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT INTO users (username, chat_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET chat_id = excluded.chat_id, updated_at = excluded.updated_at",
+                [(username, chat_id, time.time()) for username, chat_id in users.items()],
+            )
+            connection.commit()
+
+    def get_cursor(self, token: str) -> int:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT last_update_id FROM update_cursors WHERE bot = ?", (_bot_key(token),)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def set_cursor(self, token: str, update_id: int):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT INTO update_cursors (bot, last_update_id) VALUES (?, ?) "
+                "ON CONFLICT(bot) DO UPDATE SET last_update_id = MAX(last_update_id, excluded.last_update_id)",
+                (_bot_key(token), update_id),
+            )
+            connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
 
-    bot = TelegramBot(token=token)
-    if username[0] == "@":
-        username = username[1:]
-    users = {}
-    if os.path.exists("./tg_data/tg_user_ids.json"):
-        with open("./tg_data/tg_user_ids.json", 'r', encoding='utf-8') as file:
-            users = json.load(file)
-        if username in users:
-            chat_id = users[username]
+def _bot_key(token: str) -> str:
+    """Токен не храним в открытом виде"""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def _normalize_username(username: str) -> str:
+    return username.lstrip("@").lower()
+
+
+class ChatIdResolver:
+    """username -> chat_id: словарь в памяти с TTL поверх ChatIdStore
+
+    При промахе просматриваются только новые обновления getUpdates (update_id больше
+    сохраненного), все найденные пользователи сразу попадают в индекс. Параметр offset
+    в Telegram не передается: он подтверждает обновления, и бот (bot.py) их бы не получил.
+    Одновременные запросы одного username ждут одного обращения к API.
+    """
+
+    def __init__(self, store: ChatIdStore = None, ttl: float = CHAT_ID_TTL):
+        self.store = store or ChatIdStore()
+        self.ttl = ttl
+        self._cache: Dict[str, tuple] = {}
+        self._lookups: Dict[tuple, asyncio.Future] = {}
+
+    async def remember(self, username: str, chat_id: int):
+        """Запоминает пользователя (например, когда он пишет боту)"""
+        if not username:
+            return
+        username = _normalize_username(username)
+        self._cache[username] = (chat_id, time.monotonic() + self.ttl)
+        await asyncio.to_thread(self.store.put_many, {username: chat_id})
+
+    def _cached(self, username: str) -> Optional[int]:
+        entry = self._cache.get(username)
+        if entry is None:
+            return None
+        chat_id, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._cache[username]
+            return None
+        return chat_id
+
+    async def resolve(self, username: str, token: str) -> int:
+        username = _normalize_username(username)
+        chat_id = self._cached(username)
+        if chat_id is not None:
             return chat_id
-    try:
-        async with aiohttp.ClientSession() as session:
-            response = await session.get(bot.base_url + "/getUpdates")
+
+        key = (id(asyncio.get_running_loop()), token, username)
+        if key in self._lookups:
+            return await asyncio.shield(self._lookups[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._lookups[key] = future
+        try:
+            chat_id = await asyncio.to_thread(self.store.get, username)
+            if chat_id is None:
+                chat_id = await self._scan_updates(username, token)
+            self._cache[username] = (chat_id, time.monotonic() + self.ttl)
+            future.set_result(chat_id)
+            return chat_id
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._lookups[key]
+
+    async def _scan_updates(self, username: str, token: str) -> int:
+        bot = TelegramBot(token=token)
+        cursor = await asyncio.to_thread(self.store.get_cursor, token)
+        session = await RESOURCES.get(("aiohttp", "telegram_ops"), aiohttp.ClientSession, loop_bound=True)
+        async with session.get(bot.base_url + "/getUpdates") as response:
             result = await response.json()
 
-            if not result["ok"]:
-                raise ConnectionError(f"Ошибка работы Telegram API: {result}")
+        if not result["ok"]:
+            raise ConnectionError(f"Ошибка работы Telegram API: {result}")
 
-            for update in result["result"]:
-                if "message" in update and "from" in update["message"]:
-                    update_username = update["message"]["from"]["username"]
+        found = {}
+        last_update_id = cursor
+        for update in result["result"]:
+            if update["update_id"] <= cursor:
+                continue
+            last_update_id = max(last_update_id, update["update_id"])
+            sender = update.get("message", {}).get("from", {})
+            if sender.get("username"):
+                found[sender["username"].lower()] = sender["id"]
 
-                    if update_username == username:
-                        chat_id = update["message"]["from"]["id"]
-                        print(f"Найден chat_id: {chat_id}")
-                        users[username] = chat_id
-                        with open("tg_user_ids.json", "w", encoding="utf-8") as file:
-                            json.dump(users, file, ensure_ascii=False, indent=4)
-                        return chat_id
+        await asyncio.to_thread(self.store.put_many, found)
+        if last_update_id > cursor:
+            await asyncio.to_thread(self.store.set_cursor, token, last_update_id)
+        expires_at = time.monotonic() + self.ttl
+        for found_username, chat_id in found.items():
+            self._cache[found_username] = (chat_id, expires_at)
 
+        if username not in found:
             raise ValueError(f"Пользователь @{username} не найден в истории обновлений")
-    except ValueError:
-        raise ValueError(f"Пользователь @{username} не найден в истории обновлений")
+        print(f"Найден chat_id: {found[username]}")
+        return found[username]
+
+
+CHAT_ID_RESOLVER = ChatIdResolver()
+
+
+async def get_chat_id_by_username(username: str,  token: str) -> int:
+    return await CHAT_ID_RESOLVER.resolve(username, token)
+
+
+class TokenBucket:
+    """Token bucket с резервированием: acquire() ждет ровно столько, сколько нужно до токена"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        """Забирает токен (в долг, если их нет) и возвращает, сколько секунд ждать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(wait, self.paused_until - now)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Блокирует выдачу токенов (после 429 retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float, ttl: float) -> bool:
+        """Не использовался дольше ttl и не на паузе - его можно заменить новым"""
+        return now - self.updated_at > max(ttl, self.capacity / self.rate) and now >= self.paused_until
 
 
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Режет текст на части не длиннее limit, по возможности по переносу строки или пробелу"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not parts:
+        parts.append(text)
+    return parts
 
 
+class TelegramSender:
+    """Общий отправитель сообщений с учетом лимитов Telegram
+
+    На каждый токен бота - общий token bucket (30 сообщений/с), на каждый чат - свой
+    (1 сообщение/с); простаивающие дольше bucket_ttl bucket-ы забываются. Сообщения в один чат, пришедшие в течение coalesce_window,
+    склеиваются в одно, длинные - режутся на части по 4096 символов. На ответ 429
+    отправитель ждет retry_after и повторяет отправку.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 coalesce_window: float = COALESCE_WINDOW, bucket_ttl: float = BUCKET_TTL):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.coalesce_window = coalesce_window
+        self.bucket_ttl = bucket_ttl
+        self._global_buckets: Dict[str, TokenBucket] = {}
+        self._chat_buckets: Dict[tuple, TokenBucket] = {}
+        self._pruned_at = time.monotonic()
+        self._pending: Dict[tuple, List[tuple]] = {}
+        self._workers: Dict[tuple, asyncio.Task] = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    async def send(self, token: str, chat_id: int, text: str) -> Dict[str, Any]:
+        """Ставит сообщение в очередь и ждет его доставки, возвращает ответ Telegram"""
+        key = (token, chat_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((text, future))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._chat_worker(key))
+        return await future
+
+    async def _chat_worker(self, key: tuple):
+        token, chat_id = key
+        try:
+            while self._pending.get(key):
+                # окно склейки: ждем другие уведомления в этот же чат
+                if self.coalesce_window > 0:
+                    await asyncio.sleep(self.coalesce_window)
+                batch = self._pending.pop(key, [])
+                if not batch:
+                    break
+                self.coalesced += len(batch) - 1
+                text = "\n\n".join(message for message, _ in batch)
+                try:
+                    result = None
+                    for part in split_message(text):
+                        result = await self._send_part(token, chat_id, part)
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_result(result)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self._workers.pop(key, None)
+            if self._pending.get(key):
+                # сообщение пришло, пока воркер завершался
+                self._workers[key] = asyncio.create_task(self._chat_worker(key))
+
+    def _prune_buckets(self):
+        """Удаляет простаивающие bucket-ы (не чаще раза в bucket_ttl): полный bucket равен новому"""
+        now = time.monotonic()
+        if now - self._pruned_at < self.bucket_ttl:
+            return
+        self._pruned_at = now
+        for buckets in (self._chat_buckets, self._global_buckets):
+            for key in [key for key, bucket in buckets.items() if bucket.idle(now, self.bucket_ttl)]:
+                del buckets[key]
+
+    async def _send_part(self, token: str, chat_id: int, text: str) -> Dict[str, Any]:
+        self._prune_buckets()
+        global_bucket = self._global_buckets.setdefault(token, TokenBucket(self.global_rate))
+        chat_bucket = self._chat_buckets.setdefault((token, chat_id), TokenBucket(self.chat_rate, 1))
+        bot = TelegramBot(token=token)
+        session = await RESOURCES.get(("aiohttp", "telegram_ops"), aiohttp.ClientSession, loop_bound=True)
+
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await chat_bucket.acquire()
+            await global_bucket.acquire()
+            async with session.post(bot.base_url + "/sendMessage", json={"chat_id": chat_id, "text": text}) as response:
+                result = await response.json()
+            if result.get("ok"):
+                self.sent += 1
+                return result
+            if result.get("error_code") == 429:
+                retry_after = result.get("parameters", {}).get("retry_after", 1)
+                self.rate_limited += 1
+                logger.warning(f"Telegram 429 для чата {chat_id}, повтор через {retry_after}с")
+                chat_bucket.pause(retry_after)
+                if retry_after > 1 / self.chat_rate:
+                    # flood wait дольше обычного интервала чата - ограничение на весь токен:
+                    # отправка в другие чаты только продлила бы его
+                    global_bucket.pause(retry_after)
+                continue
+            raise ConnectionError(f"Ошибка работы Telegram API {result}")
+        raise ConnectionError(f"Telegram API: превышено число попыток отправки в чат {chat_id}")
+
+
+async def get_sender() -> TelegramSender:
+    """Общий отправитель для текущего event loop"""
+    return await RESOURCES.get(("telegram_sender",), TelegramSender, loop_bound=True)
+
 
 async def send_telegram_message(username: str, message: str, token: str) -> Dict[str, Any]:
 
-    bot = TelegramBot(token=token)
     chat_id = await get_chat_id_by_username(username=username, token = token)
-    data =  {"chat_id": chat_id, "text": message}
+    sender = await get_sender()
 
     try:
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(bot.base_url + "/sendMessage", json=data)
-            result = await response.json()
-            if not result["ok"]:
-                raise ConnectionError(f"Ошибка работы Telegram API {result}")
-            return {"tg_api_response": result}
+        result = await sender.send(token, chat_id, message)
+        return {"tg_api_response": result}
     except Exception as e:
         print(f"Ошибка при отправки сообщения: {e}")
-
-
+        raise
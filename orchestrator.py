@@ -1,13 +1,37 @@
 import asyncio
+import csv
+import hashlib
+import heapq
+import itertools
 import json
-from typing import Dict, List, Any, Callable
+from collections import deque
+from typing import Dict, List, Any, Callable, Optional
 import aiosqlite
 import time
 import inspect
 import os
 import shutil
-import random
-from otel_config import get_tracer
+import re
+import functools
+import contextlib
+import weakref
+from stat import S_ISREG
+from otel_config import get_tracer, get_meter
+from metrics_registry import (
+    DAGS_RUNNING, TASKS_RUNNING, READY_QUEUE_DEPTH, TASK_DURATION, TASK_RETRIES,
+    DB_WRITE_LATENCY, ARCHIVE_DURATION, ARCHIVE_SIZE, SPECULATIVE_ATTEMPTS, TASKS_REUSED,
+)
+from profiling import RunProfiler
+from run_history import (
+    record_run_started, record_run_finished, recent_task_durations, reusable_task_runs, percentile, DEFAULT_TENANT,
+)
+from retention import RETENTION_POLICY
+import dag_storage
+from artifact_store import ArtifactStore
+import value_codec
+from executor import EXECUTOR, DEFAULT_PRIORITY, priority_rank, task_demand
+from operations.registry import operation_spec, run_operation
+from operations.file_ops import digest_file, fast_copy, move_file
 import logging
 
 logger = logging.getLogger("taskflow")
@@ -22,28 +46,229 @@ if not logger.hasHandlers():
     logger.addHandler(console_handler)
 
 tracer = get_tracer("taskflow.orchestrator")
+meter = get_meter("taskflow.orchestrator")
+task_queue_wait_histogram = meter.create_histogram(
+    "taskflow.task.queue_wait", unit="s", description="Время от готовности задачи до ее запуска"
+)
+task_execution_histogram = meter.create_histogram(
+    "taskflow.task.execution_time", unit="s", description="Время выполнения операции задачи"
+)
+task_phase_histogram = meter.create_histogram(
+    "taskflow.task.phase_time", unit="s", description="Время задачи по фазам"
+)
+task_duration_histogram = meter.create_histogram(
+    "taskflow.task.duration", unit="s", description="Полное время задачи, включая ретраи"
+)
+dag_duration_histogram = meter.create_histogram(
+    "taskflow.dag.duration", unit="s", description="Время выполнения DAG"
+)
+
+# фазы выполнения задачи, время по которым пишется в колонку timings
+TASK_PHASES = ("queue_wait", "resolve_params", "db", "operation", "move_outputs", "results_dump")
+
+SWEEP_INPUTS_DIR = "./sweep_inputs"
+
+# сколько ждать блокировку БД, сек
+DB_TIMEOUT = 30
+
+# поле speculation конфига: резервная копия задачи, работающей дольше percentile
+# прошлых выполнений (не раньше min_delay сек и при истории хотя бы из min_runs выполнений)
+SPECULATION_DEFAULTS = {"percentile": 90, "min_runs": 5, "min_delay": 1.0}
+
+# поле scheduling_policy конфига: в каком порядке запускать готовые задачи, когда их
+# больше, чем слотов. fifo - в порядке готовности; critical_path - сначала задачи на
+# самом долгом оставшемся пути до конца DAG (по медианам прошлых выполнений)
+SCHEDULING_POLICIES = ("fifo", "critical_path")
+DEFAULT_SCHEDULING_POLICY = os.getenv("TASKFLOW_SCHEDULING_POLICY", "fifo")
+
+# запущенные оркестраторы: глубина очередей готовых задач считается при сборе метрик
+_active_runs = weakref.WeakSet()
+READY_QUEUE_DEPTH.set_function(lambda: sum(len(run.ready_tasks) for run in list(_active_runs)))
+
+
+def base_task_id(instance_key: str) -> str:
+    """id задачи из конфига по ключу экземпляра (fetch@3 -> fetch, fetch[2]@3 -> fetch)"""
+    return re.split(r"[@\[]", instance_key, maxsplit=1)[0]
+
+
+def mapped_parent_key(instance_key: str) -> str:
+    """Ключ mapped-задачи по ключу ее экземпляра (fetch[2]@3 -> fetch@3)"""
+    return re.sub(r"\[\d+\]", "", instance_key)
+
+
+@contextlib.contextmanager
+def _phase(timings: Dict[str, float], name: str):
+    """Добавляет время блока к фазе name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] += time.perf_counter() - started
+
+
+@functools.lru_cache(maxsize=None)
+def _signature_defaults(func: Callable[..., Any]) -> tuple:
+    """Кэшируемый разбор сигнатуры операции: ((имя, значение_по_умолчанию), ...)"""
+    sig = inspect.signature(func)
+    return tuple(
+        (name, None if param.default is inspect.Parameter.empty else param.default)
+        for name, param in sig.parameters.items()
+    )
+
 
 class TaskOrchestrator:
-    def __init__(self, dag_config, operations, db_path = "orchestrator.db"):
+    def __init__(self, dag_config, operations, db_path = "orchestrator.db", executor=None):
         self.dag_config = dag_config
         self.results = {}
         self.db_path = db_path
         self.max_retries = dag_config.get("max_retries", 3)
         self.retry_delay = dag_config.get("retry_delay", 3)
-        dag_id = random.randint(1000000, 9999999)
-        dag_path = f"./dags/dag{dag_id}"
-        while os.path.exists(dag_path):
-            dag_id = random.randint(1000000, 9999999)
-            dag_path = f"./dags/dag{id}"
-        dag_id = f"dag{dag_id}"
+        # ULID: уникален и упорядочен по времени без проверок на диске
+        dag_id = dag_storage.new_dag_id()
+        dag_path = dag_storage.dag_dir(dag_id)
         self.dag_id = dag_id
         self.dag_path = dag_path
         self.operations = operations
-        self.ready_tasks = []
-
+        self.ready_tasks = deque()
+        self.max_concurrency = dag_config.get("max_concurrency")
+        self.sweep = dag_config.get("sweep")
+        if self.sweep:
+            self.max_concurrency = self.sweep.get("max_concurrency", self.max_concurrency)
+        # экземпляры задач: task_id для обычного запуска, task_id@N для N-го входа sweep
+        self.instances = {}
+        self.scopes = []
+        self.task_status = {}
+        self.dependents = {}
+        self.waiting_deps = {}
+        self._results_flushed_at = 0.0
+        # число пишущих транзакций в БД за запуск (для бенчмарков)
+        self.db_writes = 0
+        # время по фазам для каждого экземпляра (то же, что в колонке timings)
+        self.task_timings = {}
+        self.archive_bytes = 0
+        self.artifacts = ArtifactStore(db_path)
+        # число попыток завершенных экземпляров (для истории запусков)
+        self.task_attempts = {}
+        # попытки прерванных экземпляров (recovery_mode)
+        self.retry_counts = {}
+        self._base_params_cache = {}
+        # соединение с БД на время execute_dag
+        self._db = None
+        # слоты задач делятся между всеми DAG процесса: приоритет и честная очередь по tenant
+        self.executor = executor or EXECUTOR
+        self.tenant = dag_config.get("tenant") or DEFAULT_TENANT
+        self.priority = dag_config.get("priority") or DEFAULT_PRIORITY
+        priority_rank(self.priority)
+        self._demands = {}
+        self.speculation = self._speculation_config(dag_config.get("speculation"))
+        # время операций задач в прошлых запусках графа: {task_id: [сек, по возрастанию]}
+        self.history = {}
+        self.scheduling_policy = dag_config.get("scheduling_policy") or DEFAULT_SCHEDULING_POLICY
+        if self.scheduling_policy not in SCHEDULING_POLICIES:
+            raise ValueError(
+                f"Unknown scheduling policy '{self.scheduling_policy}', "
+                f"expected one of {', '.join(SCHEDULING_POLICIES)}"
+            )
+        # critical_path: длина оставшегося пути для каждой задачи конфига, сек
+        self.upward_ranks = {}
+        self._ready_sequence = itertools.count()
+        # incremental: экземпляры с теми же операцией и входами, что в прошлом запуске графа, не выполняются
+        self.incremental = bool(dag_config.get("incremental"))
+        # {(ключ экземпляра, fingerprint): dag_id запуска с его результатом}
+        self.reusable_runs = {}
+        # fingerprint экземпляров этого запуска (пишется в task_runs) и хэши файлов из параметров
+        self.fingerprints = {}
+        # ключ хэша - (путь, размер, mtime): перезаписанный задачей файл хэшируется заново
+        self._file_digests = {}
+        # экземпляры, результат которых взят из прошлого запуска
+        self.reused = set()
+
+
+    @staticmethod
+    def _speculation_config(value):
+        if not value:
+            return None
+        config = {**SPECULATION_DEFAULTS, **(value if isinstance(value, dict) else {})}
+        if not 0 < config["percentile"] < 100:
+            raise ValueError(f"Speculation percentile must be between 0 and 100, got {config['percentile']}")
+        return config
+
+    async def _load_history(self) -> Dict[str, List[float]]:
+        """Время операций задач в прошлых запусках этого графа; ошибка истории не роняет DAG"""
+        try:
+            return await recent_task_durations(
+                self.db_path, dag_name=self.dag_config.get("dag_name"), graph_id=self.dag_config.get("graph_id")
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать историю задач для {self.dag_id}: {e}")
+            return {}
+
+    async def _load_reusable_runs(self) -> Dict[tuple, str]:
+        """Прошлые успешные выполнения задач этого графа по fingerprint; ошибка истории не роняет DAG"""
+        try:
+            return await reusable_task_runs(
+                self.db_path, dag_name=self.dag_config.get("dag_name"), graph_id=self.dag_config.get("graph_id")
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать прошлые результаты задач для {self.dag_id}: {e}")
+            return {}
+
+    def _upward_ranks(self) -> Dict[str, float]:
+        """Длина самого долгого пути от задачи до конца DAG, включая саму задачу
+
+        Вес задачи - медиана ее прошлых выполнений; задачи без истории весят как медиана
+        известных задач графа, а без истории вообще - 1 (ранг - число задач на пути).
+        """
+        tasks = self.dag_config["tasks"]
+        successors = {task["id"]: [] for task in tasks}
+        for task in tasks:
+            for dep in task["dependencies"]:
+                if dep in successors:
+                    successors[dep].append(task["id"])
+        weights = {
+            task["id"]: percentile(self.history[task["id"]], 0.5)
+            for task in tasks if self.history.get(task["id"])
+        }
+        default = percentile(sorted(weights.values()), 0.5) if weights else 1.0
+
+        # топологический порядок без рекурсии: цепочки бывают в тысячи задач
+        pending = {task["id"]: sum(dep in successors for dep in task["dependencies"]) for task in tasks}
+        order = [task_id for task_id, count in pending.items() if count == 0]
+        for task_id in order:
+            for successor in successors[task_id]:
+                pending[successor] -= 1
+                if pending[successor] == 0:
+                    order.append(successor)
+        if len(order) != len(pending):
+            raise ValueError("DAG has a dependency cycle")
+
+        ranks = {}
+        for task_id in reversed(order):
+            ranks[task_id] = weights.get(task_id, default) + max(
+                (ranks[successor] for successor in successors[task_id]), default=0.0
+            )
+        return ranks
+
+    async def _open_db(self):
+        """Одно соединение на запуск: записи задач идут через него по очереди, без нового подключения на каждую"""
+        db = await aiosqlite.connect(self.db_path, timeout=DB_TIMEOUT)
+        # WAL: чтение UI и истории не блокирует запись задач, а commit не ждет fsync
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextlib.asynccontextmanager
+    async def _connection(self):
+        """Соединение запуска, а вне execute_dag - временное"""
+        if self._db is not None:
+            yield self._db
+            return
+        async with aiosqlite.connect(self.db_path, timeout=DB_TIMEOUT) as db:
+            yield db
 
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        started = time.perf_counter()
+        async with self._connection() as db:
             await db.execute(f'''
                 CREATE TABLE IF NOT EXISTS {self.dag_id} (
                     task_id TEXT PRIMARY KEY,
@@ -53,59 +278,135 @@ class TaskOrchestrator:
                     params TEXT,
                     retry_count INTEGER,
                     created_at REAL,
-                    updated_at REAL
+                    updated_at REAL,
+                    timings TEXT
                 )
             ''')
 
+            # параметры здесь не пишутся - они сохраняются один раз, вместе с итогом экземпляра;
+            # разбор нужен, чтобы неизвестная операция роняла запуск до старта задач
             for task in self.dag_config["tasks"]:
-                task_id = task["id"]
-                params = json.dumps(self._get_funcs_param(task_config=task))
-                await db.execute(f'''
-                    INSERT OR REPLACE INTO {self.dag_id} 
-                    (task_id, status, result, error, params, retry_count, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    task_id,
-                    "pending",
-                    None,  # result
-                    None,  # error
-                    params,
-                    0,
-                    time.time(),
-                    time.time()
-                ))
+                self._base_params(task)
+            now = time.time()
+            await db.executemany(f'''
+                INSERT OR REPLACE INTO {self.dag_id} (task_id, status, retry_count, created_at, updated_at)
+                VALUES (?, 'pending', 0, ?, ?)
+            ''', [(key, now, now) for key in self.instances])
             await db.commit()
+            self.db_writes += 1
+        DB_WRITE_LATENCY.observe(time.perf_counter() - started, kind="init")
 
     def _get_funcs_param(self, task_config):
-        task_id = task_config["id"]
+        """Собирает независимые параметры задачи с дефолтами операции.
+
+        Конфиг не изменяется: возвращается новый словарь, поэтому один и тот же
+        dag_config можно запускать параллельно несколькими оркестраторами.
+        """
         operation_name = task_config["operation"]
         operation_func = self.operations[operation_name]
-        independent_params = task_config["independent_params"]
-
-
-
 
+        params = self.get_default_parameter_names(operation_func)
+        params.update(task_config["independent_params"])
+        return params
 
-        default_params = self.get_default_parameter_names(operation_func)
-
+    def _task_demand(self, task_config) -> Dict[str, float]:
+        """Ресурсы экземпляра задачи: поле resources, по умолчанию - по resource_class операции"""
+        task_id = task_config["id"]
+        if task_id not in self._demands:
+            spec = operation_spec(self.operations, task_config["operation"])
+            demand = task_demand(task_config.get("resources"), spec.resource_class)
+            self.executor.check_demand(demand, task_id)
+            self._demands[task_id] = demand
+        return self._demands[task_id]
+
+    def _base_params(self, task_config) -> Dict[str, Any]:
+        """_get_funcs_param, посчитанный один раз на задачу конфига (общий для всех ее экземпляров)"""
+        task_id = task_config["id"]
+        if task_id not in self._base_params_cache:
+            self._base_params_cache[task_id] = self._get_funcs_param(task_config)
+        return self._base_params_cache[task_id]
+
+    def _resolve_dependent_params(self, dependent_params: Dict[str, str], scope: Dict) -> Dict[str, Any]:
+        """Подставляет результаты предыдущих задач в новый словарь (ссылки вида task.results.field)
+
+        Ссылки ищутся в пределах scope - одного прохода графа. Для sweep в нем также
+        доступен текущий вход: sweep.item.value (или sweep.item.<поле> для объектов).
+        """
+        sources = {**scope["bindings"], **scope["results"]}
+        resolved = {}
+        for key, reference in dependent_params.items():
+            prev_task_id, result_field, param_name = reference.split(".")[0], \
+                reference.split(".")[1], reference.split(".")[2]
+            if prev_task_id not in sources:
+                logger.error(f"Task with id '{prev_task_id}' not found in dag config file")
+                raise ValueError(f"Task with id '{prev_task_id}' not found in dag config file")
+            if param_name not in sources[prev_task_id]:
+                logger.error(f"Parametr '{param_name}' not found in task results")
+                raise ValueError(f"Parametr '{param_name}' not found in task results")
+            resolved[key] = sources[prev_task_id][param_name]
+        return resolved
+
+    def _load_sweep_inputs(self) -> List[Any]:
+        """Загружает входы sweep: список inputs или файл inputs_file из ./sweep_inputs"""
+        if "inputs" in self.sweep:
+            return list(self.sweep["inputs"])
+
+        filename = os.path.basename(self.sweep["inputs_file"])
+        path = os.path.join(SWEEP_INPUTS_DIR, filename)
+        with open(path, "r", encoding="utf-8") as file:
+            if filename.endswith(".json"):
+                return list(json.load(file))
+            if filename.endswith(".csv"):
+                return list(csv.DictReader(file))
+            return [line.strip() for line in file if line.strip()]
+
+    def _build_instances(self):
+        """Разворачивает задачи конфига в экземпляры и строит индекс зависимостей"""
+        tasks = self.dag_config["tasks"]
+
+        if self.sweep:
+            if any(task["id"] == "sweep" for task in tasks):
+                raise ValueError("Task id 'sweep' is reserved in sweep mode")
+            for index, item in enumerate(self._load_sweep_inputs()):
+                binding = dict(item) if isinstance(item, dict) else {"value": item}
+                binding.setdefault("index", index)
+                self.scopes.append({
+                    "suffix": f"@{index}",
+                    "input": item,
+                    "results": {},
+                    "bindings": {"sweep": binding},
+                })
+        else:
+            # обычный запуск: результаты единственного прохода и есть self.results
+            self.scopes.append({"suffix": "", "input": None, "results": self.results, "bindings": {}})
 
-        for key, value in default_params.items():
-            if not(key in independent_params):
-                independent_params[key] = value
+        for task in tasks:
+            # задача, которой не хватит ресурсов процесса, роняет DAG до запуска
+            self._task_demand(task)
 
-        return independent_params
+        for scope in self.scopes:
+            for task in tasks:
+                key = task["id"] + scope["suffix"]
+                kind = "mapped" if task.get("map_params") else "task"
+                self.instances[key] = {"key": key, "task": task, "scope": scope, "kind": kind}
+                self.task_status[key] = "pending"
+                self.waiting_deps[key] = len(task["dependencies"])
+                self.dependents.setdefault(key, [])
+                for dep in task["dependencies"]:
+                    self.dependents.setdefault(dep + scope["suffix"], []).append(key)
 
 
     async def cleanup_db(self):
         """Очистка DB"""
 
 
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             try:
                 await db.execute(f'''
                     DELETE FROM {self.dag_id}
                 ''')
                 await db.commit()
+                self.db_writes += 1
             except aiosqlite.OperationalError as e:
                 if "no such table" in str(e):
                     logger.info("Таблица не существует, нечего очищать")
@@ -113,176 +414,400 @@ class TaskOrchestrator:
                 else:
                     raise e
 
-    async def _load_task_state(self, task_id: str) -> Dict:
-        """Получает состояние операции из БД"""
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(f"SELECT status, result, retry_count, params FROM {self.dag_id} WHERE task_id = ?", (task_id, )) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    params_str = row[3]
-                    params_dict = json.loads(params_str)
-                    return {
-                        "status": row[0],
-                        "result": row[1],
-                        "retry_count": row[2],
-                        "params": params_dict
-                    }
-        return {}
+
     async def execute_dag(self, recovery_mode = False):
         """Запуск DAG"""
 
-        with tracer.start_as_current_span(f"dag.run") as span:
-            span.set_attribute("dag.id", self.dag_id)
-            logger.info(f"Запуск {self.dag_id}...")
-
-            if not recovery_mode:
-                logger.info(f" Новый запуск DAG: {self.dag_id}...")
-                await self.cleanup_db()
-                await self.init_db()
-
-            # иннициализация папки для сохраняемых файлов
-            os.mkdir(self.dag_path)
-            config_path = os.path.join(self.dag_path, "config.json")
-            with open(config_path, "w", encoding="utf-8") as file:
-                json.dump(self.dag_config, file, ensure_ascii=False, indent=4)
-
-            tasks = self.dag_config["tasks"]
-
-            self.ready_tasks = await self._find_ready_tasks(tasks)
-            await self._execute_tasks(self.ready_tasks)
-
-            logger.info(f"Весь DAG {self.dag_id} выполнен!")
-
-            self.save_dag_data_in_zip()
-            zip_path = f"{self.dag_path}.zip"
-            return {"dag_path": self.dag_path,
-                    "zip_path": zip_path}
-
-    async def _find_ready_tasks(self, tasks):
-        """Нахождение готовых задач"""
-        ready_tasks = []
+        dag_started = time.perf_counter()
+        started_at = time.time()
+        DAGS_RUNNING.inc()
+        _active_runs.add(self)
+        await self._record_history(record_run_started, self.db_path, self.dag_id, self.dag_config, started_at)
+        run_status, run_error = "failed", None
+        try:
+            self._db = await self._open_db()
+            with tracer.start_as_current_span(f"dag.run") as span:
+                span.set_attribute("dag.id", self.dag_id)
+                logger.info(f"Запуск {self.dag_id}...")
+
+                self._build_instances()
+                span.set_attribute("dag.instances", len(self.instances))
+                if self.speculation or self.scheduling_policy == "critical_path":
+                    self.history = await self._load_history()
+                if self.scheduling_policy == "critical_path":
+                    self.upward_ranks = self._upward_ranks()
+                if self.incremental:
+                    self.reusable_runs = await self._load_reusable_runs()
+
+                if not recovery_mode:
+                    logger.info(f" Новый запуск DAG: {self.dag_id}...")
+                    await self.cleanup_db()
+                    await self.init_db()
+                else:
+                    await self._restore_task_states()
+
+                # иннициализация папки для сохраняемых файлов
+                os.makedirs(self.dag_path, exist_ok=True)
+                config_path = os.path.join(self.dag_path, "config.json")
+                with open(config_path, "w", encoding="utf-8") as file:
+                    json.dump(self.dag_config, file, ensure_ascii=False, indent=4)
+
+                profiler = None
+                if self.dag_config.get("profile"):
+                    profiler = RunProfiler(self.dag_config["profile"], self.dag_id)
+                    profiler.start()
+                try:
+                    self.ready_tasks = [] if self.upward_ranks else deque()
+                    self._enqueue_ready(
+                        instance for key, instance in self.instances.items()
+                        if self.task_status[key] == "pending" and self.waiting_deps[key] == 0
+                    )
+                    await self._execute_tasks()
+                    self._flush_results(force=True)
+                finally:
+                    if profiler is not None:
+                        profiler.stop(self.dag_path)
+
+                logger.info(f"Весь DAG {self.dag_id} выполнен!")
+                if self.incremental:
+                    logger.info(f"Из прошлых запусков взяты результаты {len(self.reused)} из {len(self.instances)} задач")
+                failed = sum(status == "failed" for status in self.task_status.values())
+                dag_duration_histogram.record(
+                    time.perf_counter() - dag_started,
+                    {"dag.name": self.dag_config.get("dag_name", ""), "status": "failed" if failed else "completed"},
+                )
 
-        for task in tasks:
-            task_id = task["id"]
+                archived = await self.archive_dag_data()
+                run_status = "failed" if failed else "completed"
+                # zip собирается из хранилища артефактов по запросу (ArtifactStore.write_zip)
+                return {"dag_id": self.dag_id,
+                        "dag_path": self.dag_path,
+                        "files": archived["files"]}
+        except Exception as e:
+            run_error = str(e)
+            raise
+        finally:
+            if self._db is not None:
+                await self._db.close()
+                self._db = None
+            await self._record_history(
+                record_run_finished, self.db_path, self.dag_id, self.dag_config, started_at, run_status,
+                self._history_tasks(), error=run_error, archive_bytes=self.archive_bytes
+            )
+            DAGS_RUNNING.dec()
+            _active_runs.discard(self)
+
+    async def _record_history(self, record, *args, **kwargs):
+        """Пишет в историю запусков; ошибка истории не роняет DAG"""
+        try:
+            await record(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Не удалось записать историю запуска {self.dag_id}: {e}")
+
+    def _history_tasks(self) -> List[Dict]:
+        """Выполнявшиеся экземпляры задач для task_runs и сводки"""
+        return [
+            {
+                "key": key,
+                "task_id": base_task_id(key),
+                "operation": self.instances[key]["task"]["operation"],
+                "status": self.task_status[key],
+                "duration": timings["total"],
+                "retry_count": self.task_attempts.get(key, 0),
+                "run_time": None if key in self.reused else timings["operation"],
+                "fingerprint": self.fingerprints.get(key),
+            }
+            for key, timings in self.task_timings.items()
+        ]
+
+    async def _restore_task_states(self):
+        """Восстанавливает статусы и результаты экземпляров из БД (recovery_mode)"""
+        async with self._connection() as db:
+            async with db.execute(f"SELECT task_id, status, result, retry_count FROM {self.dag_id}") as cursor:
+                rows = await cursor.fetchall()
 
-            deps_ready = all(dep in self.results for dep in task["dependencies"])
-            if not deps_ready:
+        for key, status, result, retry_count in rows:
+            if key not in self.instances or status == "pending":
                 continue
-
-            state = await self._load_task_state(task_id)
-
-            if state:
-                if state["status"] == "completed":
-                    continue
-                if state["status"] == "running":
-                    continue
-                if state["status"] == "failed":
-                    continue
-
-            ready_tasks.append(task)
-        return ready_tasks
-
-
-    async def _execute_tasks(self, tasks: List[Dict]):
-        """Выполняет асинхронно, поданный список задач"""
-        async_tasks = []
-        for task_config in tasks:
-            async_task = self._execute_single_task(task_config)
-            async_tasks.append(async_task)
-
-        await asyncio.gather(*async_tasks)
+            if status == "running":
+                # выполнение было прервано - задача будет перезапущена с той же попытки
+                self.retry_counts[key] = retry_count or 0
+                continue
+            self.task_status[key] = status
+            if status == "completed":
+                self._store_result(self.instances[key], await self._decode_value(result))
+                self._release_dependents(key)
+
+    def _enqueue_ready(self, instances):
+        """Ставит экземпляры в очередь готовых, запоминая момент готовности (для queue_wait)
+
+        При critical_path очередь - куча по убыванию оставшегося пути, иначе - FIFO.
+        """
+        now = time.perf_counter()
+        for instance in instances:
+            instance["ready_at"] = now
+            if self.upward_ranks:
+                rank = self.upward_ranks[instance["task"]["id"]]
+                heapq.heappush(self.ready_tasks, (-rank, next(self._ready_sequence), instance))
+            else:
+                self.ready_tasks.append(instance)
+
+    def _next_ready(self) -> Dict:
+        if self.upward_ranks:
+            return heapq.heappop(self.ready_tasks)[-1]
+        return self.ready_tasks.popleft()
+
+    def _slot_order(self, task_config) -> float:
+        """Порядок задачи среди ожидающих слот задач того же tenant и класса приоритета"""
+        return -self.upward_ranks.get(task_config["id"], 0.0)
+
+    def _release_dependents(self, key: str) -> List[Dict]:
+        """Отмечает выполненную зависимость и возвращает экземпляры, ставшие готовыми"""
+        ready = []
+        for dependent_key in self.dependents[key]:
+            self.waiting_deps[dependent_key] -= 1
+            if self.waiting_deps[dependent_key] == 0 and self.task_status[dependent_key] == "pending":
+                ready.append(self.instances[dependent_key])
+        return ready
+
+    async def _execute_tasks(self):
+        """Выполняет готовые задачи, держа не больше max_concurrency одновременно"""
+        running = {}
+        try:
+            while self.ready_tasks or running:
+                while self.ready_tasks and (not self.max_concurrency or len(running) < self.max_concurrency):
+                    instance = self._next_ready()
+                    self.task_status[instance["key"]] = "running"
+                    if instance["kind"] == "mapped":
+                        coro = self._expand_mapped_task(instance)
+                    else:
+                        coro = self._execute_single_task(instance)
+                    running[asyncio.create_task(coro)] = instance
+                    TASKS_RUNNING.inc()
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for async_task in done:
+                    instance = running.pop(async_task)
+                    TASKS_RUNNING.dec()
+                    async_task.result()
+                    self._enqueue_ready(await self._on_instance_done(instance))
+        finally:
+            for async_task in running:
+                async_task.cancel()
+            TASKS_RUNNING.dec(len(running))
+
+    async def _on_instance_done(self, instance: Dict) -> List[Dict]:
+        """Обрабатывает завершение экземпляра и возвращает новые готовые экземпляры"""
+        key = instance["key"]
+
+        if instance["kind"] == "mapped":
+            # mapped-задача только что развернулась в экземпляры
+            if self.task_status[key] == "failed":
+                return []
+            if instance["children"]:
+                return instance["children"]
+            return await self._gather_mapped_task(instance)
+
+        if instance["kind"] == "map_item":
+            parent = instance["parent"]
+            parent["remaining"] -= 1
+            if parent["remaining"] == 0:
+                return await self._gather_mapped_task(parent)
+            return []
+
+        if self.task_status[key] == "completed":
+            return self._release_dependents(key)
+        return []
+
+    async def _expand_mapped_task(self, instance: Dict):
+        """Разворачивает mapped-задачу в экземпляры по спискам из map_params"""
+        key = instance["key"]
+        task_config = instance["task"]
+        instance["children"] = []
+
+        try:
+            map_values = self._resolve_dependent_params(task_config["map_params"], instance["scope"])
+            for param_name, values in map_values.items():
+                if not isinstance(values, list):
+                    raise ValueError(f"Mapped parametr '{param_name}' must be a list, got {type(values).__name__}")
+            lengths = {len(values) for values in map_values.values()}
+            if len(lengths) > 1:
+                raise ValueError(f"Mapped parametrs of '{key}' have different lengths: {sorted(lengths)}")
+        except Exception as e:
+            logger.error(f"{key} не удалось развернуть: {e}")
+            self.task_status[key] = "failed"
+            await self._save_task_outcome(key, status="failed", params=self._base_params(task_config), error=str(e))
+            return
+
+        count = lengths.pop() if lengths else 0
+        for index in range(count):
+            child_key = f"{task_config['id']}[{index}]{instance['scope']['suffix']}"
+            child = {
+                "key": child_key,
+                "task": task_config,
+                "scope": instance["scope"],
+                "kind": "map_item",
+                "parent": instance,
+                "map_binding": {name: values[index] for name, values in map_values.items()},
+            }
+            self.instances[child_key] = child
+            self.task_status[child_key] = "pending"
+            instance["children"].append(child)
+        instance["remaining"] = count
+
+        now = time.time()
+        started = time.perf_counter()
+        async with self._connection() as db:
+            await db.executemany(f'''
+                INSERT OR REPLACE INTO {self.dag_id} (task_id, status, retry_count, created_at, updated_at)
+                VALUES (?, 'pending', 0, ?, ?)
+            ''', [(child["key"], now, now) for child in instance["children"]])
+            await db.commit()
+            self.db_writes += 1
+        DB_WRITE_LATENCY.observe(time.perf_counter() - started, kind="expand")
+        logger.info(f"{key} развернута в {count} экземпляров")
+
+    async def _gather_mapped_task(self, instance: Dict) -> List[Dict]:
+        """Собирает результаты экземпляров mapped-задачи: {поле: [значение каждого экземпляра]}"""
+        key = instance["key"]
+        children = instance["children"]
+        params = self._base_params(instance["task"])
+
+        failed = [child["key"] for child in children if self.task_status[child["key"]] != "completed"]
+        if failed:
+            error = f"{len(failed)} of {len(children)} mapped instances failed: {', '.join(failed[:10])}"
+            logger.error(f"{key} упала: {error}")
+            self.task_status[key] = "failed"
+            await self._save_task_outcome(key, status="failed", params=params, error=error)
+            return []
+
+        fields = []
+        for child in children:
+            fields.extend(field for field in child["result"] if field not in fields)
+        result = {field: [child["result"].get(field) for child in children] for field in fields}
+
+        await self._save_task_outcome(key, status="completed", params=params, result=result)
+        self._store_result(instance, result)
+        self.task_status[key] = "completed"
+        self._flush_results()
+        logger.info(f"{key} собрана из {len(children)} экземпляров")
+        return self._release_dependents(key)
+
+    def _store_result(self, instance: Dict, result: Dict):
+        """Сохраняет результат экземпляра в его scope и в общий self.results"""
+        if instance["kind"] == "map_item":
+            # в scope попадает только собранный результат mapped-задачи
+            instance["result"] = result
+        else:
+            instance["scope"]["results"][instance["task"]["id"]] = result
+        self.results[instance["key"]] = result
+
+    def _results_snapshot(self):
+        """Результаты для results.json: для sweep - сводка по каждому входу"""
+        if not self.sweep:
+            return self.results
+        return [
+            {"index": index, "input": scope["input"], "results": scope["results"]}
+            for index, scope in enumerate(self.scopes)
+        ]
+
+    def _flush_results(self, force=False):
+        """Пишет results.json не чаще раза в секунду (и всегда в конце запуска)"""
+        now = time.time()
+        if not force and now - self._results_flushed_at < 1:
+            return
+        self._results_flushed_at = now
+        res_path = os.path.join(self.dag_path, "results.json")
+        with open(res_path, "w", encoding="utf-8") as file:
+            json.dump(self._results_snapshot(), file, ensure_ascii=False, indent=4)
 
     def get_default_parameter_names(self, func: Callable[..., Any]) -> dict[str, Any]:
         """Возвращает словарь {имя_параметра: значение_по_умолчанию, если есть}"""
-        sig = inspect.signature(func)
-        parameters = {}
-
-        for name, param in sig.parameters.items():
-            if param.default == inspect.Parameter.empty:
-                parameters[name] = None
-            else:
-                parameters[name] = param.default
-
-        return parameters
-
-    async def _execute_single_task(self, task_config: Dict):
-        """Выполняет асинхронно одну задачу"""
-        task_id = task_config["id"]
+        return dict(_signature_defaults(func))
+
+    async def _execute_single_task(self, instance: Dict):
+        """Выполняет асинхронно один экземпляр задачи, заняв слот исполнителя (executor.py)"""
+        task_config = instance["task"]
+        async with self.executor.slot(
+            self.tenant, self.priority, self._task_demand(task_config), order=self._slot_order(task_config)
+        ) as slot:
+            await self._run_attempts(instance, slot)
+
+    async def _run_attempts(self, instance: Dict, slot):
+        """Попытки выполнения экземпляра задачи
+
+        Время задачи раскладывается по фазам TASK_PHASES и сохраняется в колонку timings
+        вместе с финальным статусом (db - все записи в БД, кроме этой последней).
+        """
+        task_config = instance["task"]
+        task_id = instance["key"]
         operation_name = task_config["operation"]
         dependent_params = task_config["dependent_params"]
 
-        state = await self._load_task_state(task_id)
-        all_params = state["params"]
-        current_retry = state.get("retry_count", 0) if state else 0
+        started = time.perf_counter()
+        timings = dict.fromkeys(TASK_PHASES, 0.0)
+        timings["queue_wait"] = started - instance.get("ready_at", started)
 
-        with tracer.start_as_current_span(f"task.{task_id}") as span:
+        base_params = self._base_params(task_config)
+        all_params = base_params
+        current_retry = self.retry_counts.pop(task_id, 0)
+
+        with tracer.start_as_current_span(f"task.{task_config['id']}") as span:
             span.set_attribute("task.id", task_id)
             span.set_attribute("task.operation", operation_name)
             logger.info(f"Запускаем {task_id}...")
 
+            if self.incremental and await self._reuse_outputs(instance, timings, started, span):
+                return
+
             for attempt in range(current_retry, self.max_retries):
                 attempt_number = attempt + 1
 
                 # Сохраняем статус running
-                await self._save_task_state(
-                    task_id,
-                    status="running",
-                    params=all_params,
-                    retry_count=attempt_number
-                )
+                with _phase(timings, "db"):
+                    await self._save_task_state(task_id, status="running", retry_count=attempt_number)
 
                 try:
                     logger.info(f" Запускаем {task_id}... (попытка {attempt_number}/{self.max_retries})")
-                    if dependent_params:
-                        for key, value in dependent_params.items():
-                            prev_task_id, result_field, param_name = dependent_params[key].split(".")[0], \
-                            dependent_params[key].split(".")[1], dependent_params[key].split(".")[2]
-                            if prev_task_id in self.results:
-                                if param_name in self.results[prev_task_id]:
-                                    dependent_params[key] = self.results[prev_task_id][param_name]
-                                else:
-                                    logger.error(f"Parametr '{param_name}' not found in task results")
-                                    raise ValueError(f"Parametr '{param_name}' not found in task results")
-                            else:
-                                logger.error(f"Task with id '{prev_task_id}' not found in dag config file")
-                                raise ValueError(f"Task with id '{prev_task_id}' not found in dag config file")
-
-
-                    for key in dependent_params.keys():
-                        all_params[key] = dependent_params[key]
-
-                    operation_func = self.operations[operation_name]
-                    result = await operation_func(**all_params)
-
-                    # Успех - сохраняем результат
-                    await self._save_task_state(
+                    # Привязка параметров на каждую попытку: конфиг и base_params не трогаем
+                    with _phase(timings, "resolve_params"):
+                        all_params = {
+                            **base_params,
+                            **self._resolve_dependent_params(dependent_params, instance["scope"]),
+                            **instance.get("map_binding", {}),
+                        }
+                        operation_func = self.operations[operation_name]
+                        spec = operation_spec(self.operations, operation_name)
+
+                    with _phase(timings, "operation"):
+                        result = await self._run_operation(task_id, task_config, spec, operation_func, all_params)
+
+                    with _phase(timings, "move_outputs"):
+                        if "output_file_path" in result.keys():
+                            result["output_file_path"] = await self._move_output(task_id, result["output_file_path"])
+                        if "output_file_paths" in result.keys():
+                            result["output_file_paths"] = [
+                                await self._move_output(task_id, path) for path in result["output_file_paths"]
+                            ]
+
+                    self._store_result(instance, result)
+                    self.task_status[task_id] = "completed"
+                    with _phase(timings, "results_dump"):
+                        self._flush_results()
+
+                    # Успех - сохраняем результат (уже с путями в папке DAG)
+                    self._finish_timings(task_id, operation_name, "completed", timings, started, span, attempt_number)
+                    await self._save_task_outcome(
                         task_id,
                         status="completed",
                         params=all_params,
                         result=result,
-                        retry_count=attempt_number
+                        retry_count=attempt_number,
+                        timings=timings
                     )
 
-
-
-                    if "output_file_path" in result.keys():
-                        source_path = result["output_file_path"]
-                        name = os.path.basename(source_path)
-                        new_path = os.path.join(self.dag_path, name)
-                        os.rename(source_path, new_path)
-                        result["output_file_path"] = new_path
-
-                    self.results[task_id] = result
-
-
-                    res_path = os.path.join(self.dag_path, "results.json")
-                    with open(res_path, "w", encoding="utf-8") as file:
-                        json.dump(self.results, file, ensure_ascii=False, indent=4)
-
                     logger.info(f"{task_id} завершена")
                     logger.info(f"Результаты: {result}\n")
-                    self.ready_tasks = await self._find_ready_tasks(self.dag_config["tasks"])
-                    await self._execute_tasks(self.ready_tasks)
 
 
                     break  # Выходим из цикла retry при успехе
@@ -290,69 +815,348 @@ class TaskOrchestrator:
                 except Exception as e:
                     logger.error(f"{task_id} упала с ошибкой (попытка {attempt_number}/{self.max_retries}): {e}")
 
-                    # Сохраняем ошибку
-                    await self._save_task_state(
-                        task_id,
-                        status="failed",
-                        params = all_params,
-                        error=str(e),
-                        retry_count=attempt_number
-                    )
-
                     # Проверяем есть ли еще попытки
                     if attempt_number < self.max_retries:
+                        TASK_RETRIES.inc(operation=operation_name)
+                        # Сохраняем ошибку
+                        with _phase(timings, "db"):
+                            await self._save_task_state(
+                                task_id,
+                                status="failed",
+                                error=str(e),
+                                retry_count=attempt_number
+                            )
                         logger.info(f"Повтор {task_id} через {self.retry_delay}с...")
+                        # на время паузы между попытками слот отдается другим задачам
+                        slot.release()
                         await asyncio.sleep(self.retry_delay)
+                        await slot.reacquire()
                     else:
+                        self._finish_timings(task_id, operation_name, "failed", timings, started, span, attempt_number)
+                        await self._save_task_outcome(
+                            task_id,
+                            status="failed",
+                            params=all_params,
+                            error=str(e),
+                            retry_count=attempt_number,
+                            timings=timings
+                        )
                         logger.info(f"{task_id} окончательно упала после {self.max_retries} попыток")
+                        self.task_status[task_id] = "failed"
                         # Можно выбросить исключение или просто залогировать
                         break
 
-    async def _save_task_state(self, task_id: str, status: str, params: str, result=None, error=None, retry_count=0):
-        """Сохраняет состояние задачи в БД"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем существующую запись для created_at
-            async with db.execute(
-                    f'SELECT created_at FROM {self.dag_id} WHERE task_id = ?', (task_id,)
-            ) as cursor:
-                existing = await cursor.fetchone()
-                created_at = existing[0] if existing else time.time()
-
+    async def _reuse_outputs(self, instance: Dict, timings: Dict[str, float], started: float, span) -> bool:
+        """incremental: берет результат и файлы прошлого выполнения экземпляра с тем же fingerprint
+
+        fingerprint - хэш операции и параметров после подстановки результатов зависимостей,
+        где файлы заменены хэшами содержимого. Экземпляр выполняется заново, если изменились
+        его параметры или входы выше по графу; задачи после перезапущенной, но выдавшей тот
+        же результат, снова берутся из прошлого запуска. Переиспользуются только cacheable
+        операции (поле cacheable задачи переопределяет метаданные операции).
+        """
+        task_config = instance["task"]
+        task_id = instance["key"]
+        operation_name = task_config["operation"]
+        try:
+            with _phase(timings, "resolve_params"):
+                params = {
+                    **self._base_params(task_config),
+                    **self._resolve_dependent_params(task_config["dependent_params"], instance["scope"]),
+                    **instance.get("map_binding", {}),
+                }
+                spec = operation_spec(self.operations, operation_name)
+                fingerprint = await asyncio.to_thread(self._fingerprint, spec, params)
+        except Exception as e:
+            # ошибку параметров покажет обычная попытка выполнения
+            logger.info(f"{task_id}: fingerprint не посчитан ({e})")
+            return False
+        self.fingerprints[task_id] = fingerprint
+        if not task_config.get("cacheable", spec.cacheable):
+            return False
+        source = self.reusable_runs.get((task_id, fingerprint))
+        if source is None or not dag_storage.is_dag_id(source):
+            return False
+
+        try:
+            with _phase(timings, "db"):
+                result = await self._previous_result(source, task_id)
+            if result is not None:
+                with _phase(timings, "move_outputs"):
+                    result = await asyncio.to_thread(self._restore_outputs, source, task_id, result)
+        except Exception as e:
+            logger.warning(f"{task_id}: не удалось взять результат из {source}, выполняем заново: {e}")
+            return False
+        if result is None:
+            return False
+
+        self._store_result(instance, result)
+        self.task_status[task_id] = "completed"
+        self.reused.add(task_id)
+        with _phase(timings, "results_dump"):
+            self._flush_results()
+        self._finish_timings(task_id, operation_name, "completed", timings, started, span, 0)
+        await self._save_task_outcome(task_id, status="completed", params=params, result=result, timings=timings)
+        TASKS_REUSED.inc(operation=operation_name)
+        logger.info(f"{task_id} не изменилась - результат взят из {source}")
+        return True
+
+    def _fingerprint(self, spec, params: Dict[str, Any]) -> str:
+        """sha256 операции и параметров (в потоке: файлы из параметров хэшируются)"""
+        payload = {"operation": spec.name, "target": spec.target, "params": self._content_keys(params)}
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _content_keys(self, value):
+        """Значение параметра для fingerprint: пути к существующим файлам заменяются хэшем содержимого"""
+        if isinstance(value, dict):
+            return {key: self._content_keys(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._content_keys(item) for item in value]
+        if isinstance(value, str) and len(value) < 4096:
+            key = self._file_key(value)
+            if key is None:
+                return value
+            if key not in self._file_digests:
+                self._file_digests[key] = digest_file(value)
+            return f"sha256:{self._file_digests[key]}"
+        return value
+
+    @staticmethod
+    def _file_key(path: str):
+        """Ключ кэша хэшей файла: (путь, размер, mtime); None, если это не обычный файл"""
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if not S_ISREG(st.st_mode):
+            return None
+        return path, st.st_size, st.st_mtime_ns
+
+    async def _previous_result(self, source: str, task_id: str):
+        """Результат экземпляра в запуске source (None, если таблицы запуска уже нет)"""
+        async with self._connection() as db:
+            try:
+                async with db.execute(
+                        f"SELECT result FROM {source} WHERE task_id = ? AND status = 'completed'", (task_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            except aiosqlite.OperationalError:
+                return None
+        return await self._decode_value(row[0]) if row else None
+
+    def _restore_outputs(self, source: str, task_id: str, result: Dict) -> Optional[Dict]:
+        """Копирует файлы-результаты запуска source из хранилища артефактов в папку DAG
+
+        Пути в результате заменяются новыми; None, если каких-то файлов в хранилище уже нет.
+        """
+        result = dict(result)
+        paths = []
+        if "output_file_path" in result:
+            paths.append(result["output_file_path"])
+        if "output_file_paths" in result:
+            paths.extend(result["output_file_paths"])
+        if not paths:
+            return result
+        manifest = self.artifacts.manifest(source)
+        if any(os.path.basename(path) not in manifest for path in paths):
+            return None
+
+        def restore(path: str) -> str:
+            name = os.path.basename(path)
+            new_path = os.path.join(self.dag_path, name)
+            if os.path.exists(new_path):
+                new_path = os.path.join(self.dag_path, f"{task_id}_{name}")
+            digest = manifest[name][0]
+            fast_copy(self.artifacts.blob_path(digest), new_path)
+            # блоб только для чтения, а копия - обычный файл запуска
+            os.chmod(new_path, 0o644)
+            self._file_digests[self._file_key(new_path)] = digest
+            return new_path
+
+        if "output_file_path" in result:
+            result["output_file_path"] = restore(result["output_file_path"])
+        if "output_file_paths" in result:
+            result["output_file_paths"] = [restore(path) for path in result["output_file_paths"]]
+        return result
+
+    def _speculation_delay(self, task_config, spec, params) -> Optional[float]:
+        """Через сколько секунд запускать резервную копию задачи (None - не запускать)
+
+        Копия запускается только для идемпотентных вызовов: поле idempotent задачи
+        переопределяет метаданные операции (POST к API по умолчанию не дублируется).
+        """
+        if not self.speculation:
+            return None
+        idempotent = task_config.get("idempotent")
+        if not (spec.is_idempotent(params) if idempotent is None else idempotent):
+            return None
+        durations = self.history.get(task_config["id"], [])
+        if len(durations) < self.speculation["min_runs"]:
+            return None
+        return max(percentile(durations, self.speculation["percentile"] / 100), self.speculation["min_delay"])
+
+    async def _run_operation(self, task_id: str, task_config, spec, operation_func, params):
+        """Выполняет операцию; если задача идемпотентной операции работает дольше обычного,
+        запускает резервную копию и берет первый успешный результат, отменяя вторую попытку
+
+        Копия занимает отдельный слот исполнителя и запускается, только если он свободен
+        сразу. Файлы отмененной попытки остаются в userdata_buffer до уборки.
+        """
+        delay = self._speculation_delay(task_config, spec, params)
+        if delay is None:
+            return await run_operation(operation_func, spec, params)
+
+        attempts = [asyncio.ensure_future(run_operation(operation_func, spec, params))]
+        backup_slot = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                backup_slot = self.executor.try_slot(self.tenant, self.priority, self._task_demand(task_config))
+                if backup_slot is not None:
+                    logger.info(f"{task_id} выполняется дольше {delay:.2f}с - запускаем резервную копию")
+                    attempts.append(asyncio.ensure_future(run_operation(operation_func, spec, params)))
+                    SPECULATIVE_ATTEMPTS.inc(operation=spec.name, outcome="launched")
+
+            pending, error = set(attempts), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if len(attempts) > 1:
+                            winner = "backup" if attempt is attempts[1] else "primary"
+                            SPECULATIVE_ATTEMPTS.inc(operation=spec.name, outcome=f"{winner}_won")
+                        return attempt.result()
+                    error = error or attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            if backup_slot is not None:
+                backup_slot.release()
+
+    def _finish_timings(self, task_id: str, operation_name: str, status: str, timings: Dict[str, float],
+                        started: float, span, attempt_number: int):
+        """Фиксирует время по фазам: в span, гистограммы OTel и self.task_timings"""
+        timings["total"] = time.perf_counter() - started
+        attributes = {"operation": operation_name}
+        task_duration_histogram.record(timings["total"], {**attributes, "status": status})
+        TASK_DURATION.observe(timings["total"], operation=operation_name, status=status)
+        task_queue_wait_histogram.record(timings["queue_wait"], attributes)
+        task_execution_histogram.record(timings["operation"], attributes)
+        for phase in TASK_PHASES:
+            task_phase_histogram.record(timings[phase], {**attributes, "phase": phase})
+            span.set_attribute(f"task.time.{phase}", timings[phase])
+        for phase, value in timings.items():
+            timings[phase] = round(value, 6)
+        self.task_timings[task_id] = timings
+        self.task_attempts[task_id] = attempt_number
+
+    async def _move_output(self, task_id: str, source_path: str) -> str:
+        """Переносит файл-результат операции в папку DAG (в том числе с другого диска)"""
+        name = os.path.basename(source_path)
+        new_path = os.path.join(self.dag_path, name)
+        if os.path.exists(new_path):
+            # несколько экземпляров задачи пишут файл с одинаковым именем
+            new_path = os.path.join(self.dag_path, f"{task_id}_{name}")
+        return await asyncio.to_thread(move_file, source_path, new_path)
+
+    async def _save_task_state(self, task_id: str, status: str, retry_count=0, error=None):
+        """Переход статуса экземпляра: обновляются только короткие колонки"""
+        started = time.perf_counter()
+        async with self._connection() as db:
+            await db.execute(
+                f"UPDATE {self.dag_id} SET status = ?, error = ?, retry_count = ?, updated_at = ? WHERE task_id = ?",
+                (status, error, retry_count, time.time(), task_id),
+            )
+            await db.commit()
+        self.db_writes += 1
+        DB_WRITE_LATENCY.observe(time.perf_counter() - started, kind="task_state")
+
+    async def _save_task_outcome(self, task_id: str, status: str, params: Dict = None, result=None, error=None,
+                                 retry_count=0, timings=None):
+        """Итог экземпляра: параметры (без секретов) и результат пишутся один раз, здесь"""
+        started = time.perf_counter()
+        params = await self._encode_value(task_id, "params", value_codec.redact_params(params) if params else None)
+        result = await self._encode_value(task_id, "result", result)
+        async with self._connection() as db:
             await db.execute(f'''
-                UPDATE {self.dag_id} 
-                SET status = ?, result = ?, error = ?, params = ?, retry_count = ?, created_at = ?, updated_at = ?
+                UPDATE {self.dag_id}
+                SET status = ?, result = ?, error = ?, params = ?, retry_count = ?, updated_at = ?, timings = ?
                 WHERE task_id = ?
             ''', (
                 status,
-                json.dumps(result),
+                result,
                 error,
-                json.dumps(params),
+                params,
                 retry_count,
                 time.time(),
-                time.time(),
+                json.dumps(timings) if timings else None,
                 task_id
             ))
             await db.commit()
+        self.db_writes += 1
+        DB_WRITE_LATENCY.observe(time.perf_counter() - started, kind="task_outcome")
+
+    async def _encode_value(self, task_id: str, field: str, value):
+        """Значение для колонки params/result: JSON, сжатый BLOB или ссылка на блоб в хранилище артефактов"""
+        if value is None:
+            return None
+        text = json.dumps(value, ensure_ascii=False)
+        if len(text) < value_codec.COMPRESS_THRESHOLD:
+            return text
+        return await asyncio.to_thread(self._pack_value, task_id, field, text)
+
+    def _pack_value(self, task_id: str, field: str, text: str):
+        encoded = value_codec.pack_text(text)
+        if value_codec.needs_spill(encoded):
+            digest = self.artifacts.put_bytes(self.dag_id, f"{task_id}/{field}", encoded)
+            return value_codec.artifact_ref(digest)
+        return encoded
+
+    async def _decode_value(self, stored):
+        if isinstance(stored, bytes) or (stored or "").startswith(value_codec.ARTIFACT_PREFIX):
+            return await asyncio.to_thread(value_codec.decode_value, stored, self.artifacts.read_blob)
+        return value_codec.decode_value(stored)
 
     async def get_dag_status(self):
         """Возвращает статус всех задач (для мониторинга)"""
         status = {}
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(f'SELECT * FROM {self.dag_id}') as cursor:
+        async with self._connection() as db:
+            async with db.execute(
+                    f'SELECT task_id, status, result, error, retry_count, created_at, updated_at FROM {self.dag_id}'
+            ) as cursor:
                 rows = await cursor.fetchall()
                 for row in rows:
                     status[row[0]] = {
                         "status": row[1],
-                        "result": row[2],
+                        "result": await self._decode_value(row[2]),
                         "error": row[3],
                         "retry_count": row[4],
                         "created_at": row[5],
                         "updated_at": row[6]
                     }
         return status
-    def save_dag_data_in_zip(self):
-        shutil.make_archive(self.dag_path, 'zip', self.dag_path)
-        logger.info(f"Данные DAG теперь лежат в {self.dag_path}.zip")
+
+    async def archive_dag_data(self) -> Dict[str, int]:
+        """Переносит файлы DAG в хранилище артефактов и удаляет папку запуска
+
+        Одинаковые файлы разных запусков (конфиг cron-графа, неизменившийся ответ API)
+        хранятся один раз; дальше файлы читаются из хранилища.
+        """
+        started = time.perf_counter()
+        keep_unzipped = RETENTION_POLICY.keep_unzipped
+        archived = await asyncio.to_thread(self.artifacts.ingest_run, self.dag_id, self.dag_path, keep_unzipped)
+        if not keep_unzipped:
+            await asyncio.to_thread(shutil.rmtree, self.dag_path, True)
+        self.archive_bytes = archived["bytes"]
+        ARCHIVE_DURATION.observe(time.perf_counter() - started)
+        ARCHIVE_SIZE.observe(self.archive_bytes)
+        logger.info(
+            f"Файлы DAG {self.dag_id} сохранены в хранилище артефактов: {archived['files']} файлов, "
+            f"{archived['bytes']} байт, новых {archived['stored_bytes']} байт"
+        )
+        return archived
 
 
 
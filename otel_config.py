@@ -1,53 +1,155 @@
 from opentelemetry import trace, metrics
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.sdk.resources import Resource, SERVICE_NAME, SERVICE_VERSION
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
-from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
-from opentelemetry.exporter.otlp.proto.grpc._log_exporter import OTLPLogExporter
-from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
-from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
 import logging
+import os
+import socket
+
+logger = logging.getLogger("taskflow")
+
+EXPORTERS = ("none", "console", "file", "otlp")
+
+_providers = None
+_log_handler = None
 
 
 def configure_opentelemetry(
     service_name: str = "taskflow",
     service_version: str = "1.0.0",
-    otlp_endpoint: str = "http://localhost:4317",
-    insecure: bool = True
+    exporter: str = None,
+    otlp_endpoint: str = None,
+    insecure: bool = True,
+    file_path: str = None,
 ):
+    """Настраивает трейсы, метрики и логи OpenTelemetry
+
+    Экспортер выбирается аргументом или переменной TASKFLOW_TELEMETRY:
+    none - SDK не подключается, API работает как no-op;
+    console - спаны и метрики в stdout;
+    file - JSONL-файл TASKFLOW_TELEMETRY_FILE (по умолчанию ./telemetry/telemetry.jsonl);
+    otlp - OTLP gRPC на OTEL_EXPORTER_OTLP_ENDPOINT.
+    По умолчанию otlp, если задан OTEL_EXPORTER_OTLP_ENDPOINT, иначе none.
+
+    Спаны и логи идут через ограниченные очереди (TASKFLOW_TELEMETRY_QUEUE_SIZE) с
+    фоновой выгрузкой: переполнение и недоступный коллектор только увеличивают
+    счетчики выброшенных записей и не задерживают запросы.
+    """
+    global _providers, _log_handler
+    if _providers is not None:
+        return _providers
+
+    exporter = exporter or os.getenv(
+        "TASKFLOW_TELEMETRY", "otlp" if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") else "none"
+    )
+    if exporter not in EXPORTERS:
+        raise ValueError(f"Unknown telemetry exporter '{exporter}', expected one of {EXPORTERS}")
+    if exporter == "none":
+        logger.info("OpenTelemetry отключена")
+        return None
+
+    # SDK и экспортеры нужны только при настройке, модулям достаточно API
+    # (get_tracer/get_meter) - оно работает через прокси
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource, SERVICE_NAME, SERVICE_VERSION
+    from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
+    from otel_exporters import BoundedSpanProcessor, BoundedLogRecordProcessor, TELEMETRY_STATS
+
     resource = Resource.create({
         SERVICE_NAME: service_name,
         SERVICE_VERSION: service_version,
-        "deployment.environment": "development",
-        "host.name": "localhost",
+        "deployment.environment": os.getenv("TASKFLOW_ENV", "development"),
+        "host.name": socket.gethostname(),
     })
+    queue_options = {
+        "max_queue_size": int(os.getenv("TASKFLOW_TELEMETRY_QUEUE_SIZE", "2048")),
+        "schedule_delay": float(os.getenv("TASKFLOW_TELEMETRY_EXPORT_DELAY", "2")),
+    }
+    export_interval_millis = int(float(os.getenv("TASKFLOW_METRICS_EXPORT_INTERVAL", "15")) * 1000)
+
+    if exporter == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
+
+        span_exporter = ConsoleSpanExporter()
+        metric_exporter = ConsoleMetricExporter()
+        # логи и так пишутся в консоль обработчиком логгера taskflow
+        log_exporter = None
+    elif exporter == "file":
+        from otel_exporters import JsonlWriter, JsonlSpanExporter, JsonlMetricExporter, JsonlLogExporter
+
+        writer = JsonlWriter(file_path or os.getenv("TASKFLOW_TELEMETRY_FILE", "./telemetry/telemetry.jsonl"))
+        span_exporter = JsonlSpanExporter(writer)
+        metric_exporter = JsonlMetricExporter(writer)
+        log_exporter = JsonlLogExporter(writer)
+    else:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+        from opentelemetry.exporter.otlp.proto.grpc._log_exporter import OTLPLogExporter
+
+        endpoint = otlp_endpoint or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4317")
+        # короткий таймаут: при недоступном коллекторе экспорт быстро сдается,
+        # а очередь приостанавливает выгрузку вместо повторных попыток
+        timeout = float(os.getenv("TASKFLOW_TELEMETRY_EXPORT_TIMEOUT", "2"))
+        span_exporter = OTLPSpanExporter(endpoint=endpoint, insecure=insecure, timeout=timeout)
+        metric_exporter = OTLPMetricExporter(endpoint=endpoint, insecure=insecure, timeout=timeout)
+        log_exporter = OTLPLogExporter(endpoint=endpoint, insecure=insecure, timeout=timeout)
 
     # === traces ===
     trace_provider = TracerProvider(resource=resource)
-    trace_exporter = OTLPSpanExporter(endpoint=otlp_endpoint, insecure=insecure)
-    trace_provider.add_span_processor(BatchSpanProcessor(trace_exporter))
+    trace_provider.add_span_processor(BoundedSpanProcessor(span_exporter, **queue_options))
     trace.set_tracer_provider(trace_provider)
 
     # === metrics ===
-    metric_exporter = OTLPMetricExporter(endpoint=otlp_endpoint, insecure=insecure)
-    metric_reader = PeriodicExportingMetricReader(metric_exporter)
+    metric_reader = PeriodicExportingMetricReader(metric_exporter, export_interval_millis=export_interval_millis)
     meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
     metrics.set_meter_provider(meter_provider)
 
+    def observe_telemetry_stats(options):
+        for signal, stats in TELEMETRY_STATS.items():
+            for name, value in stats.items():
+                yield metrics.Observation(value, {"signal": signal, "kind": name})
+
+    metrics.get_meter("taskflow.telemetry").create_observable_counter(
+        "taskflow.telemetry.records", callbacks=[observe_telemetry_stats],
+        description="Записи телеметрии: выгружено, выброшено, упавшие выгрузки",
+    )
+
     # === logs ===
-    logger_provider = LoggerProvider(resource=resource)
-    log_exporter = OTLPLogExporter(endpoint=otlp_endpoint, insecure=insecure)
-    logger_provider.add_log_record_processor(BatchLogRecordProcessor(log_exporter))
+    # обработчик добавляется к логгеру taskflow рядом с консольным, а не заменяет его
+    logger_provider = None
+    if log_exporter is not None:
+        logger_provider = LoggerProvider(resource=resource)
+        logger_provider.add_log_record_processor(BoundedLogRecordProcessor(log_exporter, **queue_options))
+        _log_handler = LoggingHandler(level=logging.INFO, logger_provider=logger_provider)
+        logger.addHandler(_log_handler)
+
+    logger.info(f"OpenTelemetry настроена: {exporter}")
+
+    _providers = (trace_provider, meter_provider, logger_provider)
+    return _providers
+
+
+def shutdown_opentelemetry():
+    """Выгружает остатки телеметрии и останавливает провайдеры"""
+    global _providers, _log_handler
+    if _providers is None:
+        return
+    if _log_handler is not None:
+        logger.removeHandler(_log_handler)
+        _log_handler = None
+    for provider in _providers:
+        if provider is not None:
+            provider.shutdown()
+    _providers = None
 
-    handler = LoggingHandler(level=logging.INFO, logger_provider=logger_provider)
-    logging.basicConfig(level=logging.INFO, handlers=[handler])
 
-    print("OpenTelemetry configured")
+def telemetry_stats():
+    """Счетчики очередей телеметрии (пусто, если SDK не настроен)"""
+    if _providers is None:
+        return {}
+    from otel_exporters import TELEMETRY_STATS
 
-    return trace_provider, meter_provider, logger_provider
+    return {signal: dict(stats) for signal, stats in TELEMETRY_STATS.items()}
 
 
 def get_tracer(name: str):
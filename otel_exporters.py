@@ -0,0 +1,215 @@
+"""
+Процессоры и экспортеры телеметрии, которые не блокируют приложение.
+
+Импортируется только из configure_opentelemetry (тянет OpenTelemetry SDK).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Sequence
+
+from opentelemetry.sdk._logs import LogData, LogRecordProcessor
+from opentelemetry.sdk._logs.export import LogExporter, LogExportResult
+from opentelemetry.sdk.metrics.export import MetricExporter, MetricExportResult, MetricsData
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+logger = logging.getLogger("taskflow")
+
+# счетчики по сигналам: сколько записей выгружено, выброшено из-за переполнения очереди
+# или недоступного экспортера, сколько выгрузок упало
+TELEMETRY_STATS: Dict[str, Dict[str, int]] = {}
+
+
+class BoundedExportQueue:
+    """Ограниченная очередь и фоновый поток, выгружающий ее батчами
+
+    put() никогда не ждет: если очередь полна, запись выбрасывается и учитывается
+    в TELEMETRY_STATS. Если выгрузка упала (коллектор недоступен), экспорт
+    приостанавливается на backoff секунд, а пришедшие за это время записи
+    выбрасываются - без повторных попыток, которые грузили бы CPU.
+    """
+
+    def __init__(self, exporter, signal: str, max_queue_size: int = 2048, max_batch_size: int = 512,
+                 schedule_delay: float = 2.0, backoff: float = 30.0):
+        self.exporter = exporter
+        self.signal = signal
+        self.max_batch_size = max_batch_size
+        self.schedule_delay = schedule_delay
+        self.backoff = backoff
+        self.stats = TELEMETRY_STATS.setdefault(signal, {"exported": 0, "dropped": 0, "failed_exports": 0})
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue_size)
+        self._paused_until = 0.0
+        self._flush_requested = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"taskflow-telemetry-{signal}", daemon=True)
+        self._thread.start()
+
+    def put(self, item: Any):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _take_batch(self) -> list:
+        batch = []
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch: list):
+        if not batch:
+            return
+        if time.monotonic() < self._paused_until:
+            self.stats["dropped"] += len(batch)
+            return
+        try:
+            result = self.exporter.export(batch)
+            ok = getattr(result, "name", None) == "SUCCESS"
+        except Exception as e:
+            logger.debug(f"Экспорт телеметрии ({self.signal}) упал: {e}")
+            ok = False
+        if ok:
+            self.stats["exported"] += len(batch)
+        else:
+            self.stats["failed_exports"] += 1
+            self.stats["dropped"] += len(batch)
+            self._paused_until = time.monotonic() + self.backoff
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self._queue.qsize() < self.max_batch_size:
+                self._flush_requested.wait(self.schedule_delay)
+            self._flush_requested.clear()
+            while not self._queue.empty():
+                self._export(self._take_batch())
+                if self._queue.qsize() < self.max_batch_size:
+                    break
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        deadline = time.monotonic() + timeout_millis / 1000
+        self._flush_requested.set()
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self._queue.empty()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._flush_requested.set()
+        self._thread.join(timeout=5)
+        # одна последняя попытка выгрузить остаток
+        while not self._queue.empty():
+            self._export(self._take_batch())
+        self.exporter.shutdown()
+
+
+class BoundedSpanProcessor(SpanProcessor):
+    """SpanProcessor поверх BoundedExportQueue"""
+
+    def __init__(self, exporter: SpanExporter, **options):
+        self.queue = BoundedExportQueue(exporter, "spans", **options)
+
+    def on_start(self, span, parent_context=None):
+        pass
+
+    def on_end(self, span: ReadableSpan):
+        if span.context is not None and span.context.trace_flags.sampled:
+            self.queue.put(span)
+
+    def shutdown(self):
+        self.queue.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.queue.force_flush(timeout_millis)
+
+
+class BoundedLogRecordProcessor(LogRecordProcessor):
+    """LogRecordProcessor поверх BoundedExportQueue"""
+
+    def __init__(self, exporter: LogExporter, **options):
+        self.queue = BoundedExportQueue(exporter, "logs", **options)
+
+    def on_emit(self, log_data: LogData):
+        self.queue.put(log_data)
+
+    def shutdown(self):
+        self.queue.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.queue.force_flush(timeout_millis)
+
+
+# --------------------
+# JSONL-файл
+# --------------------
+
+class JsonlWriter:
+    """Общий файл телеметрии: одна JSON-запись на строку, запись из потоков экспорта"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._users = 0
+
+    def write(self, signal: str, records: Sequence[str]):
+        with self._lock:
+            for record in records:
+                self._file.write(json.dumps({"signal": signal, **json.loads(record)}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def acquire(self) -> "JsonlWriter":
+        self._users += 1
+        return self
+
+    def release(self):
+        self._users -= 1
+        if self._users == 0:
+            self._file.close()
+
+
+class JsonlSpanExporter(SpanExporter):
+    def __init__(self, writer: JsonlWriter):
+        self.writer = writer.acquire()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        self.writer.write("span", [span.to_json(indent=None) for span in spans])
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        self.writer.release()
+
+
+class JsonlLogExporter(LogExporter):
+    def __init__(self, writer: JsonlWriter):
+        self.writer = writer.acquire()
+
+    def export(self, batch: Sequence[LogData]) -> LogExportResult:
+        self.writer.write("log", [data.log_record.to_json(indent=None) for data in batch])
+        return LogExportResult.SUCCESS
+
+    def shutdown(self):
+        self.writer.release()
+
+
+class JsonlMetricExporter(MetricExporter):
+    def __init__(self, writer: JsonlWriter):
+        super().__init__()
+        self.writer = writer.acquire()
+
+    def export(self, metrics_data: MetricsData, timeout_millis: float = 10_000, **kwargs) -> MetricExportResult:
+        self.writer.write("metrics", [metrics_data.to_json(indent=None)])
+        return MetricExportResult.SUCCESS
+
+    def force_flush(self, timeout_millis: float = 10_000) -> bool:
+        return True
+
+    def shutdown(self, timeout_millis: float = 30_000, **kwargs):
+        self.writer.release()
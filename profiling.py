@@ -0,0 +1,70 @@
+import io
+import logging
+import os
+import pstats
+from typing import Optional
+
+logger = logging.getLogger("taskflow")
+
+PROFILERS = ("cprofile", "yappi")
+
+# профайлеры глобальны для процесса - одновременно профилируется только один запуск
+_active = None
+
+
+class RunProfiler:
+    """Профилирование одного запуска DAG (ключ "profile" в конфиге)
+
+    "profile": true или "cprofile" - cProfile, только поток event loop;
+    "profile": "yappi" - yappi по wall-time, включая потоки операций (нужен пакет yappi).
+    Профилируется весь процесс: если на том же loop идут другие DAG, они тоже попадут
+    в профиль. Результат - profile.pstats (для snakeviz/pstats) и profile.txt в папке DAG.
+    """
+
+    def __init__(self, kind, dag_id: str):
+        self.kind = "cprofile" if kind is True else kind
+        self.dag_id = dag_id
+        self._profiler = None
+        if self.kind not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{kind}', expected one of {PROFILERS}")
+
+    def start(self) -> bool:
+        global _active
+        if _active is not None:
+            logger.warning(f"Профайлер уже запущен для {_active.dag_id}, {self.dag_id} не профилируется")
+            return False
+        if self.kind == "yappi":
+            import yappi
+
+            yappi.set_clock_type("wall")
+            yappi.start(builtins=False)
+            self._profiler = yappi
+        else:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        _active = self
+        return True
+
+    def stop(self, output_dir: str) -> Optional[str]:
+        """Останавливает профайлер и пишет отчеты в output_dir, возвращает путь к .pstats"""
+        global _active
+        if _active is not self:
+            return None
+        _active = None
+        path = os.path.join(output_dir, "profile.pstats")
+        if self.kind == "yappi":
+            self._profiler.stop()
+            self._profiler.get_func_stats().save(path, type="pstat")
+            self._profiler.clear_stats()
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(path)
+
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats("cumulative").print_stats(50)
+        with open(os.path.join(output_dir, "profile.txt"), "w", encoding="utf-8") as file:
+            file.write(report.getvalue())
+        logger.info(f"Профиль {self.dag_id} сохранен в {path}")
+        return path
@@ -0,0 +1,251 @@
+"""
+Хранение запусков: политики удаления и фоновая уборка.
+
+Политики (RetentionPolicy.from_env):
+TASKFLOW_RETENTION_KEEP_LAST - сколько последних запусков хранить на граф
+(graph_id бота, а без него - dag_name); TASKFLOW_RETENTION_MAX_AGE_DAYS - максимальный
+возраст запуска; TASKFLOW_RETENTION_MAX_BYTES - общий размер архивов (можно 500M, 10G).
+Незаданная политика не применяется.
+
+Уборка (RetentionManager.compact) выполняется в потоке раз в TASKFLOW_RETENTION_INTERVAL
+секунд: снимает ссылки запусков, вышедших за политики, на блобы хранилища
+артефактов и удаляет их таблицы (строка в dag_runs остается с пометкой purged_at -
+история и сводка не теряются), удаляет блобы без ссылок, чистит оставшиеся после
+упавших задач файлы userdata_buffer и переносит zip старых запусков из плоской
+раскладки dags/ в шарды. Размер запуска для TASKFLOW_RETENTION_MAX_BYTES - сумма
+размеров его файлов без учета дедупликации.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import dag_storage
+from artifact_store import ARTIFACTS_ROOT, ArtifactStore
+from run_history import ensure_schema
+
+logger = logging.getLogger("taskflow")
+
+BUFFER_DIR = "./userdata_buffer"
+# сколько запусков удаляется одной транзакцией
+PURGE_BATCH = 500
+
+_SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(value: Optional[str]) -> Optional[int]:
+    """Размер в байтах из строки вида 1048576, 500M, 10G"""
+    if not value:
+        return None
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in _SIZE_UNITS:
+        return int(float(value[:-1]) * _SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def _optional(name: str, cast):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Что и когда удалять; None - политика выключена"""
+    keep_last: Optional[int] = None
+    max_age: Optional[float] = None
+    max_bytes: Optional[int] = None
+    # возраст, после которого файл в userdata_buffer считается брошенным, сек
+    buffer_max_age: float = 3600
+    # оставлять распакованную папку запуска рядом с архивом
+    keep_unzipped: bool = False
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        max_age_days = _optional("TASKFLOW_RETENTION_MAX_AGE_DAYS", float)
+        return cls(
+            keep_last=_optional("TASKFLOW_RETENTION_KEEP_LAST", int),
+            max_age=max_age_days * 86400 if max_age_days else None,
+            max_bytes=parse_size(os.getenv("TASKFLOW_RETENTION_MAX_BYTES")),
+            buffer_max_age=float(os.getenv("TASKFLOW_BUFFER_MAX_AGE", "3600")),
+            keep_unzipped=os.getenv("TASKFLOW_KEEP_UNZIPPED", "0") == "1",
+        )
+
+
+RETENTION_POLICY = RetentionPolicy.from_env()
+
+
+class RetentionManager:
+    """Фоновая уборка запусков по RetentionPolicy"""
+
+    def __init__(self, db_path: str, dags_root: str = dag_storage.DAGS_ROOT, buffer_dir: str = BUFFER_DIR,
+                 policy: RetentionPolicy = RETENTION_POLICY, interval: float = None,
+                 artifacts_root: str = ARTIFACTS_ROOT):
+        self.db_path = db_path
+        self.dags_root = dags_root
+        self.artifacts = ArtifactStore(db_path, artifacts_root)
+        self.buffer_dir = buffer_dir
+        self.policy = policy
+        self.interval = interval if interval is not None else float(os.getenv("TASKFLOW_RETENTION_INTERVAL", "600"))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.error(f"Уборка запусков упала: {e}")
+            await asyncio.sleep(self.interval)
+
+    # --------------------
+    # Уборка (в потоке)
+    # --------------------
+
+    def compact(self) -> Dict[str, int]:
+        """Один проход уборки; возвращает счетчики удаленного"""
+        started = time.perf_counter()
+        stats = {"runs_purged": 0, "bytes_freed": 0, "blobs_removed": 0, "buffer_files": 0, "dirs_removed": 0,
+                 "runs_moved": 0}
+        self._compact_layout(stats)
+        self._purge_expired(stats)
+        blobs, freed = self.artifacts.collect_garbage()
+        stats["blobs_removed"] += blobs
+        stats["bytes_freed"] += freed
+        self._sweep_buffer(stats)
+        if any(stats.values()):
+            logger.info(f"Уборка запусков за {time.perf_counter() - started:.2f}с: {stats}")
+        return stats
+
+    def _expired_query(self) -> Optional[str]:
+        """SELECT dag_id запусков, вышедших хотя бы за одну политику"""
+        policy = self.policy
+        conditions = []
+        if policy.keep_last is not None:
+            conditions.append(f"position > {int(policy.keep_last)}")
+        if policy.max_age is not None:
+            conditions.append(f"started_at < {time.time() - policy.max_age}")
+        if policy.max_bytes is not None:
+            conditions.append(f"total_bytes > {int(policy.max_bytes)}")
+        if not conditions:
+            return None
+        return f'''
+            SELECT dag_id FROM (
+                SELECT dag_id, started_at,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY COALESCE(NULLIF(graph_id, ''), dag_name)
+                        ORDER BY started_at DESC, dag_id DESC
+                    ) AS position,
+                    SUM(COALESCE(archive_bytes, 0)) OVER (
+                        ORDER BY started_at DESC, dag_id DESC
+                    ) AS total_bytes
+                FROM dag_runs
+                WHERE purged_at IS NULL AND status != 'running'
+            )
+            WHERE {" OR ".join(conditions)}
+            LIMIT {PURGE_BATCH}
+        '''
+
+    def _purge_expired(self, stats: Dict[str, int]):
+        query = self._expired_query()
+        if query is None:
+            return
+        ensure_schema(self.db_path)
+        conn = self.artifacts.connect()
+        try:
+            while True:
+                expired = [row[0] for row in conn.execute(query)]
+                if not expired:
+                    break
+                for dag_id in expired:
+                    # блобы освобождаются позже, в collect_garbage, если на них больше никто не ссылается
+                    self.artifacts.release_run(conn, dag_id)
+                    stats["bytes_freed"] += self._remove_run_files(dag_id)
+                    conn.execute(f"DROP TABLE IF EXISTS {dag_id}")
+                conn.executemany(
+                    "UPDATE dag_runs SET purged_at = ?, archive_bytes = 0 WHERE dag_id = ?",
+                    [(time.time(), dag_id) for dag_id in expired],
+                )
+                conn.commit()
+                stats["runs_purged"] += len(expired)
+        finally:
+            conn.close()
+
+    def _remove_run_files(self, dag_id: str) -> int:
+        """Удаляет папку и zip запуска (старые запуски) в обеих раскладках; возвращает освобожденные байты"""
+        freed = 0
+        candidates = (
+            (dag_storage.dag_dir(dag_id, self.dags_root), dag_storage.dag_zip(dag_id, self.dags_root)),
+            dag_storage.legacy_paths(dag_id, self.dags_root),
+        )
+        for path, zip_path in candidates:
+            try:
+                freed += os.path.getsize(zip_path)
+                os.remove(zip_path)
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(path, ignore_errors=True)
+        return freed
+
+    def _compact_layout(self, stats: Dict[str, int]):
+        """Переносит архивы из плоской раскладки в шарды и удаляет папки упакованных запусков"""
+        if not os.path.isdir(self.dags_root):
+            return
+        with os.scandir(self.dags_root) as entries:
+            names = [entry.name for entry in entries]
+        legacy = {name[:-4] if name.endswith(".zip") else name for name in names}
+        for dag_id in legacy:
+            if not dag_storage.is_dag_id(dag_id):
+                continue
+            path, zip_path = dag_storage.legacy_paths(dag_id, self.dags_root)
+            if not os.path.isfile(zip_path):
+                # запуск еще выполняется (или упал до упаковки) - его папку не трогаем
+                continue
+            target = dag_storage.dag_zip(dag_id, self.dags_root)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(zip_path, target)
+            stats["runs_moved"] += 1
+            if os.path.isdir(path) and not self.policy.keep_unzipped:
+                shutil.rmtree(path, ignore_errors=True)
+                stats["dirs_removed"] += 1
+
+        if self.policy.keep_unzipped:
+            return
+        for shard_path in dag_storage.iter_shards(self.dags_root):
+            with os.scandir(shard_path) as entries:
+                shard_names = {entry.name for entry in entries}
+            for name in shard_names:
+                if f"{name}.zip" in shard_names:
+                    shutil.rmtree(os.path.join(shard_path, name), ignore_errors=True)
+                    stats["dirs_removed"] += 1
+
+    def _sweep_buffer(self, stats: Dict[str, int]):
+        """Удаляет файлы userdata_buffer, которые никто не забрал (задача упала)"""
+        if not os.path.isdir(self.buffer_dir):
+            return
+        deadline = time.time() - self.policy.buffer_max_age
+        with os.scandir(self.buffer_dir) as entries:
+            stale: List[str] = [
+                entry.path for entry in entries
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < deadline
+            ]
+        for path in stale:
+            try:
+                os.remove(path)
+                stats["buffer_files"] += 1
+            except FileNotFoundError:
+                pass
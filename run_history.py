@@ -0,0 +1,462 @@
+"""
+История запусков DAG в orchestrator.db.
+
+dag_runs - строка на запуск, task_runs - строка на выполненный экземпляр задачи,
+обе с индексами под выборки по dag_name, графу бота, статусу и времени.
+run_rollups - сводка по (граф, dag_name, тенант, день, задача), которая
+обновляется в той же транзакции, что и завершение запуска: число запусков,
+падений, сумма и максимум длительности и гистограмма длительностей. Статистика
+(успешность, перцентили) считается по сводке, а не по task_runs, поэтому ее
+стоимость зависит от числа дней и задач, а не от числа запусков.
+"""
+import asyncio
+import base64
+import bisect
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger("taskflow")
+
+DEFAULT_TENANT = "default"
+MAX_PAGE_SIZE = 500
+
+# верхние границы бакетов гистограммы длительностей, сек: 1 мс * 1.5^i (до ~15 часов)
+DURATION_BUCKETS = tuple(round(0.001 * 1.5 ** i, 6) for i in range(42))
+# task_id строки сводки, описывающей запуск DAG целиком
+RUN_ROLLUP = ""
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS dag_runs (
+        dag_id TEXT PRIMARY KEY,
+        dag_name TEXT,
+        graph_id TEXT,
+        tenant TEXT,
+        status TEXT,
+        started_at REAL,
+        finished_at REAL,
+        duration REAL,
+        tasks_total INTEGER,
+        tasks_failed INTEGER,
+        error TEXT,
+        archive_bytes INTEGER,
+        purged_at REAL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS dag_runs_started ON dag_runs (started_at, dag_id)",
+    "CREATE INDEX IF NOT EXISTS dag_runs_name ON dag_runs (dag_name, started_at, dag_id)",
+    "CREATE INDEX IF NOT EXISTS dag_runs_graph ON dag_runs (graph_id, started_at, dag_id)",
+    "CREATE INDEX IF NOT EXISTS dag_runs_status ON dag_runs (status, started_at, dag_id)",
+    "CREATE INDEX IF NOT EXISTS dag_runs_tenant ON dag_runs (tenant, started_at, dag_id)",
+    '''
+    CREATE TABLE IF NOT EXISTS task_runs (
+        dag_id TEXT,
+        task_key TEXT,
+        task_id TEXT,
+        dag_name TEXT,
+        graph_id TEXT,
+        operation TEXT,
+        status TEXT,
+        duration REAL,
+        retry_count INTEGER,
+        finished_at REAL,
+        run_time REAL,
+        fingerprint TEXT,
+        PRIMARY KEY (dag_id, task_key)
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS task_runs_name ON task_runs (dag_name, task_id, finished_at)",
+    "CREATE INDEX IF NOT EXISTS task_runs_graph ON task_runs (graph_id, task_id, finished_at)",
+    '''
+    CREATE TABLE IF NOT EXISTS run_rollups (
+        graph_id TEXT,
+        dag_name TEXT,
+        tenant TEXT,
+        day TEXT,
+        task_id TEXT,
+        runs INTEGER,
+        failures INTEGER,
+        duration_sum REAL,
+        duration_max REAL,
+        buckets TEXT,
+        PRIMARY KEY (graph_id, dag_name, tenant, day, task_id)
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS run_rollups_name ON run_rollups (dag_name, day)",
+    "CREATE INDEX IF NOT EXISTS run_rollups_tenant ON run_rollups (tenant, day)",
+)
+
+# колонки, добавленные после появления таблиц: (таблица, колонка, тип)
+MIGRATIONS = (
+    ("dag_runs", "archive_bytes", "INTEGER"),
+    ("dag_runs", "purged_at", "REAL"),
+    ("task_runs", "run_time", "REAL"),
+    ("task_runs", "fingerprint", "TEXT"),
+)
+
+# базы, в которых схема уже создана этим процессом
+_schema_ready = set()
+
+
+def ensure_schema(db_path: str):
+    """Создает таблицы истории и недостающие колонки (синхронно, один раз на процесс)"""
+    if db_path in _schema_ready:
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, column, column_type in MIGRATIONS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        conn.commit()
+    finally:
+        conn.close()
+    _schema_ready.add(db_path)
+
+
+async def _connect(db_path: str) -> aiosqlite.Connection:
+    if db_path not in _schema_ready:
+        await asyncio.to_thread(ensure_schema, db_path)
+    return await aiosqlite.connect(db_path)
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d")
+
+
+def parse_time(value) -> Optional[float]:
+    """Unix-время из числа или ISO-8601 строки (None, если не задано)"""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        parsed = datetime.fromisoformat(str(value))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+# --------------------
+# Запись
+# --------------------
+
+async def record_run_started(db_path: str, dag_id: str, dag_config: Dict, started_at: float):
+    """Заводит запуск в dag_runs со статусом running"""
+    db = await _connect(db_path)
+    try:
+        await db.execute('''
+            INSERT INTO dag_runs (dag_id, dag_name, graph_id, tenant, status, started_at)
+            VALUES (?, ?, ?, ?, 'running', ?)
+            ON CONFLICT (dag_id) DO UPDATE SET status = 'running', finished_at = NULL, error = NULL
+        ''', (
+            dag_id,
+            dag_config.get("dag_name", ""),
+            dag_config.get("graph_id", ""),
+            dag_config.get("tenant") or DEFAULT_TENANT,
+            started_at,
+        ))
+        await db.commit()
+    finally:
+        await db.close()
+
+
+def _merge_buckets(stored: Optional[str], durations: Iterable[float]) -> str:
+    counts = json.loads(stored) if stored else [0] * (len(DURATION_BUCKETS) + 1)
+    for duration in durations:
+        counts[bisect.bisect_left(DURATION_BUCKETS, duration)] += 1
+    return json.dumps(counts)
+
+
+async def record_run_finished(db_path: str, dag_id: str, dag_config: Dict, started_at: float, status: str,
+                              tasks: List[Dict], error: Optional[str] = None, archive_bytes: int = 0):
+    """Завершает запуск: строка dag_runs, строки task_runs и инкремент сводки - одной транзакцией
+
+    tasks - выполнявшиеся экземпляры: {key, task_id, operation, status, duration, retry_count, run_time,
+    fingerprint}; run_time - время в операции, без ожидания слота и пауз между попытками (None - результат
+    взят из прошлого запуска), fingerprint - хэш операции и входов задачи (incremental).
+    """
+    finished_at = time.time()
+    dag_name = dag_config.get("dag_name", "")
+    graph_id = dag_config.get("graph_id", "")
+    tenant = dag_config.get("tenant") or DEFAULT_TENANT
+    day = _day(started_at)
+
+    # (task_id) -> [запуски, падения, длительности]; RUN_ROLLUP - DAG целиком
+    increments = {RUN_ROLLUP: [1, int(status != "completed"), [finished_at - started_at]]}
+    for task in tasks:
+        entry = increments.setdefault(task["task_id"], [0, 0, []])
+        entry[0] += 1
+        entry[1] += int(task["status"] != "completed")
+        entry[2].append(task["duration"])
+
+    db = await _connect(db_path)
+    try:
+        await db.execute('''
+            UPDATE dag_runs SET status = ?, finished_at = ?, duration = ?, tasks_total = ?, tasks_failed = ?,
+                error = ?, archive_bytes = ?
+            WHERE dag_id = ?
+        ''', (
+            status, finished_at, finished_at - started_at, len(tasks),
+            sum(task["status"] != "completed" for task in tasks), error, archive_bytes, dag_id,
+        ))
+        await db.executemany('''
+            INSERT OR REPLACE INTO task_runs
+            (dag_id, task_key, task_id, dag_name, graph_id, operation, status, duration, retry_count, finished_at,
+             run_time, fingerprint)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (dag_id, task["key"], task["task_id"], dag_name, graph_id, task["operation"], task["status"],
+             task["duration"], task["retry_count"], finished_at, task.get("run_time"), task.get("fingerprint"))
+            for task in tasks
+        ])
+
+        async with db.execute('''
+            SELECT task_id, buckets FROM run_rollups WHERE graph_id = ? AND dag_name = ? AND tenant = ? AND day = ?
+        ''', (graph_id, dag_name, tenant, day)) as cursor:
+            stored = dict(await cursor.fetchall())
+        await db.executemany('''
+            INSERT INTO run_rollups
+            (graph_id, dag_name, tenant, day, task_id, runs, failures, duration_sum, duration_max, buckets)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (graph_id, dag_name, tenant, day, task_id) DO UPDATE SET
+                runs = runs + excluded.runs,
+                failures = failures + excluded.failures,
+                duration_sum = duration_sum + excluded.duration_sum,
+                duration_max = MAX(duration_max, excluded.duration_max),
+                buckets = excluded.buckets
+        ''', [
+            (graph_id, dag_name, tenant, day, task_id, runs, failures, sum(durations), max(durations),
+             _merge_buckets(stored.get(task_id), durations))
+            for task_id, (runs, failures, durations) in increments.items()
+        ])
+        await db.commit()
+    finally:
+        await db.close()
+
+
+# --------------------
+# Чтение
+# --------------------
+
+def _encode_cursor(started_at: float, dag_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([started_at, dag_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        started_at, dag_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(started_at), str(dag_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+
+def _filters(dag_name=None, graph_id=None, tenant=None) -> Tuple[List[str], List]:
+    conditions, args = [], []
+    for column, value in (("dag_name", dag_name), ("graph_id", graph_id), ("tenant", tenant)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            args.append(value)
+    return conditions, args
+
+
+async def list_runs(db_path: str, dag_name=None, graph_id=None, tenant=None, status=None, since=None, until=None,
+                    limit: int = 50, cursor: Optional[str] = None) -> Dict:
+    """Запуски от новых к старым с keyset-пагинацией по (started_at, dag_id)
+
+    Возвращает {"runs": [...], "next_cursor": str | None}; next_cursor передается
+    в следующий запрос как cursor. Время - unix-секунды.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    conditions, args = _filters(dag_name, graph_id, tenant)
+    if status is not None:
+        conditions.append("status = ?")
+        args.append(status)
+    if since is not None:
+        conditions.append("started_at >= ?")
+        args.append(since)
+    if until is not None:
+        conditions.append("started_at < ?")
+        args.append(until)
+    if cursor:
+        conditions.append("(started_at, dag_id) < (?, ?)")
+        args.extend(_decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    db = await _connect(db_path)
+    try:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+                f"SELECT * FROM dag_runs {where} ORDER BY started_at DESC, dag_id DESC LIMIT ?", (*args, limit + 1)
+        ) as rows:
+            runs = [dict(row) for row in await rows.fetchall()]
+    finally:
+        await db.close()
+
+    next_cursor = None
+    if len(runs) > limit:
+        runs = runs[:limit]
+        next_cursor = _encode_cursor(runs[-1]["started_at"], runs[-1]["dag_id"])
+    return {"runs": runs, "next_cursor": next_cursor}
+
+
+async def get_run(db_path: str, dag_id: str) -> Optional[Dict]:
+    """Запуск и его экземпляры задач из task_runs"""
+    db = await _connect(db_path)
+    try:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("SELECT * FROM dag_runs WHERE dag_id = ?", (dag_id,)) as rows:
+            run = await rows.fetchone()
+        if run is None:
+            return None
+        async with db.execute(
+                "SELECT * FROM task_runs WHERE dag_id = ? ORDER BY finished_at, task_key", (dag_id,)
+        ) as rows:
+            tasks = [dict(row) for row in await rows.fetchall()]
+    finally:
+        await db.close()
+    return {**dict(run), "tasks": tasks}
+
+
+async def recent_task_durations(db_path: str, dag_name: str = None, graph_id: str = None,
+                                limit: int = 100) -> Dict[str, List[float]]:
+    """Время в операции последних limit успешных выполнений каждой задачи графа (graph_id, без него - dag_name)
+
+    Возвращает {task_id: [секунды, по возрастанию]}; экземпляры sweep и mapped-задач
+    считаются выполнениями своей задачи.
+    """
+    column, value = ("graph_id", graph_id) if graph_id else ("dag_name", dag_name or "")
+    db = await _connect(db_path)
+    try:
+        async with db.execute(f'''
+            SELECT task_id, run_time FROM (
+                SELECT task_id, run_time, ROW_NUMBER() OVER (PARTITION BY task_id ORDER BY finished_at DESC) AS position
+                FROM task_runs
+                WHERE {column} = ? AND status = 'completed' AND run_time IS NOT NULL
+            )
+            WHERE position <= ?
+        ''', (value, limit)) as rows:
+            durations = {}
+            for task_id, run_time in await rows.fetchall():
+                durations.setdefault(task_id, []).append(run_time)
+    finally:
+        await db.close()
+    for values in durations.values():
+        values.sort()
+    return durations
+
+
+async def reusable_task_runs(db_path: str, dag_name: str = None, graph_id: str = None,
+                             limit: int = 10000) -> Dict[Tuple[str, str], str]:
+    """Где лежат результаты прошлых успешных выполнений задач графа (graph_id, без него - dag_name)
+
+    Возвращает {(ключ экземпляра, fingerprint): dag_id самого свежего запуска}; запуски,
+    удаленные уборкой, не учитываются - их результатов и файлов уже нет.
+    """
+    column, value = ("graph_id", graph_id) if graph_id else ("dag_name", dag_name or "")
+    db = await _connect(db_path)
+    try:
+        async with db.execute(f'''
+            SELECT task_runs.task_key, task_runs.fingerprint, task_runs.dag_id
+            FROM task_runs JOIN dag_runs ON dag_runs.dag_id = task_runs.dag_id
+            WHERE task_runs.{column} = ? AND task_runs.status = 'completed' AND task_runs.fingerprint IS NOT NULL
+                AND dag_runs.purged_at IS NULL
+            ORDER BY task_runs.finished_at DESC
+            LIMIT ?
+        ''', (value, limit)) as rows:
+            runs = {}
+            for task_key, fingerprint, dag_id in await rows.fetchall():
+                runs.setdefault((task_key, fingerprint), dag_id)
+    finally:
+        await db.close()
+    return runs
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль q (0..1) отсортированного списка: линейно между соседними значениями"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def bucket_percentile(counts: List[int], q: float, maximum: float) -> Optional[float]:
+    """Оценка перцентиля q (0..1) по гистограмме: линейно внутри бакета"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            lower = DURATION_BUCKETS[index - 1] if index else 0.0
+            upper = DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else maximum
+            upper = min(upper, maximum)
+            return round(lower + (upper - lower) * (rank - cumulative) / count, 6)
+        cumulative += count
+    return maximum
+
+
+def _summary(runs: int, failures: int, duration_sum: float, duration_max: float, counts: List[int]) -> Dict:
+    return {
+        "runs": runs,
+        "failures": failures,
+        "success_rate": round((runs - failures) / runs, 4) if runs else None,
+        "duration": {
+            "mean": round(duration_sum / runs, 6) if runs else None,
+            "p50": bucket_percentile(counts, 0.5, duration_max),
+            "p90": bucket_percentile(counts, 0.9, duration_max),
+            "p99": bucket_percentile(counts, 0.99, duration_max),
+            "max": round(duration_max, 6) if runs else None,
+        },
+    }
+
+
+async def run_stats(db_path: str, dag_name=None, graph_id=None, tenant=None, since=None, until=None) -> Dict:
+    """Успешность и перцентили длительности запусков и каждой задачи по сводке run_rollups
+
+    Сводка хранится по дням (UTC), поэтому since/until округляются до дня.
+    Перцентили - оценка по бакетам DURATION_BUCKETS (погрешность в пределах бакета, ~50%).
+    """
+    conditions, args = _filters(dag_name, graph_id, tenant)
+    if since is not None:
+        conditions.append("day >= ?")
+        args.append(_day(since))
+    if until is not None:
+        conditions.append("day <= ?")
+        args.append(_day(until))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    db = await _connect(db_path)
+    try:
+        async with db.execute(
+                f"SELECT task_id, runs, failures, duration_sum, duration_max, buckets FROM run_rollups {where}", args
+        ) as rows:
+            rollups = await rows.fetchall()
+    finally:
+        await db.close()
+
+    merged = {}
+    for task_id, runs, failures, duration_sum, duration_max, buckets in rollups:
+        entry = merged.setdefault(task_id, [0, 0, 0.0, 0.0, [0] * (len(DURATION_BUCKETS) + 1)])
+        entry[0] += runs
+        entry[1] += failures
+        entry[2] += duration_sum
+        entry[3] = max(entry[3], duration_max)
+        entry[4] = [a + b for a, b in zip(entry[4], json.loads(buckets))]
+
+    run_entry = merged.pop(RUN_ROLLUP, [0, 0, 0.0, 0.0, [0] * (len(DURATION_BUCKETS) + 1)])
+    return {
+        **_summary(*run_entry),
+        "tasks": {task_id: _summary(*entry) for task_id, entry in sorted(merged.items())},
+    }
@@ -0,0 +1,80 @@
+"""
+Кодирование параметров и результатов задач для колонок params/result.
+
+Маленькие значения (меньше TASKFLOW_VALUE_COMPRESS_BYTES, 1 КБ) хранятся как
+JSON-текст. Большие сжимаются (zstd, если установлен zstandard, иначе zlib) и
+хранятся как BLOB с байтом-меткой кодека. Сжатые значения больше
+TASKFLOW_VALUE_SPILL_BYTES (256 КБ) уходят в хранилище артефактов, а в колонке
+остается ссылка "@artifact:<sha256>" - JSON-текст не может начинаться с "@".
+"""
+import json
+import os
+import re
+import zlib
+from typing import Any, Callable, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен
+    zstandard = None
+
+COMPRESS_THRESHOLD = int(os.getenv("TASKFLOW_VALUE_COMPRESS_BYTES", "1024"))
+SPILL_THRESHOLD = int(os.getenv("TASKFLOW_VALUE_SPILL_BYTES", str(256 * 1024)))
+
+ZLIB = b"\x01"
+ZSTD = b"\x02"
+ARTIFACT_PREFIX = "@artifact:"
+
+# параметры с секретами (токены ботов, пароли) не сохраняются в БД
+SECRET_PARAM = re.compile(r"token|password|secret|api_key|apikey", re.IGNORECASE)
+REDACTED = "***"
+
+
+def redact_params(params: dict) -> dict:
+    """Копия параметров, в которой значения секретов заменены на ***"""
+    return {key: REDACTED if SECRET_PARAM.search(key) and value else value for key, value in params.items()}
+
+
+def encode_value(value: Any) -> Union[str, bytes]:
+    """JSON-текст или сжатый BLOB (с меткой кодека)"""
+    return pack_text(json.dumps(value, ensure_ascii=False))
+
+
+def pack_text(text: str) -> Union[str, bytes]:
+    """Сжимает уже сериализованный JSON, если он не меньше COMPRESS_THRESHOLD"""
+    if len(text) < COMPRESS_THRESHOLD:
+        return text
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        return ZSTD + zstandard.ZstdCompressor(level=3).compress(raw)
+    return ZLIB + zlib.compress(raw, 6)
+
+
+def needs_spill(encoded: Union[str, bytes]) -> bool:
+    return isinstance(encoded, bytes) and len(encoded) >= SPILL_THRESHOLD
+
+
+def artifact_ref(digest: str) -> str:
+    return ARTIFACT_PREFIX + digest
+
+
+def decode_value(stored: Optional[Union[str, bytes]], read_blob: Callable[[str], Optional[bytes]] = None) -> Any:
+    """Обратное к encode_value; read_blob(sha256) читает вынесенное в хранилище артефактов значение"""
+    if stored is None:
+        return None
+    if isinstance(stored, str):
+        if not stored.startswith(ARTIFACT_PREFIX):
+            return json.loads(stored)
+        if read_blob is None:
+            raise ValueError(f"Value is stored in artifact store: {stored}")
+        stored = read_blob(stored[len(ARTIFACT_PREFIX):])
+        if stored is None:
+            raise ValueError("Spilled value is missing from artifact store")
+    codec, payload = stored[:1], stored[1:]
+    if codec == ZLIB:
+        return json.loads(zlib.decompress(payload))
+    if codec == ZSTD:
+        if zstandard is None:
+            raise ValueError("Value is compressed with zstd, install zstandard to read it")
+        return json.loads(zstandard.ZstdDecompressor().decompress(payload))
+    raise ValueError(f"Unknown value codec {codec!r}")